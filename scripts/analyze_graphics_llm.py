@@ -7,15 +7,41 @@
 Вызов API — по логике из api_example.py (Yandex Eliza / OpenAI-совместимый).
 """
 import argparse
-import base64
+import copy
+import itertools
 import json
 import os
+import random
+import socket
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import Any, List, Optional
+from typing import Any, Callable, List, Optional, Sequence, Set, Tuple, Union
 import warnings
 warnings.filterwarnings("ignore")
 import requests
+
+from vision_cache import CACHE_PATH, DEFAULT_MAX_BYTES, VisionCache, sha256_file, sha256_hex
+from vision_http import chat_body, configure_session, http_session
+from compact_prompt import compact_prompt, expand_graphs
+from detect_page_regions import regions_dir_for
+from extract_text_layer import OUT_DIR_COVERAGE as TEXT_DIR_COVERAGE
+from extract_text_layer import OUT_DIR_WITHOUT as TEXT_DIR_WITHOUT
+from extract_text_layer import load_text_layer, overlay_text_layer
+from glyph_ocr import OUT_DIR_COVERAGE as OCR_DIR_COVERAGE
+from glyph_ocr import OUT_DIR_WITHOUT as OCR_DIR_WITHOUT
+from glyph_ocr import accuracy_problem
+from merge_graphics_llm import merge_graph
+from optimize_payload import optimized_path
+from self_consistency import DEFAULT_MARGIN, run_vote, vote_summary
+from model_cascade import (
+    CHEAP_MODEL, PARTIAL_INTRO, STATS_INTRO, VISION_FIELDS, TierStats, apply_fields, expected_graphs, focused_prompt,
+    run_cascade,
+)
+from vision_json import SCHEMA_NOTE, JsonArrayStream, missing_keys, parse_graphs, prompt_template, response_format, start_error
+from vision_metrics import METRICS_PATH, CallRecorder, MetricsStore, error_outcome, percentile, prompt_version
+from vision_journal import DEFAULT_LEASE_S, DONE_STATES, HTTP_FAILED, IN_FLIGHT, JOURNAL_PATH, OK, PARSE_FAILED, PENDING, JobJournal, scope_for
 os.environ["ELIZA_TOKEN"] = 'y1__xCO5uSRpdT-ARiuKyCNuNgCfT9dyn8T_pEyXKpRdI4xPCSSwIg'
 PROJECT_ROOT = Path(__file__).resolve().parent.parent
 API_URL = "https://api.eliza.yandex.net/openai/v1/chat/completions"
@@ -144,87 +170,541 @@ PROMPT_COVERAGE = """На изображении — страница с гра
 - Числа в structured_log_metrics — только числа (float), даты и время — строки.
 - Ответ — только JSON-массив, начинается с [ и заканчивается ]."""
 
+# Парный режим: одна и та же страница «без покрытия» и «с покрытием» в одном запросе.
+# Модель сама сопоставляет графики двух изображений, ответ сразу раскладывается в формат graphics_merged.json.
+PROMPT_PAIRED = """Тебе даны два изображения одной и той же страницы приложения с графиками ЯМР (спад свободной индукции, ССИ):
+1) первое изображение — вариант «без покрытия» (заголовок с образцом, индексом кристалличности K1 и протонной плотностью Pr1, графики, подпись к иллюстрации);
+2) второе изображение — вариант «с покрытием» (общий заголовок приложения; для каждого графика — заголовок с K2 и Pr2, график, под ним **панель лога** и **строка состояния**, подпись).
 
-def call_vision_api(image_path: Path, token: str, model: str = MODEL, prompt: str = PROMPT) -> dict:
-    """Отправить изображение и промпт в API, вернуть ответ API (dict)."""
-    with open(image_path, "rb") as f:
-        b64 = base64.b64encode(f.read()).decode("ascii")
-    image_url = f"data:image/png;base64,{b64}"
-
-    payload = {
-        "model": model,
-        "messages": [
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": prompt},
-                    {
-                        "type": "image_url",
-                        "image_url": {"url": image_url},
-                    },
-                ],
-            }
-        ],
+На обоих изображениях графики идут в одном порядке: первый график первого изображения соответствует первому графику второго и т.д. Сопоставь их по порядку и по номеру образца/иллюстрации.
+
+Верни **строго один JSON-массив** без обёртки в markdown. Каждый элемент — одна пара графиков (graph_id: 1, 2, …):
+
+{
+  "page_context": { "title": "<полный заголовок приложения вверху второго изображения>" },
+  "graph_id": <номер графика на странице, 1 или 2>,
+  "without_coverage": {
+    "header_data": {
+      "full_text": "<заголовок над графиком на первом изображении>",
+      "structured_metrics": { "sample_reference": "<ссылка на образец>", "crystallinity_index": <K1, число>, "proton_density": <Pr1, число> }
+    },
+    "graph_statistics": {
+      "axes": {
+        "y_axis": { "label": "<подпись>", "visible_min": <число или null>, "visible_max": <число или null>, "step_interval": <число или null> },
+        "x_axis": { "label": "<подпись>", "visible_min": <число или null>, "visible_max": <число или null>, "step_interval": <число или null> }
+      },
+      "y_metrics_max": { "red": <число или null>, "blue": <число или null>, "green": <число или null> },
+      "visible_tabs": ["<вкладка>", ...]
+    },
+    "caption_data": {
+      "illustration_number": "<номер иллюстрации>",
+      "full_text": "<полный текст подписи>",
+      "structured_details": { "object_type": "<тип>", "source_item": "<источник>", "investigation_object": "<объект>", "condition": "<условие>" }
+    }
+  },
+  "with_coverage": {
+    "header_data": {
+      "full_text": "<заголовок над графиком на втором изображении>",
+      "structured_metrics": { "sample_reference": "<ссылка на образец>", "crystallinity_index": <K2, число>, "proton_density": <Pr2, число> }
+    },
+    "log_panel_data": {
+      "timestamp": "<ЧЧ:ММ:СС>",
+      "raw_lines": ["<строка 1 лога>", ...],
+      "structured_log_metrics": {
+        "research_date": "<ДД.ММ.ГГГГ>",
+        "relaxation_time_short_component_mks": <число>,
+        "relaxation_time_long_component_mks": <число>,
+        "amplitude_short_component_au": <число>,
+        "amplitude_long_component_au": <число>,
+        "calculated_crystallinity_index": <число>,
+        "calculated_proton_density": <число>
+      }
+    },
+    "status_bar_data": { "urtb": "<значение>", "adc": "<значение>", "base_offset": "<значение>", "operation": "<текст>", "numeric_values": "<числа через пробел>" },
+    "caption_data": {
+      "illustration_number": "<номер иллюстрации>",
+      "full_text": "<полный текст подписи>",
+      "structured_details": { "object_type": "<тип>", "source_item": "<источник>", "investigation_object": "<объект>", "condition": "<условие>" }
     }
+  }
+}
+
+Правила:
+- K1/Pr1 читай только с первого изображения, K2/Pr2 — только со второго; не переноси числа между изображениями.
+- page_context указывай в первом элементе массива.
+- Числа — только числа (float), даты и время — строки. Если блока нет — пустые строки или null.
+- Ответ — только JSON-массив, начинается с [ и заканчивается ]."""
+
+
+# Добавка к промпту для режима --crops: вместо страницы отправляется полоса текстовых фрагментов
+# (detect_page_regions.py), поле графика не передаётся — оси и кривые оцифровываются локально.
+CROPS_NOTE = """
+
+Важно: вместо целой страницы на изображении — полоса из вырезанных текстовых фрагментов страницы, сверху вниз: заголовок приложения (если есть), затем для каждого графика — строка заголовка (образец, индекс кристалличности, протонная плотность), панель лога и строка состояния (если есть), подпись к иллюстрации. Сами поля графиков не переданы: в graph_statistics.axes и y_metrics_max укажи null, visible_tabs — []. Номер графика (graph_id) — порядковый номер строки заголовка в полосе."""
+
+
+def call_vision_api(
+    image_path: Union[Path, Sequence[Path]],
+    token: str,
+    model: str = MODEL,
+    prompt: str = PROMPT,
+    api_url: str = API_URL,
+    schema: Optional[dict] = None,
+    stream: bool = False,
+    on_graph: Optional[Callable[[dict], None]] = None,
+    sent: Optional[dict] = None,
+) -> dict:
+    """
+    Отправить изображение (или несколько изображений в одном сообщении) и промпт в API, вернуть ответ API (dict).
+    schema — параметр response_format (vision_json.response_format), если нужен строгий JSON по схеме.
+    stream — читать ответ по мере генерации (SSE, см. read_stream); on_graph получает каждый график,
+    как только закрылась его скобка. В sent (если передан) записывается размер тела запроса request_bytes.
+    """
+    image_paths = [image_path] if isinstance(image_path, Path) else list(image_path)
+
+    extra: dict = {}
+    if schema is not None:
+        extra["response_format"] = schema
+    if stream:
+        extra["stream"] = True
+        extra["stream_options"] = {"include_usage": True}
+    # Тело собирается потоком (base64 PNG кодируется кусками при отправке), соединение — из общего пула
+    body = chat_body(model, prompt, image_paths, **extra)
+    if sent is not None:
+        sent["request_bytes"] = len(body)
     headers = {
         "authorization": f"OAuth {token}",
         "content-type": "application/json",
     }
-    r = requests.post(API_URL, json=payload, headers=headers, timeout=120, verify=False)
-    r.raise_for_status()
-    return r.json()
+    if not stream:
+        r = http_session().post(api_url, data=body, headers=headers, timeout=120, verify=False)
+        r.raise_for_status()
+        return r.json()
+    # При потоке таймаут чтения — пауза между кусками ответа, а не время всего ответа
+    r = http_session().post(api_url, data=body, headers=headers, timeout=(10, STREAM_IDLE_TIMEOUT), verify=False, stream=True)
+    try:
+        r.raise_for_status()
+        return read_stream(r, model, on_graph)
+    finally:
+        r.close()
 
 
-def parse_response_json(text: str) -> Optional[List[Any]]:
-    """Из ответа модели извлечь JSON-массив (убрать обёртку ```json ... ``` при наличии)."""
-    raw = text.strip()
-    for prefix in ("```json\n", "```json\r\n", "```\n"):
-        if raw.startswith(prefix):
-            raw = raw[len(prefix):]
-            break
-    for suffix in ("\n```", "\r\n```"):
-        if raw.endswith(suffix):
-            raw = raw[: -len(suffix)]
+STREAM_IDLE_TIMEOUT = 30
+
+
+class StreamAborted(RuntimeError):
+    """Потоковый ответ прерван досрочно: по началу видно, что это не JSON-массив графиков, или поток оборвался."""
+
+
+def read_stream(response, model: str, on_graph: Optional[Callable[[dict], None]] = None) -> dict:
+    """
+    Собрать потоковый ответ chat completions (строки «data: {...}», конец — «data: [DONE]») в тот же
+    вид, что у обычного ответа. Текст разбирается по мере прихода (vision_json.JsonArrayStream):
+    каждый закрывшийся график сразу передаётся в on_graph. Если начало ответа — не JSON
+    (vision_json.start_error), соединение закрывается и поднимается StreamAborted; им же
+    становится недописанная или испорченная строка data: (обрыв посреди события).
+    """
+    parser = JsonArrayStream()
+    parts: List[str] = []
+    usage = None
+    model_name = model
+    t0 = time.monotonic()
+    first_graph_s = None
+    finished = False
+    # Байты, а не decode_unicode: без charset в content-type requests декодирует
+    # text/event-stream как ISO-8859-1, и кириллица в подписях приходит испорченной
+    for raw in response.iter_lines():
+        try:
+            line = raw.decode("utf-8")
+        except UnicodeDecodeError as e:
+            raise StreamAborted(f"строка потока не в UTF-8: {e}") from e
+        if not line or not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            finished = True
             break
-    raw = raw.strip()
-    if not raw.startswith("["):
-        return None
+        try:
+            chunk = json.loads(data)
+        except json.JSONDecodeError as e:
+            raise StreamAborted(f"событие потока не разбирается как JSON: {e}") from e
+        model_name = chunk.get("model") or model_name
+        usage = chunk.get("usage") or usage
+        for choice in chunk.get("choices") or []:
+            delta = (choice.get("delta") or {}).get("content")
+            if not delta:
+                continue
+            parts.append(delta)
+            if not parser.started:
+                error = start_error(parser.buffer + delta)
+                if error is not None:
+                    raise StreamAborted(error)
+            for graph in parser.feed(delta):
+                if first_graph_s is None:
+                    first_graph_s = time.monotonic() - t0
+                if on_graph is not None and isinstance(graph, dict):
+                    on_graph(graph)
+    if not finished:
+        raise StreamAborted("поток оборвался до data: [DONE]")
+    return {
+        "model": model_name,
+        "choices": [{"message": {"role": "assistant", "content": "".join(parts)}}],
+        "usage": usage,
+        "stream": {"first_graph_s": round(first_graph_s, 3) if first_graph_s is not None else None, "total_s": round(time.monotonic() - t0, 3)},
+    }
+
+
+# Ошибки, после которых имеет смысл повторить запрос: лимит частоты, сбои сервера, таймауты, обрывы соединения
+TRANSIENT_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+def is_transient_error(e: Exception) -> bool:
+    """
+    Временная ли ошибка (повтор может помочь) — 429/5xx, таймаут, обрыв соединения, прерванный
+    или обрезанный поток (StreamAborted из read_stream). Прочие ошибки разбора JSON временными
+    не считаются: повтор того же запроса их не исправит.
+    """
+    if isinstance(e, (requests.Timeout, requests.ConnectionError, StreamAborted)):
+        return True
+    if isinstance(e, requests.HTTPError) and e.response is not None:
+        return e.response.status_code in TRANSIENT_STATUS
+    return False
+
+
+def retry_delay(attempt: int, base: float, max_delay: float, error: Optional[Exception] = None) -> float:
+    """
+    Пауза перед повтором номер attempt (с 0): экспонента с «полным» джиттером,
+    uniform(0, min(max_delay, base * 2**attempt)). Заголовок Retry-After от сервера имеет приоритет.
+    """
+    response = getattr(error, "response", None)
+    if response is not None:
+        retry_after = response.headers.get("retry-after")
+        try:
+            if retry_after is not None:
+                return min(max_delay, float(retry_after))
+        except ValueError:
+            pass
+    return random.uniform(0, min(max_delay, base * (2 ** attempt)))
+
+
+def page_file_done(out_file: Path) -> bool:
+    """Есть ли уже готовый результат страницы (файл без поля error)."""
+    if not out_file.exists():
+        return False
     try:
-        return json.loads(raw)
-    except json.JSONDecodeError:
-        return None
+        with open(out_file, encoding="utf-8") as f:
+            return "error" not in json.load(f)
+    except (json.JSONDecodeError, OSError):
+        return False
+
+
+def parse_response_json(text: str) -> Optional[List[Any]]:
+    """
+    Из ответа модели извлечь JSON-массив графиков: обёртка ```json ... ```, пояснения вокруг,
+    ответ по схеме {"graphs": [...]} и оборванный на середине массив (целые элементы
+    сохраняются, последний достраивается) — см. vision_json.parse_graphs.
+    """
+    return parse_graphs(text)
+
+
+class TokenBucket:
+    """
+    Ограничение частоты запросов (token bucket): rate запросов в секунду в среднем,
+    всплеск до capacity запросов подряд. Потокобезопасен — один экземпляр на весь пул.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = max(float(capacity), 1.0)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Дождаться свободного токена и забрать его. rate <= 0 — без ограничения."""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                wait = (1.0 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def write_json_atomic(path: Path, payload: Any) -> None:
+    """Записать JSON через временный файл и os.replace — читатель никогда не увидит половину файла."""
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+
+
+def paired_to_merged(page: int, graphs: List[Any]) -> List[dict]:
+    """Ответ парного режима → элементы graphs в формате graphics_merged.json (через merge_graph)."""
+    page_context = None
+    if graphs and isinstance(graphs[0], dict) and graphs[0].get("page_context"):
+        page_context = graphs[0]["page_context"]
+    merged = []
+    for i, g in enumerate(graphs):
+        if not isinstance(g, dict):
+            continue
+        gid = g.get("graph_id", i + 1)
+        merged.append({
+            "page": page,
+            "graph_id": gid,
+            **merge_graph(g.get("without_coverage") or {}, g.get("with_coverage"), page_context if i == 0 else None),
+        })
+    return merged
+
+
+def _parses(data: dict) -> bool:
+    """Разбирается ли JSON из ответа API (в том числе из записи кэша)."""
+    completion = data.get("response", data)
+    try:
+        content = completion["choices"][0]["message"]["content"]
+    except (KeyError, IndexError, TypeError):
+        return False
+    return parse_response_json(content or "") is not None
+
+
+def complete_request(
+    image_path: Union[Path, Sequence[Path]],
+    token: str,
+    model: str,
+    prompt: str,
+    api_url: str,
+    cache: Optional[VisionCache],
+    bucket: Optional[TokenBucket],
+    schema: Optional[dict] = None,
+    stream: bool = False,
+    on_graph: Optional[Callable[[dict], None]] = None,
+    metrics: Optional[CallRecorder] = None,
+    sample: int = 0,
+) -> Tuple[dict, bool]:
+    """
+    Ответ модели (choices/usage) из кэша или из API; второй элемент — попадание в кэш.
+    metrics — запись вызова в телеметрию (размер запроса, токены, задержка, исход).
+    sample — номер ответа при голосовании (--vote): у каждого свой ключ кэша.
+    """
+    data = None
+    # Схема меняет форму ответа, поэтому входит в ключ кэша вместе с промптом
+    cache_prompt = prompt if schema is None else prompt + "\n" + json.dumps(schema, sort_keys=True)
+    if sample:
+        cache_prompt += f"\n#sample {sample}"
+    if cache is not None:
+        image_paths = [image_path] if isinstance(image_path, Path) else list(image_path)
+        image_hashes = [sha256_file(p) for p in image_paths]
+        # Для нескольких изображений ключ — хэш от упорядоченного списка их хэшей
+        image_sha256 = image_hashes[0] if len(image_hashes) == 1 else sha256_hex(":".join(image_hashes).encode("ascii"))
+        data = cache.get(image_sha256, cache_prompt, model)
+        # Нераспознанный ответ, сохранённый старой версией, не повторяем — запрашиваем заново
+        if data is not None and not _parses(data):
+            data = None
+    cached = data is not None
+    sent: dict = {}
+    wait = latency = None
+    if data is None:
+        t0 = time.monotonic()
+        if bucket is not None:
+            bucket.acquire()
+        t1 = time.monotonic()
+        wait = t1 - t0
+        try:
+            data = call_vision_api(image_path, token, model, prompt, api_url, schema, stream, on_graph, sent)
+        except Exception as e:
+            if metrics is not None:
+                metrics.record(model, prompt, False, error_outcome(e), None, sent.get("request_bytes"), time.monotonic() - t1, wait)
+            raise
+        latency = time.monotonic() - t1
+    parsed = _parses(data)
+    # В кэш — только разобранные ответы: иначе PARSE_FAILED воспроизводился бы из кэша при каждом перезапуске
+    if not cached and parsed and cache is not None:
+        cache.put(image_sha256, cache_prompt, model, data)
+    completion = data.get("response", data)
+    if "usage" not in completion and data.get("usage"):
+        completion = dict(completion, usage=data["usage"])
+    if metrics is not None:
+        metrics.record(model, prompt, cached, "ok" if parsed else "parse_failed", completion.get("usage"), sent.get("request_bytes"), latency, wait)
+    return completion, cached
+
+
+def analyze_page(
+    page: int,
+    image_path: Union[Path, Sequence[Path]],
+    token: str,
+    model: str,
+    prompt: str,
+    api_url: str = API_URL,
+    cache: Optional[VisionCache] = None,
+    bucket: Optional[TokenBucket] = None,
+    paired: bool = False,
+    schema: Optional[dict] = None,
+    reask: bool = False,
+    reask_note: str = "",
+    stream: bool = False,
+    on_graph: Optional[Callable[[dict], None]] = None,
+    metrics: Optional[CallRecorder] = None,
+    full_prompt: Optional[str] = None,
+    sample: int = 0,
+) -> dict:
+    """
+    Один запрос к vision API по странице (или ответ из кэша); вернуть запись для page_XXX.json.
+    Лимит частоты (bucket) расходуется только на реальные запросы, попадания в кэш бесплатны.
+    reask: если в разобранном ответе нет части ключей шаблона промпта, задать короткий дозапрос
+    только по ним (запись reask в результате) вместо повторной отправки всей страницы.
+    stream/on_graph — потоковый ответ, графики передаются в on_graph по мере готовности (не при попадании в кэш).
+    metrics — телеметрия вызовов (vision_metrics.CallRecorder), включая дозапрос.
+    full_prompt — prompt компактный (compact_prompt.py): ответ с короткими ключами разворачивается
+    в схему full_prompt, по ней же ищутся недостающие ключи.
+    sample — номер ответа при голосовании (self_consistency.run_vote).
+    """
+    completion, cached = complete_request(image_path, token, model, prompt, api_url, cache, bucket, schema, stream, on_graph, metrics, sample)
+    text = completion["choices"][0]["message"]["content"]
+    graphs = parse_response_json(text)
+    if full_prompt is not None and graphs is not None:
+        graphs = expand_graphs(graphs, full_prompt)
+    result = {
+        "page": page,
+        "content": text,
+        "graphs": graphs,
+        "model": completion.get("model", model),
+        "usage": completion.get("usage"),
+        "cached": cached,
+    }
+    if completion.get("stream"):
+        result["stream"] = completion["stream"]
+    missing = missing_keys(graphs, prompt_template(full_prompt or prompt)) if reask else []
+    if missing:
+        extra, extra_cached = complete_request(image_path, token, model, focused_prompt(missing, reask_note), api_url, cache, bucket, stream=stream, metrics=metrics)
+        extra_text = extra["choices"][0]["message"]["content"]
+        result["reask"] = {
+            "missing": missing,
+            "applied": apply_fields(graphs, parse_response_json(extra_text), missing),
+            "content": extra_text,
+            "usage": extra.get("usage"),
+            "cached": extra_cached,
+        }
+    if paired and graphs is not None:
+        result["graphs"] = paired_to_merged(page, graphs)
+    return result
 
 
 def main():
     parser = argparse.ArgumentParser(description="Анализ графиков ЯМР через LLM (vision)")
     parser.add_argument("--coverage", action="store_true", help="Режим «с покрытием»: исходник graphics_pages_coverage, выход graphics_llm_coverage, расширенный JSON (log_panel_data, status_bar_data, page_context)")
+    parser.add_argument("--paired", action="store_true", help="Парный режим: страницы «без покрытия» и «с покрытием» одним запросом; выход graphics_llm_paired в формате graphics_merged.json")
+    parser.add_argument("--crops", action="store_true", help="Отправлять только текстовые фрагменты страницы (page_XXX_text.png из detect_page_regions.py) вместо целой страницы")
+    parser.add_argument("--text-layer", action="store_true", help="Брать поля из текстового слоя PDF (extract_text_layer.py); в API — только страницы, где их не хватает")
+    parser.add_argument("--ocr", action="store_true", help="Брать уверенно прочитанные поля из офлайн-OCR (glyph_ocr.py); в API — только страницы, где их не хватает")
+    parser.add_argument("--no-graph-statistics", action="store_true", help="С --text-layer/--ocr: страницы, где есть все текстовые поля, не отправлять в API совсем (без осей и y_metrics_max)")
     parser.add_argument("--pages", type=str, default=None, help="Номера страниц через запятую, например 1,2,5,10. По умолчанию — все страницы")
     parser.add_argument("--sample", type=int, default=None, help="Взять каждую N-ю страницу (например 10)")
-    parser.add_argument("--delay", type=float, default=1.0, help="Пауза между запросами (сек)")
+    parser.add_argument("--delay", type=float, default=1.0, help="Средний интервал между запросами (сек); задаёт --rate, если тот не указан")
+    parser.add_argument("--rate", type=float, default=None, help="Лимит запросов в секунду (token bucket); 0 — без ограничения")
+    parser.add_argument("--concurrency", type=int, default=1, help="Сколько запросов держать в полёте одновременно (по умолчанию 1 — последовательно)")
+    parser.add_argument("--api-url", type=str, default=os.getenv("ELIZA_API_URL", API_URL), help="Endpoint chat completions (например, локальная заглушка для тестов)")
+    parser.add_argument("--out-dir", type=str, default=None, help="Каталог для page_XXX.json (по умолчанию data/graphics_llm, data/graphics_llm_coverage или data/graphics_llm_paired)")
     parser.add_argument("--force", action="store_true", help="Перезаписать уже сохранённые страницы")
+    parser.add_argument("--no-cache", action="store_true", help="Не читать и не писать кэш ответов (data/vision_cache.sqlite)")
+    parser.add_argument("--cache-path", type=str, default=str(CACHE_PATH), help="Файл кэша ответов")
+    parser.add_argument("--cache-max-mb", type=float, default=DEFAULT_MAX_BYTES / 1024 / 1024, help="Лимит размера кэша, МБ (вытеснение LRU)")
+    parser.add_argument("--retries", type=int, default=4, help="Повторов при временных ошибках (429, 5xx, таймаут)")
+    parser.add_argument("--backoff", type=float, default=2.0, help="Базовая пауза экспоненциального повтора, сек")
+    parser.add_argument("--backoff-max", type=float, default=60.0, help="Максимальная пауза между повторами, сек")
+    parser.add_argument("--journal-path", type=str, default=str(JOURNAL_PATH), help="Журнал заданий (SQLite) для продолжения прерванного прогона")
+    parser.add_argument("--metrics-path", type=str, default=str(METRICS_PATH), help="Телеметрия вызовов (SQLite): размер запроса, токены, задержка, исход; сводка — vision_metrics.py")
+    parser.add_argument("--no-metrics", action="store_true", help="Не писать телеметрию вызовов")
+    parser.add_argument("--worker", nargs="?", const="", default=None, help="Исполнитель общей очереди: страницы забираются из журнала в аренду, можно запускать много процессов и машин (имя по умолчанию — хост:pid)")
+    parser.add_argument("--lease", type=float, default=DEFAULT_LEASE_S, help="Срок аренды страницы исполнителем, с; продлевается каждую треть срока")
     parser.add_argument("--model", type=str, default=os.getenv("ELIZA_MODEL", MODEL), help="Модель vision (по умолчанию: gpt-4o для лучшего чтения осей)")
+    parser.add_argument("--cascade", action="store_true", help="Каскад: сначала --cheap-model, непрошедшие локальную проверку страницы и поля — у --model (model_cascade.py)")
+    parser.add_argument("--json-schema", action="store_true", help="Требовать от модели JSON по схеме (response_format json_schema, строится из шаблона промпта)")
+    parser.add_argument("--no-reask", action="store_true", help="Не дозапрашивать недостающие ключи ответа (по умолчанию — короткий дозапрос только по ним)")
+    parser.add_argument("--stream", action="store_true", help="Потоковый ответ (SSE): графики печатаются по мере готовности, ответ не-JSON прерывается сразу")
+    parser.add_argument("--compact", action="store_true", help="Компактный промпт с короткими ключами (compact_prompt.py); ответ разворачивается в полную схему")
+    parser.add_argument("--vote", type=int, default=0, help="Голосование: до K ответов на страницу, значение полей — по большинству, с ранней остановкой (self_consistency.py)")
+    parser.add_argument("--vote-margin", type=int, default=DEFAULT_MARGIN, help="Отрыв лидера в голосах, при котором поле считается решённым")
+    parser.add_argument("--optimized", action="store_true", help="Отправлять облегчённые изображения страниц из optimize_payload.py (data/graphics_payload*) вместо PNG")
+    parser.add_argument("--cheap-model", type=str, default=os.getenv("ELIZA_CHEAP_MODEL", CHEAP_MODEL), help="Дешёвая модель первого уровня каскада")
     args = parser.parse_args()
     model = args.model or MODEL
+    if args.paired and args.text_layer:
+        parser.error("--text-layer пока не поддерживается вместе с --paired")
+    if args.paired and args.ocr:
+        parser.error("--ocr пока не поддерживается вместе с --paired")
+    if args.text_layer and args.ocr:
+        parser.error("--text-layer и --ocr — разные источники полей, укажите один")
+    if args.paired and args.cascade:
+        parser.error("--cascade пока не поддерживается вместе с --paired")
+    if args.vote and (args.paired or args.cascade):
+        parser.error("--vote пока не поддерживается вместе с --paired и --cascade")
+    if args.worker is not None and args.force:
+        parser.error("--force сбрасывает очередь: выполните его один раз без --worker, затем запускайте исполнителей")
+    if args.compact and (args.paired or args.crops):
+        parser.error("--compact пока не поддерживается вместе с --paired и --crops")
+    if args.optimized and args.crops:
+        parser.error("--optimized выбирает вариант целой страницы и не сочетается с --crops")
 
     token = os.getenv("ELIZA_TOKEN")
     if not token:
         print("Укажите ELIZA_TOKEN в окружении (как в api_example.py).", file=__import__("sys").stderr)
         return 1
 
-    if args.coverage:
-        pages_dir = PROJECT_ROOT / "data" / "graphics_pages_coverage"
+    if args.paired:
+        pages_dirs = [PROJECT_ROOT / "data" / "graphics_pages", PROJECT_ROOT / "data" / "graphics_pages_coverage"]
+        out_dir = PROJECT_ROOT / "data" / "graphics_llm_paired"
+        prompt = PROMPT_PAIRED
+        max_page = 79
+    elif args.coverage:
+        pages_dirs = [PROJECT_ROOT / "data" / "graphics_pages_coverage"]
         out_dir = PROJECT_ROOT / "data" / "graphics_llm_coverage"
         prompt = PROMPT_COVERAGE
         max_page = 80  # coverage может иметь 79 страниц
     else:
-        pages_dir = PROJECT_ROOT / "data" / "graphics_pages"
+        pages_dirs = [PROJECT_ROOT / "data" / "graphics_pages"]
         out_dir = PROJECT_ROOT / "data" / "graphics_llm"
         prompt = PROMPT
         max_page = 79
 
-    if not pages_dir.exists():
-        print(f"Каталог не найден: {pages_dir}. Сначала выполните extract_graphics_pages.py или extract_graphics_pages_coverage.py", file=__import__("sys").stderr)
-        return 1
+    if args.out_dir:
+        out_dir = Path(args.out_dir)
+
+    for pages_dir in pages_dirs:
+        if not pages_dir.exists():
+            print(f"Каталог не найден: {pages_dir}. Сначала выполните extract_graphics_pages.py или extract_graphics_pages_coverage.py", file=__import__("sys").stderr)
+            return 1
+
+    source_dirs = list(pages_dirs)
+    image_name = "page_{:03d}.png"
+    if args.crops:
+        pages_dirs = [regions_dir_for(d) for d in pages_dirs]
+        image_name = "page_{:03d}_text.png"
+        prompt += CROPS_NOTE
+        for regions_dir in pages_dirs:
+            if not regions_dir.exists():
+                print(f"Каталог не найден: {regions_dir}. Сначала выполните detect_page_regions.py", file=__import__("sys").stderr)
+                return 1
+
+    full_prompt = None
+    if args.compact:
+        full_prompt, prompt = prompt, compact_prompt(prompt)
+
+    schema = None
+    if args.json_schema:
+        schema = response_format(prompt)
+        prompt += SCHEMA_NOTE
+    reask_note = CROPS_NOTE if args.crops else ""
+    prompt_name = "paired" if args.paired else "coverage" if args.coverage else "base"
+    prompt_name += "+crops" * args.crops + "+compact" * args.compact + "+schema" * args.json_schema
 
     # Список страниц для обработки
     if args.pages:
@@ -236,37 +716,310 @@ def main():
 
     out_dir.mkdir(parents=True, exist_ok=True)
 
+    journal = JobJournal(Path(args.journal_path))
+    scope = scope_for(out_dir)
+
+    candidates = []
     for page in page_numbers:
         out_file = out_dir / f"page_{page:03d}.json"
-        if out_file.exists() and not args.force:
+        if not args.force and journal.state(scope, page) is None and page_file_done(out_file):
+            # Результат из прогона до появления журнала — считаем страницу готовой
             print(f"Пропуск страницы {page} (уже есть {out_file.name}).")
             continue
-        path = pages_dir / f"page_{page:03d}.png"
-        if not path.exists():
-            print(f"Файл не найден: {path}")
+        missing = [d / image_name.format(page) for d in pages_dirs if not (d / image_name.format(page)).exists()]
+        if missing:
+            print(f"Файл не найден: {missing[0]}")
             continue
-        print(f"Страница {page}...", end=" ", flush=True)
-        try:
-            data = call_vision_api(path, token, model, prompt)
-            completion = data.get("response", data)
-            text = completion["choices"][0]["message"]["content"]
-            graphs = parse_response_json(text)
+        candidates.append(page)
+
+    def job_for(page: int) -> Tuple[int, List[Path], Path]:
+        paths = [d / image_name.format(page) for d in pages_dirs]
+        if args.optimized:
+            optimized = [optimized_path(p) for p in paths]
+            if None in optimized:
+                print(f"Страница {page}: нет актуального варианта optimize_payload.py, отправляется исходный PNG")
+            paths = [o or p for o, p in zip(optimized, paths)]
+        return page, paths, out_dir / f"page_{page:03d}.json"
+
+    # Завершённая в журнале страница без файла результата (его удалили, чтобы переделать страницу) — снова в очередь
+    lost = [
+        page for page in candidates
+        if journal.state(scope, page) in DONE_STATES and not page_file_done(out_dir / f"page_{page:03d}.json")
+    ]
+    journal.enqueue(scope, candidates, force=args.force, redo=lost)
+    worker = None
+    jobs = []
+    if args.worker is not None:
+        # Очередь общая: страницы забираются по одной в run_worker, а не списком заранее
+        worker = args.worker or f"{socket.gethostname()}:{os.getpid()}"
+        journal.register_worker(scope, worker, args.lease)
+    else:
+        todo = set(journal.pending(scope, candidates))
+        for page in candidates:
+            if page not in todo:
+                print(f"Пропуск страницы {page} (в журнале: {journal.state(scope, page)}).")
+                continue
+            jobs.append(job_for(page))
+
+    concurrency = max(1, args.concurrency)
+    configure_session(concurrency)
+    rate = args.rate if args.rate is not None else (1.0 / args.delay if args.delay > 0 else 0.0)
+    bucket = TokenBucket(rate, capacity=concurrency)
+
+    text_dir = None
+    if args.text_layer:
+        text_dir = TEXT_DIR_COVERAGE if args.coverage else TEXT_DIR_WITHOUT
+        if not text_dir.exists():
+            print(f"Каталог не найден: {text_dir}. Сначала выполните extract_text_layer.py", file=__import__("sys").stderr)
+            return 1
+    elif args.ocr:
+        text_dir = OCR_DIR_COVERAGE if args.coverage else OCR_DIR_WITHOUT
+        if not text_dir.exists():
+            print(f"Каталог не найден: {text_dir}. Сначала выполните glyph_ocr.py", file=__import__("sys").stderr)
+            return 1
+        # Без измеренной точности на размеченных страницах поля OCR не заменяют запрос к модели
+        problem = accuracy_problem(text_dir)
+        if problem:
+            print(f"--ocr: {problem}", file=__import__("sys").stderr)
+            return 1
+    text_source = "glyph_ocr" if args.ocr else "text_layer"
+
+    cache = None if args.no_cache else VisionCache(Path(args.cache_path), int(args.cache_max_mb * 1024 * 1024))
+    stats = TierStats({"cheap": args.cheap_model, "strong": model}) if args.cascade else None
+    metrics_store = metrics = None
+    if not args.no_metrics:
+        metrics_store = MetricsStore(Path(args.metrics_path))
+        run_args = {k: v for k, v in vars(args).items() if not k.endswith("_path")}
+        run_id = metrics_store.start_run(scope, run_args)
+        metrics = CallRecorder(metrics_store, run_id, {prompt: prompt_version(prompt_name, prompt)})
+
+    def show_graph(page: int, t0: float, shown: Set[int]):
+        # shown — номера графиков страницы, уже напечатанных: оборванный поток повторяется
+        # с начала, и при повторе те же графики не печатаются второй раз
+        index = itertools.count()
+
+        def on_graph(graph: dict) -> None:
+            i = next(index)
+            if i in shown:
+                return
+            shown.add(i)
+            # В парном режиме у графика две половины; печатаем K1/Pr1
+            header = graph.get("header_data") or (graph.get("without_coverage") or {}).get("header_data") or {}
+            m = header.get("structured_metrics") or {}
+            if args.compact:
+                m = {"crystallinity_index": graph.get("K"), "proton_density": graph.get("Pr")}
+            print(
+                f"Страница {page}, график {graph.get('graph_id', graph.get('id'))}: K={m.get('crystallinity_index')}, "
+                f"Pr={m.get('proton_density')} ({time.monotonic() - t0:.1f} с)",
+                flush=True,
+            )
+        return on_graph if args.stream else None
+
+    voted: List[dict] = []
+
+    def run_job(page: int, paths: List[Path], out_file: Path):
+        text_layer = load_text_layer(text_dir, page) if text_dir is not None else None
+        # Все графики страницы найдены в текстовом слое (или OCR); полей может не хватать
+        found = (
+            text_layer is not None and "graphs" not in (text_layer.get("missing_fields") or [])
+            and len(text_layer["graphs"]) >= expected_graphs(source_dirs[0] / f"page_{page:03d}.png")
+        )
+        missing = list(text_layer.get("missing_fields") or []) if found else []
+        complete = found and not missing
+        stats_prompt = None
+        fields: List[str] = []
+        if found and (missing or not (args.crops or args.no_graph_statistics)):
+            # Текстовые поля есть в PDF (или уверенно прочитаны OCR); у модели спрашиваются
+            # только недостающие из них и оси с максимумами кривых — их нет нигде, кроме изображения
+            fields = list(missing)
+            if not (args.crops or args.no_graph_statistics):
+                fields += [f"{g['graph_id']}:{f}" for g in text_layer["graphs"] for f in VISION_FIELDS]
+            stats_prompt = focused_prompt(fields, note=reask_note, intro=PARTIAL_INTRO if missing else STATS_INTRO)
+        elif complete:
+            # Графики не нужны (или на вырезках их нет) — запрос к модели не нужен
+            journal.start_attempt(scope, page)
             payload = {
                 "page": page,
-                "content": text,
-                "graphs": graphs,
-                "model": completion.get("model", model),
-                "usage": completion.get("usage") or data.get("usage"),
+                "content": "",
+                "graphs": text_layer["graphs"],
+                "model": text_source,
+                "usage": None,
+                "cached": False,
             }
-            with open(out_file, "w", encoding="utf-8") as f:
-                json.dump(payload, f, ensure_ascii=False, indent=2)
-            print("OK" if graphs is not None else "OK (JSON не распарсен)")
-        except Exception as e:
-            print(f"Ошибка: {e}")
-            payload = {"page": page, "error": str(e)}
-            with open(out_file, "w", encoding="utf-8") as f:
-                json.dump(payload, f, ensure_ascii=False, indent=2)
-        time.sleep(args.delay)
+            journal.finish_attempt(scope, page, OK, 0.0, worker=worker)
+            write_json_atomic(out_file, payload)
+            return page, "OK [OCR]" if args.ocr else "OK [текстовый слой]"
+
+        attempt = 0
+        shown: Set[int] = set()
+        while True:
+            journal.start_attempt(scope, page)
+            if metrics is not None:
+                metrics.bind(page, attempt)
+            t0 = time.monotonic()
+            try:
+                if stats_prompt is not None:
+                    payload = analyze_page(
+                        page, paths, token, model, stats_prompt, args.api_url, cache, bucket,
+                        stream=args.stream, metrics=metrics,
+                    )
+                elif stats is not None:
+                    def call(tier_model: str, tier_prompt: str):
+                        started = time.monotonic()
+                        res = analyze_page(
+                            page, paths, token, tier_model, tier_prompt, args.api_url, cache, bucket,
+                            schema=schema if tier_prompt == prompt else None, stream=args.stream,
+                            on_graph=show_graph(page, started, shown) if tier_prompt == prompt else None,
+                            metrics=metrics, full_prompt=full_prompt if tier_prompt == prompt else None,
+                        )
+                        return res, time.monotonic() - started
+
+                    payload = run_cascade(
+                        call, prompt, stats.models, stats, args.coverage,
+                        expected=expected_graphs(source_dirs[0] / f"page_{page:03d}.png"),
+                        check_axes=not args.crops, note=reask_note,
+                    )
+                elif args.vote:
+                    def sample_call(sample: int, attempt: int = attempt) -> dict:
+                        # Ответы идут в потоках голосования — страницу и попытку телеметрии задаём в каждом
+                        if metrics is not None:
+                            metrics.bind(page, attempt)
+                        return analyze_page(
+                            page, paths, token, model, prompt, args.api_url, cache, bucket,
+                            schema=schema, stream=args.stream, on_graph=show_graph(page, t0, shown) if sample == 0 else None,
+                            metrics=metrics, full_prompt=full_prompt, sample=sample,
+                        )
+
+                    payload = run_vote(sample_call, args.vote, args.coverage, args.vote_margin, check_axes=not args.crops)
+                    voted.append(payload)
+                else:
+                    payload = analyze_page(
+                        page, paths, token, model, prompt, args.api_url, cache, bucket, args.paired,
+                        schema=schema, reask=not args.no_reask, reask_note=reask_note,
+                        stream=args.stream, on_graph=show_graph(page, t0, shown), metrics=metrics,
+                        full_prompt=full_prompt,
+                    )
+            except Exception as e:
+                latency = time.monotonic() - t0
+                if is_transient_error(e) and attempt < args.retries:
+                    pause = retry_delay(attempt, args.backoff, args.backoff_max, e)
+                    # Исполнитель очереди держит аренду и на время паузы перед повтором
+                    journal.finish_attempt(scope, page, IN_FLIGHT if worker else PENDING, latency, str(e), worker=worker)
+                    print(f"Страница {page}: {e}; повтор через {pause:.1f} с", flush=True)
+                    time.sleep(pause)
+                    attempt += 1
+                    continue
+                journal.finish_attempt(scope, page, HTTP_FAILED, latency, str(e), worker=worker)
+                if not page_file_done(out_file):
+                    write_json_atomic(out_file, {"page": page, "error": str(e)})
+                return page, f"Ошибка: {e}"
+            latency = time.monotonic() - t0
+            parsed = payload["graphs"] is not None
+            if stats_prompt is not None:
+                # Ответ на короткий запрос — только в спрошенные поля графиков текстового слоя
+                graphs = copy.deepcopy(text_layer["graphs"])
+                payload["focused"] = {"fields": fields, "applied": apply_fields(graphs, payload["graphs"], fields)}
+                payload["graphs"] = graphs
+            elif text_layer is not None:
+                payload["graphs"] = overlay_text_layer(payload["graphs"], text_layer["graphs"], fill_only=args.ocr)
+            owned = journal.finish_attempt(scope, page, OK if parsed else PARSE_FAILED, latency, worker=worker)
+            write_json_atomic(out_file, payload)
+            status = "OK" if parsed else "OK (JSON не распарсен)"
+            if stats_prompt is not None:
+                asked = (f" + {len(missing)} полей" if missing else "") + (" + оси" if len(fields) > len(missing) else "")
+                status += f" [OCR{asked}]" if args.ocr else f" [текстовый слой{asked}]"
+            if not owned:
+                status += " [аренда истекла раньше ответа]"
+            if payload["cached"]:
+                status += " [кэш]"
+            if "reask" in payload:
+                status += f" [дозапрос {len(payload['reask']['applied'])}/{len(payload['reask']['missing'])} ключей]"
+            if "cascade" in payload:
+                status += f" [{payload['cascade']['tier']}]"
+            if "vote" in payload:
+                vote = payload["vote"]
+                status += f" [ответов {vote['samples']}, согласие {vote['agreement_rate']}"
+                status += f", нерешённых {len(vote['unresolved'])}]" if vote["unresolved"] else "]"
+            return page, status
+
+    held: set = set()
+    held_lock = threading.Lock()
+
+    def run_worker() -> None:
+        """Забирать страницы из общей очереди по одной, пока она не опустеет."""
+        while True:
+            claimed = journal.claim(scope, worker, args.lease)
+            if not claimed:
+                return
+            page = claimed[0]
+            with held_lock:
+                held.add(page)
+            try:
+                job = job_for(page)
+                missing = [p for p in job[1] if not p.exists()]
+                if missing:
+                    journal.finish_attempt(scope, page, HTTP_FAILED, None, f"файл не найден: {missing[0]}", worker=worker)
+                    status = f"Файл не найден: {missing[0]}"
+                else:
+                    page, status = run_job(*job)
+            finally:
+                with held_lock:
+                    held.discard(page)
+            print(f"Страница {page}: {status}", flush=True)
+
+    def heartbeat(stop: threading.Event) -> None:
+        while not stop.wait(args.lease / 3):
+            with held_lock:
+                pages = list(held)
+            journal.heartbeat(scope, worker, pages, args.lease)
+
+    rate_text = f"{rate:g} запр/с" if rate > 0 else "без лимита"
+    if worker is not None:
+        counts = journal.counts(scope)
+        print(f"Исполнитель {worker}: в очереди {counts[PENDING]}, в работе у других {counts[IN_FLIGHT]}, аренда {args.lease:g} с, "
+              f"параллельно: {concurrency}, частота: {rate_text}")
+        stop = threading.Event()
+        beat = threading.Thread(target=heartbeat, args=(stop,), daemon=True)
+        beat.start()
+        try:
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                for fut in [pool.submit(run_worker) for _ in range(concurrency)]:
+                    fut.result()
+        finally:
+            stop.set()
+    else:
+        print(f"Страниц к обработке: {len(jobs)}, параллельно: {concurrency}, частота: {rate_text}")
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = [pool.submit(run_job, *job) for job in jobs]
+            for fut in as_completed(futures):
+                page, status = fut.result()
+                print(f"Страница {page}: {status}", flush=True)
+
+    if cache is not None:
+        s = cache.summary()
+        print(f"Кэш ответов: попаданий {s['hits']}, промахов {s['misses']}, вытеснено {s['evictions']}; записей {s['entries']}, {s['bytes'] / 1024:.1f} КБ")
+        cache.close()
+
+    if stats is not None:
+        for line in stats.report_lines():
+            print(line)
+        stats.save(out_dir / "cascade_report.json")
+
+    for line in vote_summary(voted):
+        print(line)
+
+    if metrics_store is not None:
+        metrics_store.finish_run(run_id)
+        latencies = [c["latency_s"] for c in metrics_store.calls(run_id) if not c["cached"] and c["latency_s"] is not None]
+        if latencies:
+            p50, p95, p99 = (percentile(latencies, q) for q in (50, 95, 99))
+            print(f"Телеметрия: прогон {run_id}, вызовов API {len(latencies)}, задержка p50/p95/p99 {p50:.2f}/{p95:.2f}/{p99:.2f} с "
+                  f"(сводка: python scripts/vision_metrics.py --run {run_id})")
+        metrics_store.close()
+
+    counts = journal.counts(scope)
+    print("Журнал: " + ", ".join(f"{state}={n}" for state, n in counts.items() if n))
+    journal.close()
 
     print(f"Результаты по страницам: {out_dir}")
     return 0
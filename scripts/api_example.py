@@ -2,7 +2,8 @@ import os
 import requests
 import base64
 
-url = "https://api.eliza.yandex.net/openai/v1/chat/completions"
+# ELIZA_API_URL — другой endpoint, например локальная заглушка scripts/vision_stub_server.py
+url = os.getenv("ELIZA_API_URL", "https://api.eliza.yandex.net/openai/v1/chat/completions")
 
 with open('image.png', 'rb') as f:
     encoded_image = base64.b64encode(f.read())
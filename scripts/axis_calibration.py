@@ -0,0 +1,745 @@
+#!/usr/bin/env python3
+"""
+Калибровка осей графиков ССИ по пикселям: линии сетки, деления и подписи делений →
+линейное отображение «пиксель → значение оси» для каждой оси.
+
+В ответах vision-модели visible_min / visible_max / step_interval часто null или не совпадают
+с подписями, поэтому и геометрия осей, и значения подписей определяются локально (NumPy):
+  1) рамка — крайние линии сетки на тёмном поле графика;
+  2) подписи делений — зелёные надписи под нижней линией рамки (ось X) и слева от левой (ось Y);
+     центр подписи привязывается к ближайшей линии сетки — это и есть деление;
+  3) подписи читаются по шаблонам цифр (glyph_ocr.GlyphTemplates, шрифт «tick»); «-» и «.»
+     узнаются по форме (одна-две строки чернил);
+  4) по прочитанным подписям (пиксель, значение) методом наименьших квадратов подбирается
+     value = a * px + b; подпись, не ложащаяся на прямую (ошибка чтения), отбрасывается.
+
+Шаблоны цифр строятся без эталона (--bootstrap): символы подписей оси X кластеризуются по
+корреляции, а цифры кластеров находятся из того, что подписи оси X — арифметическая
+прогрессия от 0 (0, s, 2s, …): для каждой оси перебирается шаг s, и принимается единственный,
+при котором число символов всех подписей совпало и каждый кластер получил одну цифру.
+
+Диапазоны осей из ответа vision-модели (--check-llm) только сверяются с прочитанными
+подписями — в калибровку они не входят.
+
+Геометрия кэшируется по дешёвому отпечатку раскладки, который считается до поиска сетки:
+размер вырезки, линии рамки по прореженному изображению и засечки основных делений за
+рамкой (полосы без кривых, поэтому отпечаток не зависит от данных графика). В кэше — рамка
+и линии сетки; подписи и привязка делений считаются для каждого поля.
+Объект калибровки (calibrate_plot) — обычный dict, пригодный для JSON; перевод пикселей
+в значения — to_values().
+
+Пример запуска:
+  python scripts/axis_calibration.py --bootstrap
+  python scripts/axis_calibration.py --check-llm
+  python scripts/axis_calibration.py --coverage --pages 1,2,3
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from detect_page_regions import detect_regions, mask_runs
+from digitize_vector_curves import fit_axis
+from glyph_ocr import CELLS, GlyphTemplates, build_templates, glyph_canvas, normalize_rows
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+CACHE_PATH = PROJECT_ROOT / "data" / "axis_calibration_cache.json"
+TICK_TEMPLATES_PATH = PROJECT_ROOT / "data" / "tick_templates.npz"
+
+GRID_FRACTION = 0.3     # доля пикселей линии сетки в строке/столбце поля
+EDGE_PX = 3             # полоса у края вырезки, где линии сетки не ищутся
+SNAP_PX = 4             # радиус привязки центра подписи к линии сетки
+Y_LABEL_BAND = 30       # ширина полосы подписей оси Y слева от рамки
+X_LABEL_BAND = (3, 20)  # полоса подписей оси X под рамкой (отступ от рамки, конец)
+LABEL_GAP = 3           # разрыв между символами одной подписи
+
+LAYOUT_VERSION = 3      # меняется вместе с форматом записей кэша и отпечатка
+LAYOUT_STRIDE = 8       # прореживание при поиске рамки для отпечатка
+LATTICE_STEP = 0.5      # точность шага решётки делений в отпечатке, пиксели
+LAYOUT_FRACTION = 0.5   # линия рамки сплошная, в отличие от пунктира сетки
+TICK_STRIP = {"x": (2, 8), "y": (2, 5)}  # полосы засечек за линией рамки (отступ, конец); слева ближе — там подписи
+TICK_MARK_MIN = 3       # засечка основного деления не короче (промежуточные — 1–2 пикселя)
+
+TICK_FONT = "tick"
+TICK_INK = 0.3          # порог чернил подписи — доля контраста зелёного канала
+DIGIT_PITCH = 5.7       # шаг цифр шрифта подписей (цифры одной ширины), пиксели
+MAX_GLYPH_W = 7         # шире — слипшиеся при сжатии цифры, делятся по DIGIT_PITCH
+CLUSTER_NCC = 0.9       # сходство символа с кластером при построении шаблонов
+MIN_TICK_CONFIDENCE = 0.05  # минимальный отрыв NCC от второй цифры по символам подписи
+MIN_ANCHORS = 3         # меньше согласных подписей — ось не калибруется
+ANCHOR_TOLERANCE = 0.25  # допустимое отклонение подписи от прямой, доля шага делений
+
+
+def _channels(rgb):
+    return tuple(rgb[..., i].astype("int16") for i in range(3))
+
+
+def grid_mask(rgb, background: Optional[float] = None):
+    """
+    Пиксели линий сетки: светлее фона поля, серо-голубые (b > g > r). background — яркость фона
+    (r + g + b) всего поля, если rgb — его узкая полоса; по умолчанию медиана rgb.
+    """
+    import numpy as np
+
+    r, g, b = _channels(rgb)
+    s = r + g + b
+    return (s > (np.median(s) if background is None else background) + 40) & (b > g) & (g > r) & (b - g < 45)
+
+
+def label_mask(rgb):
+    """Пиксели зелёных подписей делений и названий осей."""
+    r, g, b = _channels(rgb)
+    # Там, где подпись пересекает линию сетки, синий канал выше зелёного
+    return (g > 65) & (g > r + 20) & (g + 20 > b)
+
+
+def label_ink(rgb):
+    """Контраст подписей (0..1) по зелёному каналу: фон поля, сетка и рамка в нём темнее текста."""
+    import numpy as np
+
+    g = rgb[..., 1].astype("float32")
+    background = float(np.median(g))
+    peak = float(g.max()) - background
+    if peak <= 0:
+        return np.zeros_like(g)
+    return np.clip((g - background) / peak, 0.0, 1.0)
+
+
+def _frame_from(grid) -> Optional[Tuple[int, int, int, int]]:
+    # Край вырезки может захватить рамку окна — её не считаем линией сетки
+    grid[:EDGE_PX] = grid[-EDGE_PX:] = False
+    grid[:, :EDGE_PX] = grid[:, -EDGE_PX:] = False
+    import numpy as np
+
+    cols = np.flatnonzero(grid.mean(axis=0) > GRID_FRACTION)
+    rows = np.flatnonzero(grid.mean(axis=1) > GRID_FRACTION)
+    if cols.size < 2 or rows.size < 2:
+        return None
+    return int(cols[0]), int(rows[0]), int(cols[-1]), int(rows[-1])
+
+
+def grid_frame(rgb) -> Optional[Tuple[int, int, int, int]]:
+    """Крайние линии сетки поля графика (x0, y0, x1, y1) в пикселях вырезки; None, если сетки нет."""
+    return _frame_from(grid_mask(rgb))
+
+
+def _tick_marks(counts) -> List[int]:
+    """Центры засечек основных делений по числу пикселей сетки поперёк полосы засечек."""
+    return [(s + e - 1) // 2 for s, e in mask_runs(counts >= TICK_MARK_MIN, max_gap=1)]
+
+
+def layout_marks(rgb) -> Optional[dict]:
+    """
+    Раскладка поля без полного поиска сетки: размер вырезки, линии рамки (по каждому
+    LAYOUT_STRIDE-му столбцу и строке) и засечки основных делений под рамкой и слева от неё —
+    в полосах без кривых. Шаг засечек следует за диапазоном осей, поэтому в отпечаток
+    раскладки входят не они сами, а решётка делений (_lattice). None — рамка не найдена.
+    """
+    import numpy as np
+
+    rows = grid_mask(rgb[:, ::LAYOUT_STRIDE]).mean(axis=1)
+    cols = grid_mask(rgb[::LAYOUT_STRIDE]).mean(axis=0)
+    rows[:EDGE_PX] = rows[-EDGE_PX:] = 0
+    cols[:EDGE_PX] = cols[-EDGE_PX:] = 0
+    rows, cols = np.flatnonzero(rows > LAYOUT_FRACTION), np.flatnonzero(cols > LAYOUT_FRACTION)
+    if rows.size < 2 or cols.size < 1:
+        return None
+    y0, y1, x0 = int(rows[0]), int(rows[-1]), int(cols[0])
+    (a, b), (c, d) = TICK_STRIP["x"], TICK_STRIP["y"]
+    below = rgb[y1 + a:y1 + b]
+    left = rgb[:, max(0, x0 - d + 1):max(0, x0 - c + 1)]
+    return {
+        "shape": list(rgb.shape[:2]),
+        "frame": [x0, y0, y1],
+        "marks": {
+            "x": _tick_marks(grid_mask(below).sum(axis=0)) if below.size else [],
+            "y": _tick_marks(grid_mask(left).sum(axis=1)) if left.size else [],
+        },
+    }
+
+
+def _lattice(marks: List[int]) -> Optional[List[float]]:
+    """Решётка основных делений по засечкам: [первая, шаг, число шагов]; пропуск засечки внутри её не меняет."""
+    import numpy as np
+
+    if len(marks) < 2:
+        return None
+    span = marks[-1] - marks[0]
+    steps = max(1, int(round(span / float(np.median(np.diff(marks))))))
+    return [marks[0], round(span / steps / LATTICE_STEP) * LATTICE_STEP, steps]
+
+
+def layout_fingerprint(marks: dict) -> str:
+    """Отпечаток раскладки (ключ кэша геометрии) по layout_marks: размер поля, рамка и решётка делений."""
+    grid = {axis: _lattice(marks["marks"][axis]) for axis in ("x", "y")}
+    payload = json.dumps({"v": LAYOUT_VERSION, "shape": marks["shape"], "frame": marks["frame"], "grid": grid}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def _frame_fits(rgb, layout: dict) -> bool:
+    """
+    Рамка из кэша — и в этом поле крайние линии сетки. Правая и нижняя зависят от диапазонов
+    осей, а не только от решётки делений, поэтому каждая сторона проверяется по полосе между
+    ней и краем вырезки (как в _frame_from), без поиска сетки по всему полю.
+    """
+    import numpy as np
+
+    h, w = rgb.shape[:2]
+    x0, y0, x1, y1 = layout["frame"]
+    r, g, b = _channels(rgb[::LAYOUT_STRIDE, ::LAYOUT_STRIDE])
+    background = float(np.median(r + g + b))
+
+    def profile(top: int, bottom: int, left: int, right: int, axis: int):
+        grid = grid_mask(rgb[top:bottom, left:right], background)
+        grid[:max(0, EDGE_PX - top)] = grid[max(0, h - EDGE_PX - top):] = False
+        grid[:, :max(0, EDGE_PX - left)] = grid[:, max(0, w - EDGE_PX - left):] = False
+        return grid.mean(axis=axis) > GRID_FRACTION
+
+    sides = (
+        profile(0, h, 0, x0 + 1, 0)[::-1],
+        profile(0, h, x1, w, 0),
+        profile(0, y0 + 1, 0, w, 1)[::-1],
+        profile(y1, h, 0, w, 1),
+    )
+    # Линия рамки — первая в полосе, дальше к краю вырезки линий сетки нет
+    return all(side.size and side[0] and not side[1:].any() for side in sides)
+
+
+def grid_lines(profile, lo: int, hi: int) -> List[List[float]]:
+    """Линии сетки в профиле между lo и hi: локальные максимумы в окне ±SNAP_PX — [пиксель, доля сетки]."""
+    import numpy as np
+
+    padded = np.pad(profile, SNAP_PX)
+    peaks = np.lib.stride_tricks.sliding_window_view(padded, 2 * SNAP_PX + 1).max(axis=1)
+    idx = np.flatnonzero((profile > 0) & (profile >= peaks))
+    return [[int(i), round(float(profile[i]), 4)] for i in idx if lo <= i <= hi]
+
+
+def _snap(center: float, lines: List[List[float]]) -> int:
+    """Самая заметная линия сетки в пределах SNAP_PX от center (или сам center)."""
+    near = [(strength, -pos) for pos, strength in lines if abs(pos - center) <= SNAP_PX]
+    return -int(max(near)[1]) if near else int(round(center))
+
+
+def _label_boxes(labels, frame) -> Dict[str, List[List[int]]]:
+    """bbox подписей делений [x0, y0, x1, y1] (пиксели вырезки): ось X слева направо, ось Y сверху вниз."""
+    x0, y0, x1, y1 = frame
+    h, w = labels.shape
+    boxes: Dict[str, List[List[int]]] = {"x": [], "y": []}
+
+    top, bottom = min(h, y1 + X_LABEL_BAND[0]), min(h, y1 + X_LABEL_BAND[1])
+    # Подпись «0» центрирована на левой линии рамки; левее — хвост нижней подписи оси Y
+    off = max(0, x0 - 8)
+    band = labels[top:bottom, off:]
+    for s, e in mask_runs(band.any(axis=0), min_len=2, max_gap=LABEL_GAP):
+        rows = mask_runs(band[:, s:e].any(axis=1))
+        if rows:
+            boxes["x"].append([off + s, top + rows[0][0], off + e, top + rows[-1][1]])
+
+    left = max(0, x0 - Y_LABEL_BAND)
+    band = labels[max(0, y0 - 10):min(h, y1 + 10), left:x0]
+    for s, e in mask_runs(band.any(axis=1), min_len=3, max_gap=1):
+        cols = mask_runs(band[s:e].any(axis=0), max_gap=LABEL_GAP)
+        if cols:
+            # Правый блок символов прижат к рамке — подпись деления; левее может быть название оси
+            c0, c1 = cols[-1]
+            off = max(0, y0 - 10)
+            boxes["y"].append([left + c0, off + s, left + c1, off + e])
+    return boxes
+
+
+class CalibrationCache:
+    """Рамка и линии сетки по отпечатку раскладки; хранится в JSON рядом с данными."""
+
+    def __init__(self, path: Optional[Path] = CACHE_PATH):
+        self.path = Path(path) if path else None
+        self.entries: Dict[str, dict] = {}
+        self.hits = 0
+        self.misses = 0
+        if self.path and self.path.exists():
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    self.entries = json.load(f)
+            except (json.JSONDecodeError, OSError):
+                self.entries = {}
+
+    def get(self, fingerprint: str) -> Optional[dict]:
+        entry = self.entries.get(fingerprint)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def reject(self) -> None:
+        """Запись, полученная get, не подошла полю (рамка сдвинута) — считать промахом."""
+        self.hits -= 1
+        self.misses += 1
+
+    def put(self, fingerprint: str, geometry: dict) -> None:
+        self.entries[fingerprint] = geometry
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+
+def grid_layout(rgb) -> Optional[dict]:
+    """Рамка и линии сетки поля: {"frame", "lines": {"x": [[столбец, доля]], "y": [[строка, доля]]}}."""
+    grid = grid_mask(rgb)
+    frame = _frame_from(grid.copy())
+    if frame is None:
+        return None
+    x0, y0, x1, y1 = frame
+    return {
+        "frame": list(frame),
+        "lines": {
+            "x": grid_lines(grid[y0:y1 + 1].mean(axis=0), x0, x1),
+            "y": grid_lines(grid[:, x0:x1 + 1].mean(axis=1), y0, y1),
+        },
+    }
+
+
+def plot_geometry(rgb, cache: Optional[CalibrationCache] = None) -> Optional[dict]:
+    """
+    Геометрия осей одного поля графика: {"fingerprint", "frame", "labels": {"x", "y"}, "ticks": {"x", "y"}}.
+    ticks — пиксели делений (столбцы для X, строки для Y) в порядке подписей. None, если сетки нет.
+    """
+    marks = layout_marks(rgb)
+    fingerprint = layout_fingerprint(marks) if marks is not None else None
+    layout = cache.get(fingerprint) if cache is not None and fingerprint is not None else None
+    if layout is not None and not _frame_fits(rgb, layout):
+        cache.reject()
+        layout = None
+    if layout is None:
+        layout = grid_layout(rgb)
+        if layout is None:
+            return None
+        if cache is not None and fingerprint is not None:
+            cache.put(fingerprint, layout)
+    frame = layout["frame"]
+    boxes = _label_boxes(label_mask(rgb), frame)
+    # Засечка деления точнее линии сетки: профиль сетки внутри поля искажают кривые
+    lines = {
+        axis: layout["lines"][axis] + [[m, 2.0] for m in (marks["marks"][axis] if marks else [])]
+        for axis in ("x", "y")
+    }
+    ticks = {
+        "x": [_snap((b[0] + b[2]) / 2, lines["x"]) for b in boxes["x"]],
+        "y": [_snap((b[1] + b[3]) / 2, lines["y"]) for b in boxes["y"]],
+    }
+    return {"fingerprint": fingerprint, "frame": list(frame), "labels": boxes, "ticks": ticks}
+
+
+Glyph = Union[str, "object"]
+
+
+def label_glyphs(ink, box: Sequence[int]) -> List[Glyph]:
+    """
+    Символы одной подписи: "-" и "." — строкой (узнаются по форме: чернила в одной-двух строках),
+    цифры — холстом шрифта TICK_FONT (glyph_ocr.glyph_canvas). Цифры, слипшиеся при сжатии,
+    делятся по шагу DIGIT_PITCH в минимумах чернил; минус, слипшийся с первой цифрой,
+    отделяется по плоским (чернила в одной-двух строках) столбцам в начале подписи.
+    """
+    import numpy as np
+
+    x0, y0, x1, _ = box
+    h = CELLS[TICK_FONT][0]
+    top = max(0, y0 - 1)
+    sub = ink[top:top + h, x0:x1 + 1]
+    profile = sub.max(axis=0)
+    out: List[Glyph] = []
+    runs = mask_runs(profile > TICK_INK)
+    if runs:
+        a, e = runs[0]
+        flat = 0
+        while a + flat < e:
+            rows = np.flatnonzero(sub[:, a + flat] > TICK_INK)
+            if rows[-1] - rows[0] > 1 or rows.mean() >= 0.75 * h:
+                break
+            flat += 1
+        if 2 <= flat < e - a:
+            out.append("-")
+            runs[0] = (a + flat, e)
+    for a, e in runs:
+        n = max(1, int(round((e - a + 1) / DIGIT_PITCH))) if e - a > MAX_GLYPH_W else 1
+        cuts = [a]
+        for i in range(1, n):
+            c = a + int(round(i * (e - a) / n))
+            lo, hi = max(a + 1, c - 1), min(e - 1, c + 2)
+            cuts.append(lo + int(np.argmin(profile[lo:hi])) if hi > lo else c)
+        cuts.append(e)
+        for s, t in zip(cuts[:-1], cuts[1:]):
+            rows = np.flatnonzero((sub[:, s:t] > TICK_INK).any(axis=1))
+            if rows.size and rows[-1] - rows[0] <= 2:
+                out.append("-" if rows.mean() < 0.75 * h else ".")
+            else:
+                out.append(glyph_canvas(ink, (top, top + h, x0 + s, x0 + t), TICK_FONT))
+    return out
+
+
+def tick_glyphs(rgb, geometry: dict) -> Dict[str, List[List[Glyph]]]:
+    """Символы всех подписей делений поля по осям (порядок — как у geometry["labels"])."""
+    ink = label_ink(rgb)
+    return {axis: [label_glyphs(ink, box) for box in geometry["labels"][axis]] for axis in ("x", "y")}
+
+
+def read_ticks(glyphs: Dict[str, List[List[Glyph]]], geometry: dict, templates: GlyphTemplates) -> Dict[str, List[dict]]:
+    """
+    Значения подписей делений: по осям [{"px", "text", "value", "confidence"}]. Цифры всех подписей
+    поля сравниваются с шаблонами одним вызовом GlyphTemplates.match; value None — не число.
+    """
+    import numpy as np
+
+    canvases = [g for axis in ("x", "y") for label in glyphs[axis] for g in label if not isinstance(g, str)]
+    chars, scores = templates.match(TICK_FONT, np.stack(canvases)) if canvases else ([], [])
+    it = iter(zip(chars, scores))
+    out: Dict[str, List[dict]] = {"x": [], "y": []}
+    for axis in ("x", "y"):
+        for px, label in zip(geometry["ticks"][axis], glyphs[axis]):
+            text, confidence = "", 1.0
+            for g in label:
+                if isinstance(g, str):
+                    text += g
+                else:
+                    ch, score = next(it)
+                    text += ch
+                    confidence = min(confidence, float(score))
+            try:
+                value: Optional[float] = float(text)
+            except ValueError:
+                value = None
+            out[axis].append({"px": px, "text": text, "value": value, "confidence": round(confidence, 4)})
+    return out
+
+
+def tick_anchors(labels: List[dict], min_confidence: float = MIN_TICK_CONFIDENCE) -> List[Tuple[float, float]]:
+    """
+    Опорные точки (пиксель, значение) из прочитанных подписей. Подписи делений равномерны,
+    поэтому неверно прочитанная подпись не ложится на прямую: из прямых через каждую пару
+    подписей берётся та, с которой согласно больше всего подписей (отклонение меньше
+    ANCHOR_TOLERANCE шага делений). Меньше MIN_ANCHORS согласных — [].
+    """
+    import numpy as np
+
+    pts = [(float(l["px"]), l["value"]) for l in labels if l["value"] is not None and l["confidence"] >= min_confidence]
+    if len(pts) < MIN_ANCHORS:
+        return []
+    px = np.array([p for p, _ in pts])
+    values = np.array([v for _, v in pts])
+    spacing = float(np.median(np.diff(np.sort(px))))
+    best = np.zeros(len(pts), dtype=bool)
+    for i in range(len(pts)):
+        for j in range(i + 1, len(pts)):
+            if px[i] == px[j] or values[i] == values[j]:
+                continue
+            a = (values[j] - values[i]) / (px[j] - px[i])
+            resid = np.abs(values - (values[i] + a * (px - px[i])))
+            inliers = resid <= ANCHOR_TOLERANCE * abs(a) * spacing
+            if inliers.sum() > best.sum():
+                best = inliers
+    if best.sum() < MIN_ANCHORS:
+        return []
+    return [pt for pt, ok in zip(pts, best) if ok]
+
+
+def fit_calibration(geometry: dict, anchors: Dict[str, List[Tuple[float, float]]], source: str) -> dict:
+    """Геометрия + опорные подписи → объект калибровки с отображениями осей (или None по оси)."""
+    import numpy as np
+
+    axes = {}
+    for axis in ("x", "y"):
+        pts = anchors.get(axis) or []
+        fit = fit_axis([p for p, _ in pts], [v for _, v in pts]) if len(pts) >= 2 else None
+        if fit is None:
+            axes[axis] = None
+            continue
+        a, b = fit
+        px = np.array([p for p, _ in pts])
+        resid = np.array([v for _, v in pts]) - (a * px + b)
+        axes[axis] = {
+            "a": a,
+            "b": b,
+            "rmse": round(float(np.sqrt(np.mean(resid ** 2))), 6),
+            "anchors": [[p, v] for p, v in pts],
+            "source": source,
+        }
+    return {**geometry, "axes": axes, "calibrated": bool(axes["x"] and axes["y"])}
+
+
+def calibrate_plot(
+    rgb,
+    templates: Optional[GlyphTemplates] = None,
+    cache: Optional[CalibrationCache] = None,
+    anchors: Optional[Dict[str, List[Tuple[float, float]]]] = None,
+    source: str = "anchors",
+) -> Optional[dict]:
+    """
+    Калибровка одного поля графика (rgb — вырезка поля): по подписям делений, прочитанным
+    шаблонами templates, или по готовым anchors. Без того и другого оси остаются None.
+    """
+    geometry = plot_geometry(rgb, cache)
+    if geometry is None:
+        return None
+    if anchors is None and templates is not None:
+        labels = read_ticks(tick_glyphs(rgb, geometry), geometry, templates)
+        calib = fit_calibration(geometry, {axis: tick_anchors(labels[axis]) for axis in ("x", "y")}, "ticks")
+        calib["tick_text"] = {axis: [l["text"] for l in labels[axis]] for axis in ("x", "y")}
+        return calib
+    return fit_calibration(geometry, anchors or {}, source)
+
+
+def to_values(calibration: dict, axis: str, px):
+    """Пиксели вырезки (столбцы для x, строки для y) → значения оси; None, если ось не откалибрована."""
+    import numpy as np
+
+    fit = (calibration.get("axes") or {}).get(axis)
+    if not fit:
+        return None
+    return fit["a"] * np.asarray(px, dtype=float) + fit["b"]
+
+
+def _progression_mapping(labels: List[List[Glyph]], clusters: List[List[int]]) -> Optional[Dict[int, str]]:
+    """
+    Цифры кластеров по подписям одной оси X, если подписи — 0, s, 2s, … и шаг s определяется
+    однозначно. labels — символы подписей, clusters — номера кластеров их цифр.
+    """
+    if len(labels) < 3 or len(labels[0]) != 1 or any(isinstance(g, str) for label in labels for g in label):
+        return None
+    k = len(labels[1])
+    found = None
+    for s in range(10 ** (k - 1) if k > 1 else 1, 10 ** k):
+        mapping: Dict[int, str] = {}
+        ok = True
+        for i, ids in enumerate(clusters):
+            text = str(i * s)
+            if len(text) != len(ids) or any(mapping.setdefault(c, ch) != ch for c, ch in zip(ids, text)):
+                ok = False
+                break
+        if ok:
+            if found is not None:
+                return None
+            found = mapping
+    return found
+
+
+def bootstrap_templates(x_labels: List[List[List[Glyph]]]) -> Optional[GlyphTemplates]:
+    """
+    Шаблоны цифр по подписям осей X многих полей без эталона: символы кластеризуются
+    (лидер кластера — первый символ, непохожий ни на один из лидеров с NCC ≥ CLUSTER_NCC),
+    цифры кластеров — голосованием осей, однозначно решённых _progression_mapping.
+    """
+    import numpy as np
+
+    canvases = [g for axis in x_labels for label in axis for g in label if not isinstance(g, str)]
+    if not canvases:
+        return None
+    vectors = normalize_rows(np.stack(canvases).reshape(len(canvases), -1))
+    leaders = np.zeros((0, vectors.shape[1]), dtype=vectors.dtype)
+    assign = np.empty(len(vectors), dtype=int)
+    for i, v in enumerate(vectors):
+        if len(leaders):
+            sim = leaders @ v
+            j = int(sim.argmax())
+            if sim[j] >= CLUSTER_NCC:
+                assign[i] = j
+                continue
+        leaders = np.vstack([leaders, v])
+        assign[i] = len(leaders) - 1
+
+    votes: Dict[int, Dict[str, int]] = {}
+    i = 0
+    for axis in x_labels:
+        clusters = []
+        for label in axis:
+            n = sum(1 for g in label if not isinstance(g, str))
+            clusters.append([int(c) for c in assign[i:i + n]])
+            i += n
+        mapping = _progression_mapping(axis, clusters)
+        for c, ch in (mapping or {}).items():
+            votes.setdefault(c, {}).setdefault(ch, 0)
+            votes[c][ch] += 1
+
+    samples: Dict[str, list] = {}
+    for c, counts in votes.items():
+        ch = max(counts, key=counts.get)
+        # Кластер, который разные оси называют разными цифрами, — смесь, в шаблоны не берём
+        if counts[ch] < 0.9 * sum(counts.values()):
+            continue
+        samples.setdefault(ch, []).extend(canvases[j] for j in np.flatnonzero(assign == c))
+    if not samples:
+        return None
+    return GlyphTemplates({TICK_FONT: build_templates(samples)})
+
+
+def llm_axes(llm_dir: Path, page: int) -> Dict[int, dict]:
+    """Оси и y_metrics_max из ответа vision-модели по graph_id: {"x_axis": {...}, "y_axis": {...}, "y_metrics_max"}."""
+    path = llm_dir / f"page_{page:03d}.json"
+    if not path.exists():
+        return {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (json.JSONDecodeError, OSError):
+        return {}
+    out = {}
+    for i, g in enumerate(data.get("graphs") or []):
+        if not isinstance(g, dict):
+            continue
+        stats = g.get("graph_statistics") or {}
+        axes = stats.get("axes") or {}
+        out[g.get("graph_id", i + 1)] = {
+            "x_axis": axes.get("x_axis") or {},
+            "y_axis": axes.get("y_axis") or {},
+            "y_metrics_max": stats.get("y_metrics_max") or {},
+        }
+    return out
+
+
+def llm_check(calibration: dict, ref: dict) -> Dict[str, Optional[dict]]:
+    """
+    Сверка с диапазонами осей ответа vision-модели: значения крайних делений по калибровке
+    против visible_min / visible_max. agrees — расхождение меньше половины шага делений.
+    None — ось не откалибрована или в ответе нет диапазона.
+    """
+    import numpy as np
+
+    out: Dict[str, Optional[dict]] = {}
+    for axis, key in (("x", "x_axis"), ("y", "y_axis")):
+        fit = (calibration.get("axes") or {}).get(axis)
+        vmin, vmax = (ref.get(key) or {}).get("visible_min"), (ref.get(key) or {}).get("visible_max")
+        ticks = calibration["ticks"][axis]
+        if not fit or not isinstance(vmin, (int, float)) or not isinstance(vmax, (int, float)) or len(ticks) < 2:
+            out[axis] = None
+            continue
+        values = np.sort(to_values(calibration, axis, ticks))
+        half_step = float(np.median(np.diff(values))) / 2
+        lo, hi = float(values[0]), float(values[-1])
+        out[axis] = {
+            "read": [round(lo, 4), round(hi, 4)],
+            "llm": [vmin, vmax],
+            "agrees": abs(lo - vmin) <= half_step and abs(hi - vmax) <= half_step,
+        }
+    return out
+
+
+def load_templates(path: Path = TICK_TEMPLATES_PATH) -> Optional[GlyphTemplates]:
+    """Шаблоны цифр подписей делений; None, если --bootstrap ещё не выполнялся."""
+    if not Path(path).exists():
+        return None
+    templates = GlyphTemplates.load(Path(path))
+    return templates if TICK_FONT in templates.fonts else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Калибровка осей графиков по линиям сетки и подписям делений")
+    parser.add_argument("--coverage", action="store_true", help="Страницы «с покрытием» (data/graphics_pages_coverage)")
+    parser.add_argument("--pages", type=str, default=None, help="Номера страниц через запятую (по умолчанию — все)")
+    parser.add_argument("--bootstrap", action="store_true", help="Построить шаблоны цифр подписей по страницам --pages (без эталона)")
+    parser.add_argument("--templates", type=str, default=str(TICK_TEMPLATES_PATH), help="Файл шаблонов цифр (.npz)")
+    parser.add_argument("--check-llm", action="store_true", help="Сверить прочитанные подписи с диапазонами осей из ответов vision-модели")
+    parser.add_argument("--cache-path", type=str, default=str(CACHE_PATH), help="Кэш геометрии по отпечатку раскладки")
+    parser.add_argument("--no-cache", action="store_true", help="Не использовать кэш геометрии")
+    parser.add_argument("--out", type=str, default=None, help="Файл результата (по умолчанию data/axis_calibration[_coverage].json)")
+    args = parser.parse_args()
+
+    try:
+        import numpy as np
+        from PIL import Image
+    except ImportError:
+        print("Install: pip install numpy Pillow", file=sys.stderr)
+        return 1
+
+    suffix = "_coverage" if args.coverage else ""
+    pages_dir = PROJECT_ROOT / "data" / f"graphics_pages{suffix}"
+    llm_dir = PROJECT_ROOT / "data" / f"graphics_llm{suffix}"
+    out = Path(args.out) if args.out else PROJECT_ROOT / "data" / f"axis_calibration{suffix}.json"
+    templates_path = Path(args.templates)
+    paths = sorted(pages_dir.glob("page_*.png"))
+    if args.pages:
+        wanted = {int(x.strip()) for x in args.pages.split(",")}
+        paths = [p for p in paths if int(p.stem.split("_")[1]) in wanted]
+    if not paths:
+        print(f"Нет page_*.png в {pages_dir}. Сначала выполните extract_graphics_pages.py", file=sys.stderr)
+        return 1
+
+    cache = None if args.no_cache else CalibrationCache(Path(args.cache_path))
+    templates = None
+    if not args.bootstrap:
+        templates = load_templates(templates_path)
+        if templates is None:
+            print(f"Нет шаблонов {templates_path}. Сначала: python scripts/axis_calibration.py --bootstrap", file=sys.stderr)
+            return 1
+
+    t0 = time.perf_counter()
+    pages = []
+    x_labels = []
+    n_plots = n_calibrated = n_checked = n_agree = 0
+    for path in paths:
+        page = int(path.stem.split("_")[1])
+        rgb = np.asarray(Image.open(path).convert("RGB"))
+        refs = llm_axes(llm_dir, page) if args.check_llm else {}
+        graphs = []
+        for region in detect_regions(rgb):
+            if region["kind"] != "plot":
+                continue
+            x0, y0, x1, y1 = region["bbox"]
+            crop = rgb[y0:y1, x0:x1]
+            if args.bootstrap:
+                geometry = plot_geometry(crop, cache)
+                if geometry is not None:
+                    x_labels.append(tick_glyphs(crop, geometry)["x"])
+                continue
+            calib = calibrate_plot(crop, templates, cache)
+            if calib is None:
+                continue
+            n_plots += 1
+            n_calibrated += int(calib["calibrated"])
+            if args.check_llm:
+                calib["llm_check"] = llm_check(calib, refs.get(region["graph_id"], {}))
+                for check in calib["llm_check"].values():
+                    if check is not None:
+                        n_checked += 1
+                        n_agree += int(check["agrees"])
+            graphs.append({"graph_id": region["graph_id"], "plot_bbox": region["bbox"], **calib})
+        pages.append({"page": page, "graphs": graphs})
+    if args.bootstrap:
+        templates = bootstrap_templates(x_labels)
+        if templates is None:
+            print("Не удалось построить шаблоны: ни одна ось X не прочитана как прогрессия 0, s, 2s, …", file=sys.stderr)
+            return 1
+        templates.save(templates_path)
+        chars = templates.fonts[TICK_FONT][0]
+        print(f"Осей X: {len(x_labels)}; шаблонов {len(chars)} ({''.join(sorted(set(chars)))}): {templates_path}")
+        print(f"Время: {time.perf_counter() - t0:.2f} с")
+        return 0
+    elapsed = time.perf_counter() - t0
+    if cache is not None:
+        cache.save()
+
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump({"source": str(pages_dir.relative_to(PROJECT_ROOT)), "pages": pages}, f, ensure_ascii=False, indent=2)
+
+    layouts = {g["fingerprint"] for p in pages for g in p["graphs"]}
+    print(f"Страниц: {len(paths)}, полей графиков: {n_plots}, раскладок: {len(layouts)}, откалибровано по подписям: {n_calibrated}")
+    if args.check_llm:
+        print(f"Сверка с диапазонами осей vision-модели: осей {n_checked}, совпало {n_agree}")
+    if cache is not None:
+        print(f"Кэш геометрии: попаданий {cache.hits}, промахов {cache.misses}, записей {len(cache.entries)}")
+    print(f"Время: {elapsed:.2f} с")
+    print(f"Результат: {out}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
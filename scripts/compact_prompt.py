@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Компактный промпт с короткими ключами ответа для analyze_graphics_llm.py --compact.
+
+Полный промпт (PROMPT, PROMPT_COVERAGE) описывает вложенную схему с длинными ключами, и модель
+повторяет их в каждом графике (relaxation_time_short_component_mks и т.п.). Компактный вариант
+строится из шаблона полного промпта: каждому листовому полю соответствует короткий ключ плоского
+объекта (COMPACT_FIELDS), подсказка к полю — в одну строку. Ответ модели разворачивается
+(expand_graphs) в ту же вложенную структуру, что и ответ на полный промпт; ключи, которых модель
+не вернула, в развёрнутом ответе тоже отсутствуют, поэтому merge_graphics_llm.py, дозапрос
+недостающих ключей и каскад работают без изменений.
+
+Офлайн-сравнение по сохранённым ответам (длина промпта и ответа в символах, проверка, что
+сжатие и разворот ответа ничего не теряют):
+  python scripts/compact_prompt.py --coverage
+Замер на API — токены и задержка полного и компактного промпта на одних и тех же страницах:
+  python scripts/compact_prompt.py --coverage --benchmark --pages 1,5,10
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from vision_json import get_path, prompt_template, set_path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+# (короткий ключ, путь в полной схеме, подсказка); тип значения берётся из шаблона полного промпта
+COMPACT_FIELDS: Tuple[Tuple[str, str, str], ...] = (
+    ("title", "page_context.title", "заголовок приложения вверху страницы, только в первом графике"),
+    ("id", "graph_id", "номер графика на странице, 1 или 2"),
+    ("hdr", "header_data.full_text", "полный текст заголовка над графиком"),
+    ("ref", "header_data.structured_metrics.sample_reference", "ссылка на образец из заголовка"),
+    ("K", "header_data.structured_metrics.crystallinity_index", "индекс кристалличности из заголовка"),
+    ("Pr", "header_data.structured_metrics.proton_density", "протонная плотность из заголовка"),
+    ("yl", "graph_statistics.axes.y_axis.label", "подпись оси Y"),
+    ("y0", "graph_statistics.axes.y_axis.visible_min", "число у начала шкалы Y"),
+    ("y1", "graph_statistics.axes.y_axis.visible_max", "число у конца шкалы Y"),
+    ("ys", "graph_statistics.axes.y_axis.step_interval", "шаг делений Y"),
+    ("xl", "graph_statistics.axes.x_axis.label", "подпись оси X"),
+    ("x0", "graph_statistics.axes.x_axis.visible_min", "число у начала шкалы X"),
+    ("x1", "graph_statistics.axes.x_axis.visible_max", "число у конца шкалы X"),
+    ("xs", "graph_statistics.axes.x_axis.step_interval", "шаг делений X"),
+    ("r", "graph_statistics.y_metrics_max.red", "максимум красной кривой по оси Y"),
+    ("b", "graph_statistics.y_metrics_max.blue", "максимум синей кривой по оси Y"),
+    ("g", "graph_statistics.y_metrics_max.green", "максимум зелёной кривой по оси Y"),
+    ("tabs", "graph_statistics.visible_tabs", "вкладка интерфейса"),
+    ("lt", "log_panel_data.timestamp", "время ЧЧ:ММ:СС из панели лога под графиком"),
+    ("log", "log_panel_data.raw_lines", "строка лога"),
+    ("date", "log_panel_data.structured_log_metrics.research_date", "дата исследования ДД.ММ.ГГГГ"),
+    ("t1", "log_panel_data.structured_log_metrics.relaxation_time_short_component_mks", "время релаксации короткой компоненты, мкс"),
+    ("t2", "log_panel_data.structured_log_metrics.relaxation_time_long_component_mks", "время релаксации длинной компоненты, мкс"),
+    ("a1", "log_panel_data.structured_log_metrics.amplitude_short_component_au", "амплитуда короткой компоненты, a.u."),
+    ("a2", "log_panel_data.structured_log_metrics.amplitude_long_component_au", "амплитуда длинной компоненты, a.u."),
+    ("lK", "log_panel_data.structured_log_metrics.calculated_crystallinity_index", "индекс кристалличности из лога"),
+    ("lPr", "log_panel_data.structured_log_metrics.calculated_proton_density", "протонная плотность из лога"),
+    ("urtb", "status_bar_data.urtb", "URTB из строки состояния, например 3%"),
+    ("adc", "status_bar_data.adc", "ADC из строки состояния"),
+    ("off", "status_bar_data.base_offset", "base offset, например 100% 100%"),
+    ("op", "status_bar_data.operation", "операция в строке состояния"),
+    ("nums", "status_bar_data.numeric_values", "числа строки состояния через пробел"),
+    ("cn", "caption_data.illustration_number", "номер иллюстрации, например №155"),
+    ("cap", "caption_data.full_text", "полный текст подписи к иллюстрации"),
+    ("ot", "caption_data.structured_details.object_type", "тип объекта из подписи"),
+    ("src", "caption_data.structured_details.source_item", "источник из подписи"),
+    ("obj", "caption_data.structured_details.investigation_object", "объект, например Объект №12"),
+    ("cond", "caption_data.structured_details.condition", "условие, например при третьем проколе"),
+)
+
+COMPACT_PROMPT = """Страница с графиками ЯМР (ССИ). Верни только JSON-массив без markdown: элемент на каждый график, ключи:
+{template}
+Числа — числа; чего нет на странице — null или ""."""
+
+
+def _leaves(template: dict, prefix: str = "") -> Dict[str, Any]:
+    out = {}
+    for k, v in template.items():
+        if isinstance(v, dict) and v:
+            out.update(_leaves(v, f"{prefix}{k}."))
+        else:
+            out[f"{prefix}{k}"] = v
+    return out
+
+
+def fields_for(full_prompt: str) -> List[Tuple[str, str, Any]]:
+    """Поля компактной схемы для полного промпта: (короткий ключ, путь, значение шаблона)."""
+    template = prompt_template(full_prompt)
+    if template is None:
+        raise ValueError("в полном промпте нет шаблона элемента ответа")
+    leaves = _leaves(template)
+    missing = sorted(set(leaves) - {path for _, path, _ in COMPACT_FIELDS})
+    if missing:
+        raise ValueError(f"нет коротких ключей для полей: {', '.join(missing)}")
+    return [(short, path, leaves[path]) for short, path, _ in COMPACT_FIELDS if path in leaves]
+
+
+def compact_prompt(full_prompt: str) -> str:
+    """Компактный промпт: плоский шаблон с короткими ключами, по строке на поле."""
+    hints = {short: hint for short, _, hint in COMPACT_FIELDS}
+    lines = []
+    for short, _, value in fields_for(full_prompt):
+        if isinstance(value, list):
+            lines.append(f'  "{short}": ["<{hints[short]}>", ...],')
+        elif isinstance(value, (int, float)):
+            lines.append(f'  "{short}": <{hints[short]}>,')
+        else:
+            lines.append(f'  "{short}": "<{hints[short]}>",')
+    lines[-1] = lines[-1].rstrip(",")
+    return COMPACT_PROMPT.format(template="{\n" + "\n".join(lines) + "\n}")
+
+
+def expand_graphs(graphs: List[Any], full_prompt: str) -> List[Any]:
+    """Ответ на компактный промпт → графики в схеме полного промпта (не-объекты остаются как есть)."""
+    fields = fields_for(full_prompt)
+    out = []
+    for item in graphs:
+        if not isinstance(item, dict):
+            out.append(item)
+            continue
+        # Только ключи, которые вернула модель: пропущенные остаются пропущенными,
+        # и дозапрос (missing_keys) видит их так же, как в ответе на полный промпт
+        graph: Dict[str, Any] = {}
+        for short, path, _ in fields:
+            if short in item:
+                set_path(graph, path, item[short])
+        gid = graph.get("graph_id")
+        if isinstance(gid, float) and gid.is_integer():
+            graph["graph_id"] = int(gid)
+        out.append(graph)
+    return out
+
+
+def compress_graphs(graphs: List[Any], full_prompt: str) -> List[Any]:
+    """Обратное преобразование (для офлайн-сравнения): графики полной схемы → короткие ключи."""
+    fields = fields_for(full_prompt)
+    out = []
+    for index, g in enumerate(graphs):
+        if not isinstance(g, dict):
+            out.append(g)
+            continue
+        item = {}
+        for short, path, _ in fields:
+            if short == "title" and index > 0 and "page_context" not in g:
+                continue
+            item[short] = get_path(g, path)
+        out.append(item)
+    return out
+
+
+def _project(graphs: List[Any], full_prompt: str) -> List[Any]:
+    """Значения полей схемы (пустые — None) — для сравнения ответов независимо от формы."""
+    fields = fields_for(full_prompt)
+    return [
+        {path: (get_path(g, path) if get_path(g, path) not in ("", []) else None) for _, path, _ in fields}
+        for g in graphs if isinstance(g, dict)
+    ]
+
+
+def _chars(graphs: Any) -> int:
+    return len(json.dumps(graphs, ensure_ascii=False))
+
+
+def offline_report(full_prompt: str, llm_dir: Path) -> None:
+    short = compact_prompt(full_prompt)
+    print(f"Промпт: полный {len(full_prompt)} символов, компактный {len(short)} ({100 * (1 - len(short) / len(full_prompt)):.0f} % меньше)")
+    n_pages = n_same = full_chars = short_chars = 0
+    for path in sorted(llm_dir.glob("page_*.json")):
+        with open(path, encoding="utf-8") as f:
+            graphs = json.load(f).get("graphs")
+        if not isinstance(graphs, list) or not graphs:
+            continue
+        n_pages += 1
+        compact = compress_graphs(graphs, full_prompt)
+        full_chars += _chars(graphs)
+        short_chars += _chars(compact)
+        n_same += _project(expand_graphs(compact, full_prompt), full_prompt) == _project(graphs, full_prompt)
+    if n_pages:
+        print(f"Ответы ({llm_dir.name}, {n_pages} стр.): {full_chars / n_pages:.0f} → {short_chars / n_pages:.0f} символов на страницу "
+              f"({100 * (1 - short_chars / full_chars):.0f} % меньше); разворот без потерь на {n_same}/{n_pages} страницах")
+
+
+def benchmark(full_prompt: str, pages_dir: Path, pages: List[int], token: str, model: str, api_url: str) -> None:
+    from analyze_graphics_llm import complete_request, parse_response_json
+
+    variants = (("полный", full_prompt, None), ("компактный", compact_prompt(full_prompt), full_prompt))
+    stats: Dict[str, Dict[str, List[float]]] = {name: {"prompt": [], "completion": [], "latency": []} for name, _, _ in variants}
+    agree = total = 0
+    for page in pages:
+        image = pages_dir / f"page_{page:03d}.png"
+        if not image.exists():
+            print(f"Файл не найден: {image}")
+            continue
+        answers = {}
+        for name, prompt, expand_to in variants:
+            t0 = time.monotonic()
+            completion, _ = complete_request(image, token, model, prompt, api_url, cache=None, bucket=None)
+            latency = time.monotonic() - t0
+            usage = completion.get("usage") or {}
+            stats[name]["prompt"].append(usage.get("prompt_tokens") or 0)
+            stats[name]["completion"].append(usage.get("completion_tokens") or 0)
+            stats[name]["latency"].append(latency)
+            graphs = parse_response_json(completion["choices"][0]["message"]["content"]) or []
+            answers[name] = _project(expand_graphs(graphs, expand_to) if expand_to else graphs, full_prompt)
+            print(f"Страница {page}, {name}: токенов {usage.get('prompt_tokens')} + {usage.get('completion_tokens')}, {latency:.1f} с", flush=True)
+        for a, b in zip(answers["полный"], answers["компактный"]):
+            total += len(a)
+            agree += sum(a[k] == b.get(k) for k in a)
+    print(f"{'промпт':<12} {'вход, ток':>10} {'выход, ток':>11} {'задержка, с':>12}")
+    for name, s in stats.items():
+        n = max(len(s["latency"]), 1)
+        print(f"{name:<12} {sum(s['prompt']) / n:>10.0f} {sum(s['completion']) / n:>11.0f} {sum(s['latency']) / n:>12.2f}")
+    if total:
+        print(f"Совпадение значений полей компактного ответа с полным: {agree}/{total} ({100 * agree / total:.0f} %)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Компактный промпт с короткими ключами: сравнение с полным офлайн и на API")
+    parser.add_argument("--coverage", action="store_true", help="PROMPT_COVERAGE и data/graphics_llm_coverage")
+    parser.add_argument("--show", action="store_true", help="Напечатать компактный промпт и выйти")
+    parser.add_argument("--benchmark", action="store_true", help="Отправить страницы с полным и компактным промптом (без кэша) и сравнить токены и задержку")
+    parser.add_argument("--pages", type=str, default="1,2,3", help="Страницы для --benchmark через запятую")
+    parser.add_argument("--api-url", type=str, default=None, help="Endpoint chat completions (по умолчанию — как в analyze_graphics_llm.py)")
+    parser.add_argument("--model", type=str, default=None, help="Модель (по умолчанию — как в analyze_graphics_llm.py)")
+    args = parser.parse_args()
+
+    from analyze_graphics_llm import API_URL, MODEL, PROMPT, PROMPT_COVERAGE
+
+    full_prompt = PROMPT_COVERAGE if args.coverage else PROMPT
+    suffix = "_coverage" if args.coverage else ""
+    if args.show:
+        print(compact_prompt(full_prompt))
+        return 0
+    if not args.benchmark:
+        offline_report(full_prompt, PROJECT_ROOT / "data" / f"graphics_llm{suffix}")
+        return 0
+    token = os.getenv("ELIZA_TOKEN")
+    if not token:
+        print("Укажите ELIZA_TOKEN в окружении (как в api_example.py).", file=sys.stderr)
+        return 1
+    pages = [int(x.strip()) for x in args.pages.split(",")]
+    benchmark(full_prompt, PROJECT_ROOT / "data" / f"graphics_pages{suffix}", pages, token,
+              args.model or os.getenv("ELIZA_MODEL", MODEL), args.api_url or os.getenv("ELIZA_API_URL", API_URL))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
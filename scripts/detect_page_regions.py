@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Разметка страниц с графиками ЯМР на области: заголовок приложения, строка заголовка
+над графиком (образец, K, Pr), панель графика, панель лога, строка состояния и подпись
+к иллюстрации. Без LLM: профили по строкам и столбцам (NumPy) по цветам интерфейса —
+бирюзовая панель инструментов, тёмно-синее поле графика, синяя панель лога.
+
+Результат:
+  data/graphics_regions[_coverage]/page_XXX_g1_header.png, … — вырезанные области;
+  data/graphics_regions[_coverage]/page_XXX_text.png — все текстовые области, сложенные
+      в одну полосу (её отправляет analyze_graphics_llm.py --crops вместо целой страницы);
+  data/graphics_regions[_coverage]/manifest.json — bbox каждой области по страницам.
+
+Пример запуска:
+  python scripts/detect_page_regions.py
+  python scripts/detect_page_regions.py --coverage --pages 1,2,3
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+# Пороговые доли пикселей класса в строке/столбце
+ROW_FRACTION = 0.3
+WHITE_LEVEL = 245       # фон страницы PDF (интерфейс программы темнее)
+INK_LEVEL = 128         # «чернила» текста подписи
+CAPTION_MAX_GAP = 40    # пустых строк подряд — конец подписи (при ZOOM = 2)
+STRIP_GAP = 12          # отступ между областями в текстовой полосе
+
+# Области, в которых есть текст для vision-модели (поле графика — нет: оси и кривые читаются локально)
+TEXT_KINDS = ("title", "header", "log", "status", "caption")
+
+
+def regions_dir_for(pages_dir: Path) -> Path:
+    """data/graphics_pages[_coverage] → data/graphics_regions[_coverage]."""
+    return pages_dir.parent / pages_dir.name.replace("graphics_pages", "graphics_regions")
+
+
+def mask_runs(mask, min_len: int = 1, max_gap: int = 0) -> List[Tuple[int, int]]:
+    """Непрерывные участки True в 1D-маске как [start, end); разрывы до max_gap склеиваются."""
+    import numpy as np
+
+    idx = np.flatnonzero(mask)
+    if idx.size == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(idx) > max_gap + 1)
+    starts = np.r_[idx[0], idx[breaks + 1]]
+    ends = np.r_[idx[breaks], idx[-1]] + 1
+    return [(int(s), int(e)) for s, e in zip(starts, ends) if e - s >= min_len]
+
+
+def color_masks(rgb) -> dict:
+    """Маски классов пикселей интерфейса по массиву HxWx3 (uint8)."""
+    r, g, b = (rgb[..., i].astype("int16") for i in range(3))
+    return {
+        "teal": (r < 60) & (g > 100) & (g < 160) & (b > 100) & (b < 160),
+        "dark": (r < 60) & (g < 70) & (b >= 30) & (b < 110) & (b > r + 15),
+        "log": (r < 80) & (g >= 60) & (g < 140) & (b >= 100) & (b < 180) & (b > g + 10),
+        "white": (r >= WHITE_LEVEL) & (g >= WHITE_LEVEL) & (b >= WHITE_LEVEL),
+        "ink": (r < INK_LEVEL) & (g < INK_LEVEL) & (b < INK_LEVEL),
+    }
+
+
+def _text_block(ink, y0: int, y1: int) -> Optional[List[int]]:
+    """
+    bbox текстового блока в полосе строк [y0, y1): от первой строки с «чернилами»
+    до разрыва > CAPTION_MAX_GAP; по ширине — крайние столбцы с «чернилами».
+    """
+    import numpy as np
+
+    runs = mask_runs(ink[y0:y1].any(axis=1), min_len=2, max_gap=CAPTION_MAX_GAP)
+    if not runs:
+        return None
+    by0, by1 = y0 + runs[0][0], y0 + runs[0][1]
+    cols = np.flatnonzero(ink[by0:by1].any(axis=0))
+    return [int(cols[0]), by0, int(cols[-1]) + 1, by1]
+
+
+def detect_regions(rgb) -> List[dict]:
+    """
+    Найти области на странице. Возвращает список {"kind", "graph_id", "bbox": [x0, y0, x1, y1]};
+    graph_id = None у общего заголовка страницы.
+    """
+    import numpy as np
+
+    m = color_masks(rgb)
+    height, width = m["white"].shape
+    toolbars = mask_runs(m["teal"].mean(axis=1) > ROW_FRACTION, min_len=8, max_gap=2)
+    regions: List[dict] = []
+    shots = []
+
+    for gi, (t0, t1) in enumerate(toolbars):
+        # Ширина скриншота — по панели инструментов (бирюзовый фон и значки слева)
+        cols = np.flatnonzero(~m["white"][t0:t1].all(axis=0) & (m["white"][t0:t1].mean(axis=0) < 0.5))
+        if cols.size == 0:
+            continue
+        x0, x1 = int(cols[0]), int(cols[-1]) + 1
+        limit = toolbars[gi + 1][0] if gi + 1 < len(toolbars) else height
+        nonwhite = m["white"][:, x0:x1].mean(axis=1) < 0.5
+        # Верх скриншота — строка меню над панелью инструментов
+        top = t0
+        while top > 0 and nonwhite[top - 1]:
+            top -= 1
+        graph_id = gi + 1
+
+        # Строка заголовка (образец, K, Pr) — светлая полоса от панели инструментов до рамки окна графика
+        dark_frac = m["dark"][t1:limit, x0:x1].mean(axis=1)
+        frame = np.flatnonzero(dark_frac > ROW_FRACTION)
+        frame_top = t1 + int(frame[0]) if frame.size else t1
+        if frame_top > t1:
+            regions.append({"kind": "header", "graph_id": graph_id, "bbox": [x0, t1, x1, frame_top]})
+
+        below = frame_top
+        dark_rows = mask_runs(dark_frac > ROW_FRACTION, min_len=20, max_gap=4)
+        if dark_rows:
+            py0, py1 = t1 + dark_rows[0][0], t1 + dark_rows[0][1]
+            dcols = np.flatnonzero(m["dark"][py0:py1, x0:x1].mean(axis=0) > 0.5)
+            px0, px1 = (x0 + int(dcols[0]), x0 + int(dcols[-1]) + 1) if dcols.size else (x0, x1)
+            regions.append({"kind": "plot", "graph_id": graph_id, "bbox": [px0, py0, px1, py1]})
+            below = py1
+
+        log_rows = mask_runs(m["log"][below:limit, x0:x1].mean(axis=1) > ROW_FRACTION, min_len=20, max_gap=4)
+        log_bottom = None
+        if log_rows:
+            ly0, ly1 = below + log_rows[0][0], below + log_rows[0][1]
+            lcols = np.flatnonzero(m["log"][ly0:ly1, x0:x1].mean(axis=0) > 0.5)
+            lx0, lx1 = (x0 + int(lcols[0]), x0 + int(lcols[-1]) + 1) if lcols.size else (x0, x1)
+            regions.append({"kind": "log", "graph_id": graph_id, "bbox": [lx0, ly0, lx1, ly1]})
+            below = log_bottom = ly1
+
+        # Низ скриншота — первая строка фона страницы после графика (и лога)
+        bottom = below
+        while bottom < limit and nonwhite[bottom]:
+            bottom += 1
+        if log_bottom is not None and bottom > log_bottom:
+            regions.append({"kind": "status", "graph_id": graph_id, "bbox": [x0, log_bottom, x1, bottom]})
+        shots.append((top, bottom, x0, x1))
+
+    # Подпись — текст под скриншотом до следующего скриншота; заголовок страницы — текст над первым
+    for i, (top, bottom, x0, x1) in enumerate(shots):
+        limit = shots[i + 1][0] if i + 1 < len(shots) else height
+        bbox = _text_block(m["ink"], bottom, limit)
+        if bbox:
+            regions.append({"kind": "caption", "graph_id": i + 1, "bbox": bbox})
+    if shots:
+        bbox = _text_block(m["ink"], 0, shots[0][0])
+        if bbox:
+            regions.append({"kind": "title", "graph_id": None, "bbox": bbox})
+
+    order = {k: i for i, k in enumerate(("title", "header", "plot", "log", "status", "caption"))}
+    regions.sort(key=lambda r: (r["graph_id"] or 0, order[r["kind"]]))
+    return regions
+
+
+def compose_text_strip(image, regions: List[dict]):
+    """Сложить текстовые области страницы в одну вертикальную полосу (PIL.Image) в порядке чтения."""
+    from PIL import Image
+
+    crops = [image.crop(tuple(r["bbox"])) for r in regions if r["kind"] in TEXT_KINDS]
+    if not crops:
+        return image.copy()
+    width = max(c.width for c in crops)
+    height = sum(c.height for c in crops) + STRIP_GAP * (len(crops) - 1)
+    strip = Image.new("RGB", (width, height), (255, 255, 255))
+    y = 0
+    for c in crops:
+        strip.paste(c, (0, y))
+        y += c.height + STRIP_GAP
+    return strip
+
+
+def process_page(path: Path, out_dir: Path, page: int, save_crops: bool = True) -> dict:
+    """Разметить одну страницу, сохранить вырезки и текстовую полосу; вернуть запись манифеста."""
+    import numpy as np
+    from PIL import Image
+
+    image = Image.open(path).convert("RGB")
+    regions = detect_regions(np.asarray(image))
+    if save_crops:
+        for r in regions:
+            gid = f"g{r['graph_id']}_" if r["graph_id"] is not None else ""
+            name = f"page_{page:03d}_{gid}{r['kind']}.png"
+            image.crop(tuple(r["bbox"])).save(out_dir / name)
+            r["file"] = name
+    strip = compose_text_strip(image, regions)
+    strip_name = f"page_{page:03d}_text.png"
+    strip.save(out_dir / strip_name)
+    return {
+        "page": page,
+        "source": path.name,
+        "size": [image.width, image.height],
+        "text_strip": strip_name,
+        "text_strip_size": [strip.width, strip.height],
+        "source_bytes": path.stat().st_size,
+        "text_strip_bytes": (out_dir / strip_name).stat().st_size,
+        "regions": regions,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Разметка страниц графиков ЯМР на области и вырезка текстовых фрагментов")
+    parser.add_argument("--coverage", action="store_true", help="Страницы «с покрытием» (data/graphics_pages_coverage)")
+    parser.add_argument("--pages", type=str, default=None, help="Номера страниц через запятую (по умолчанию — все)")
+    parser.add_argument("--no-crops", action="store_true", help="Не сохранять отдельные вырезки, только текстовую полосу и манифест")
+    args = parser.parse_args()
+
+    try:
+        import numpy  # noqa: F401
+        from PIL import Image  # noqa: F401
+    except ImportError:
+        print("Install: pip install numpy Pillow", file=sys.stderr)
+        return 1
+
+    pages_dir = PROJECT_ROOT / "data" / ("graphics_pages_coverage" if args.coverage else "graphics_pages")
+    out_dir = regions_dir_for(pages_dir)
+    paths = sorted(pages_dir.glob("page_*.png"))
+    if args.pages:
+        wanted = {int(x.strip()) for x in args.pages.split(",")}
+        paths = [p for p in paths if int(p.stem.split("_")[1]) in wanted]
+    if not paths:
+        print(f"Нет page_*.png в {pages_dir}. Сначала выполните extract_graphics_pages.py", file=sys.stderr)
+        return 1
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    manifest_path = out_dir / "manifest.json"
+    manifest = {"pages": {}}
+    if manifest_path.exists():
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+
+    total_src = total_strip = 0
+    for p in paths:
+        page = int(p.stem.split("_")[1])
+        entry = process_page(p, out_dir, page, save_crops=not args.no_crops)
+        manifest["pages"][str(page)] = entry
+        total_src += entry["source_bytes"]
+        total_strip += entry["text_strip_bytes"]
+        kinds = ", ".join(f"{r['kind']}{r['graph_id'] or ''}" for r in entry["regions"])
+        print(f"Страница {page}: {kinds}")
+
+    manifest["pages"] = dict(sorted(manifest["pages"].items(), key=lambda kv: int(kv[0])))
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    ratio = total_src / total_strip if total_strip else 0.0
+    print(f"Манифест: {manifest_path}")
+    print(f"Объём: страницы {total_src / 1024:.0f} КБ → текстовые полосы {total_strip / 1024:.0f} КБ (в {ratio:.1f} раза меньше)")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
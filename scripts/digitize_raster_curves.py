@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Оцифровка кривых ССИ с растровых страниц (data/graphics_pages*/page_XXX.png) без LLM.
+
+Для каждого поля графика (detect_page_regions.py):
+  1) маски красной, синей и зелёной кривых — векторные пороги NumPy по всему полю сразу;
+  2) для каждого столбца пикселей — медиана строк маски (кривая толщиной в несколько пикселей → одна точка);
+  3) короткие разрывы (кривую перекрыла другая) заполняются линейной интерполяцией.
+
+Оси калибруются по линиям сетки и подписям делений, прочитанным по шаблонам цифр
+(axis_calibration.py, шаблоны — axis_calibration.py --bootstrap). Откалиброванная ось — в её
+единицах, иначе — в долях рамки сетки (0..1 слева направо и снизу вверх).
+По каждой кривой — max / area / tail (curve_metrics из digitize_vector_curves.py).
+
+--benchmark сравнивает max кривых с размеченными вручную значениями
+(data/raster_benchmark.json) и с векторной оцифровкой (data/graphics_curves[_coverage].json,
+если она есть) — не с ответом vision-модели.
+
+Результат:
+  data/graphics_curves_raster[_coverage].npz  — p001_g1_red_x, p001_g1_red_y, …
+  data/graphics_curves_raster[_coverage].json — метрики и y_metrics_max по графикам
+
+Пример запуска:
+  python scripts/axis_calibration.py --bootstrap
+  python scripts/digitize_raster_curves.py --benchmark
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from axis_calibration import TICK_TEMPLATES_PATH, calibrate_plot, load_templates, to_values
+from detect_page_regions import detect_regions
+from digitize_vector_curves import COLORS, curve_metrics
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+BENCHMARK_PATH = PROJECT_ROOT / "data" / "raster_benchmark.json"
+
+MAX_GAP = 25            # разрыв кривой (пикселей), который ещё заполняется интерполяцией
+MIN_COLUMN_FRACTION = 0.02  # кривая с точками меньше чем в 2 % столбцов считается отсутствующей
+
+
+def curve_masks(rgb) -> Dict[str, "object"]:
+    """Маски кривых на тёмном поле графика (пороги подобраны по скриншотам программы ЯМР)."""
+    r, g, b = (rgb[..., i].astype("int16") for i in range(3))
+    return {
+        "red": (r > 40) & (r > g + 25) & (r > b + 10),
+        "blue": (b > 85) & (b > g + 60) & (r < 60),
+        "green": (g > 45) & (g > r + 20) & (g >= b),
+    }
+
+
+def column_median(mask):
+    """Медиана номеров строк True в каждом столбце (NaN, где столбец пуст) — без циклов Python."""
+    import numpy as np
+
+    n = mask.sum(axis=0)
+    cs = np.cumsum(mask, axis=0)
+    target = (n + 1) // 2
+    rows = np.argmax(cs >= np.maximum(target, 1), axis=0).astype(float)
+    rows[n == 0] = np.nan
+    return rows
+
+
+def fill_gaps(y, max_gap: int = MAX_GAP):
+    """Линейная интерполяция внутренних разрывов длиной до max_gap; края и длинные разрывы остаются NaN."""
+    import numpy as np
+
+    y = y.copy()
+    valid = np.flatnonzero(~np.isnan(y))
+    if valid.size < 2:
+        return y
+    gaps = np.flatnonzero(np.diff(valid) > 1)
+    for i in gaps:
+        a, b = valid[i], valid[i + 1]
+        if b - a - 1 <= max_gap:
+            y[a + 1:b] = np.interp(np.arange(a + 1, b), [a, b], [y[a], y[b]])
+    return y
+
+
+def digitize_plot(rgb, templates=None) -> Optional[dict]:
+    """
+    Кривые одного поля графика в пикселях вырезки: {"calibration": {...}, "curves": {color: (cols, rows)}}.
+    calibration — рамка, деления и отображения осей по подписям (axis_calibration.calibrate_plot).
+    """
+    import numpy as np
+
+    calibration = calibrate_plot(rgb, templates)
+    if calibration is None:
+        return None
+    x0, y0, x1, y1 = calibration["frame"]
+    masks = curve_masks(rgb[y0:y1 + 1, x0:x1 + 1])
+    curves = {}
+    for color in COLORS:
+        rows = fill_gaps(column_median(masks[color]))
+        ok = ~np.isnan(rows)
+        if ok.mean() < MIN_COLUMN_FRACTION:
+            continue
+        cols = np.flatnonzero(ok)
+        curves[color] = ((cols + x0).astype("float32"), (rows[ok] + y0).astype("float32"))
+    return {"calibration": calibration, "curves": curves}
+
+
+def to_axis_units(calibration: dict, cols, rows):
+    """Пиксели вырезки → единицы осей; неоткалиброванная ось — в долях рамки (0..1)."""
+    x0, y0, x1, y1 = calibration["frame"]
+    x = to_values(calibration, "x", cols)
+    y = to_values(calibration, "y", rows)
+    if x is None:
+        x = (cols - x0) / max(x1 - x0, 1)
+    if y is None:
+        y = (y1 - rows) / max(y1 - y0, 1)
+    return x, y
+
+
+@lru_cache(maxsize=None)
+def _templates(path: str):
+    # Один раз на процесс пула
+    return load_templates(Path(path))
+
+
+def digitize_page_file(path: Path, templates_path: str = str(TICK_TEMPLATES_PATH)) -> dict:
+    """Все поля графиков одной PNG-страницы."""
+    import numpy as np
+    from PIL import Image
+
+    templates = _templates(templates_path)
+    rgb = np.asarray(Image.open(path).convert("RGB"))
+    graphs = []
+    for region in detect_regions(rgb):
+        if region["kind"] != "plot":
+            continue
+        x0, y0, x1, y1 = region["bbox"]
+        res = digitize_plot(rgb[y0:y1, x0:x1], templates)
+        if res is None:
+            continue
+        res["plot_bbox"] = region["bbox"]
+        res["graph_id"] = region["graph_id"]
+        graphs.append(res)
+    return {"page": int(path.stem.split("_")[1]), "graphs": graphs}
+
+
+def reference_maxima(path: Path, coverage: bool) -> Dict[tuple, Dict[str, float]]:
+    """
+    Эталонные max кривых {(page, graph_id): {color: value}}: файл ручной разметки
+    ({"pages": [{"page", "coverage", "graph_id", "y_metrics_max"}]}) или JSON векторной оцифровки.
+    """
+    if not path.exists():
+        return {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (json.JSONDecodeError, OSError):
+        return {}
+    out = {}
+    for entry in data.get("pages") or []:
+        # Ручная разметка — запись на график, векторная оцифровка — страница со списком графиков
+        graphs = entry.get("graphs") if "graphs" in entry else [entry]
+        if bool(entry.get("coverage", coverage)) != coverage:
+            continue
+        for g in graphs:
+            maxima = {c: float(v) for c, v in (g.get("y_metrics_max") or {}).items() if isinstance(v, (int, float))}
+            if maxima:
+                out[(entry["page"], g["graph_id"])] = maxima
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Оцифровка кривых ССИ с растровых страниц графиков")
+    parser.add_argument("--coverage", action="store_true", help="Страницы «с покрытием» (data/graphics_pages_coverage)")
+    parser.add_argument("--pages", type=str, default=None, help="Номера страниц через запятую (по умолчанию — все)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Процессов в пуле")
+    parser.add_argument("--templates", type=str, default=str(TICK_TEMPLATES_PATH), help="Шаблоны цифр подписей делений (axis_calibration.py --bootstrap)")
+    parser.add_argument("--benchmark", action="store_true", help="Время и сравнение max с ручной разметкой и векторной оцифровкой")
+    parser.add_argument("--benchmark-path", type=str, default=str(BENCHMARK_PATH), help="Ручная разметка max кривых (JSON)")
+    parser.add_argument("--out", type=str, default=None, help="Префикс выходных файлов (.npz и .json)")
+    args = parser.parse_args()
+
+    try:
+        import numpy as np
+        from PIL import Image  # noqa: F401
+    except ImportError:
+        print("Install: pip install numpy Pillow", file=sys.stderr)
+        return 1
+
+    suffix = "_coverage" if args.coverage else ""
+    pages_dir = PROJECT_ROOT / "data" / f"graphics_pages{suffix}"
+    out = Path(args.out) if args.out else PROJECT_ROOT / "data" / f"graphics_curves_raster{suffix}"
+    paths = sorted(pages_dir.glob("page_*.png"))
+    if args.pages:
+        wanted = {int(x.strip()) for x in args.pages.split(",")}
+        paths = [p for p in paths if int(p.stem.split("_")[1]) in wanted]
+    if not paths:
+        print(f"Нет page_*.png в {pages_dir}. Сначала выполните extract_graphics_pages.py", file=sys.stderr)
+        return 1
+    if load_templates(Path(args.templates)) is None:
+        print(f"Нет шаблонов {args.templates}. Сначала: python scripts/axis_calibration.py --bootstrap", file=sys.stderr)
+        return 1
+
+    t0 = time.perf_counter()
+    workers = max(1, min(args.workers, len(paths)))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(
+            partial(digitize_page_file, templates_path=args.templates), paths,
+            chunksize=max(1, len(paths) // (workers * 4)),
+        ))
+    elapsed = time.perf_counter() - t0
+
+    references = {}
+    if args.benchmark:
+        references = {
+            "ручная разметка": reference_maxima(Path(args.benchmark_path), args.coverage),
+            "векторная оцифровка": reference_maxima(PROJECT_ROOT / "data" / f"graphics_curves{suffix}.json", args.coverage),
+        }
+    diffs: Dict[str, Dict[str, List[float]]] = {name: {c: [] for c in COLORS} for name in references}
+
+    arrays = {}
+    summary = {"source": str(pages_dir.relative_to(PROJECT_ROOT)), "pages": []}
+    n_curves = n_calibrated = 0
+    for res in results:
+        page_entry = {"page": res["page"], "graphs": []}
+        for g in res["graphs"]:
+            calib = g["calibration"]
+            n_calibrated += int(calib["calibrated"])
+            metrics = {}
+            for color, (cols, rows) in g["curves"].items():
+                x, y = to_axis_units(calib, cols, rows)
+                key = f"p{res['page']:03d}_g{g['graph_id']}_{color}"
+                arrays[f"{key}_x"] = np.asarray(x, dtype="float32")
+                arrays[f"{key}_y"] = np.asarray(y, dtype="float32")
+                metrics[color] = curve_metrics(x, y)
+                n_curves += 1
+                if not calib["axes"]["y"] or metrics[color]["max"] is None:
+                    continue
+                for name, ref in references.items():
+                    value = ref.get((res["page"], g["graph_id"]), {}).get(color)
+                    if value is not None:
+                        diffs[name][color].append(abs(metrics[color]["max"] - value))
+            page_entry["graphs"].append({
+                "graph_id": g["graph_id"],
+                "plot_bbox": g["plot_bbox"],
+                "frame_px": calib["frame"],
+                "axes": calib["axes"],
+                "tick_text": calib.get("tick_text"),
+                "units": "axis" if calib["calibrated"] else "frame_fraction",
+                "y_metrics_max": {c: metrics[c]["max"] if c in metrics else None for c in COLORS},
+                "curves": metrics,
+            })
+        summary["pages"].append(page_entry)
+
+    out.parent.mkdir(parents=True, exist_ok=True)
+    np.savez_compressed(out.with_suffix(".npz"), **arrays)
+    with open(out.with_suffix(".json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+
+    n_graphs = sum(len(p["graphs"]) for p in summary["pages"])
+    print(f"Страниц: {len(paths)}, графиков: {n_graphs} (оси по подписям: {n_calibrated}), кривых: {n_curves}")
+    print(f"Время: {elapsed:.2f} с ({workers} процессов, {elapsed / len(paths) * 1000:.0f} мс на страницу)")
+    for name, per_color in diffs.items():
+        print(f"Сравнение max с эталоном ({name}):")
+        for color in COLORS:
+            d = per_color[color]
+            if d:
+                print(f"  {color}: пар {len(d)}, средн. |разница| {sum(d) / len(d):.2f}, медиана {sorted(d)[len(d) // 2]:.2f}")
+            else:
+                print(f"  {color}: нет пар для сравнения")
+    print(f"Результаты: {out.with_suffix('.npz')}, {out.with_suffix('.json')}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
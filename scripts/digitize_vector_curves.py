@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Оцифровка кривых ССИ из векторной графики PDF (PyMuPDF, page.get_drawings()) вместо чтения
+максимумов «на глаз» моделью (y_metrics_max у gpt-4o-mini часто null).
+
+Для каждой страницы: цветные ломаные (красная, синяя, зелёная) → массивы x, y в единицах осей.
+Поле графика — крупный прямоугольник с тёмной заливкой; шкалы — числовые подписи делений
+из текстового слоя, по ним подбирается линейное отображение «пункты PDF → единицы оси».
+Если подписей нет, координаты остаются в пунктах (calibrated = false).
+
+По каждой кривой считаются max, area (интеграл по трапециям) и tail (среднее y на последних
+10 % диапазона x). Страницы обрабатываются в пуле процессов (один fitz.Document на процесс).
+
+Результат:
+  data/graphics_curves[_coverage].npz  — массивы p001_g1_red_x, p001_g1_red_y, …
+  data/graphics_curves[_coverage].json — метрики по страницам и графикам
+
+Если графики в PDF растровые (скриншоты), векторных кривых не будет — используйте
+digitize_raster_curves.py.
+
+Пример запуска:
+  python scripts/digitize_vector_curves.py --coverage --workers 4
+"""
+import argparse
+import json
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+PDF_WITHOUT = PROJECT_ROOT / "graphics_without_coverage.pdf"
+PDF_COVERAGE = PROJECT_ROOT / "graphics_with_coverage.pdf"
+OUT_WITHOUT = PROJECT_ROOT / "data" / "graphics_curves"
+OUT_COVERAGE = PROJECT_ROOT / "data" / "graphics_curves_coverage"
+
+COLORS = ("red", "blue", "green")
+MIN_PLOT_AREA = 10000.0   # пт², меньше — не поле графика
+TAIL_FRACTION = 0.1
+NUMERIC_RE = re.compile(r"^[-+−]?\d+(?:[.,]\d+)?$")
+
+
+def classify_color(rgb) -> Optional[str]:
+    """Цвет обводки (доли 0..1) → red / blue / green или None."""
+    if rgb is None or len(rgb) < 3:
+        return None
+    r, g, b = rgb[:3]
+    if r > 0.6 and g < 0.4 and b < 0.4:
+        return "red"
+    if b > 0.6 and r < 0.4 and g < 0.5:
+        return "blue"
+    if g > 0.4 and r < 0.4 and b < 0.4:
+        return "green"
+    return None
+
+
+def _is_dark(rgb) -> bool:
+    return rgb is not None and len(rgb) >= 3 and max(rgb[:3]) < 0.45 and rgb[2] >= rgb[0]
+
+
+def curve_metrics(x, y) -> dict:
+    """max, area (трапеции), tail (среднее y на последних TAIL_FRACTION диапазона x)."""
+    import numpy as np
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    ok = np.isfinite(x) & np.isfinite(y)
+    x, y = x[ok], y[ok]
+    if x.size == 0:
+        return {"max": None, "x_at_max": None, "area": None, "tail": None, "points": 0}
+    i = int(np.argmax(y))
+    x_tail = x.max() - TAIL_FRACTION * (x.max() - x.min())
+    tail = y[x >= x_tail]
+    area = float(np.sum((x[1:] - x[:-1]) * (y[1:] + y[:-1]) / 2.0)) if x.size > 1 else 0.0
+    return {
+        "max": round(float(y[i]), 4),
+        "x_at_max": round(float(x[i]), 4),
+        "area": round(area, 4),
+        "tail": round(float(tail.mean()), 4) if tail.size else None,
+        "points": int(x.size),
+    }
+
+
+def fit_axis(coords: List[float], values: List[float]) -> Optional[Tuple[float, float]]:
+    """Линейное отображение coord → value (a, b) по подписям делений; None, если подписей < 2."""
+    import numpy as np
+
+    if len(set(coords)) < 2:
+        return None
+    a, b = np.polyfit(np.asarray(coords, dtype=float), np.asarray(values, dtype=float), 1)
+    return float(a), float(b)
+
+
+def _numeric_spans(page) -> List[Tuple[float, float, float, float]]:
+    """Числовые подписи страницы: (центр x, центр y, правый край, значение)."""
+    out = []
+    for block in page.get_text("dict")["blocks"]:
+        for line in block.get("lines", []):
+            for span in line["spans"]:
+                text = span["text"].strip().replace("−", "-")
+                if NUMERIC_RE.match(text):
+                    x0, y0, x1, y1 = span["bbox"]
+                    out.append(((x0 + x1) / 2, (y0 + y1) / 2, x1, float(text.replace(",", "."))))
+    return out
+
+
+def _largest_group(items: List[tuple], key, tol: float) -> List[tuple]:
+    """Самая многочисленная группа подписей с одинаковым key (в пределах tol) — один ряд или столбец."""
+    best: List[tuple] = []
+    for it in items:
+        group = [o for o in items if abs(key(o) - key(it)) <= tol]
+        if len(group) > len(best):
+            best = group
+    return best
+
+
+def plot_rects(drawings) -> List[Tuple[float, float, float, float]]:
+    """Поля графиков — крупные прямоугольники с тёмной заливкой, сверху вниз."""
+    rects = []
+    for d in drawings:
+        rect = d.get("rect")
+        if rect is None or not _is_dark(d.get("fill")):
+            continue
+        if rect.width * rect.height < MIN_PLOT_AREA:
+            continue
+        rects.append((rect.x0, rect.y0, rect.x1, rect.y1))
+    # Вложенные прямоугольники (рамка окна + поле) — оставляем внутренний
+    rects = [r for r in rects if not any(o != r and o[0] >= r[0] and o[1] >= r[1] and o[2] <= r[2] and o[3] <= r[3] for o in rects)]
+    return sorted(set(rects), key=lambda r: (r[1], r[0]))
+
+
+def calibrate(rect, spans) -> Dict[str, Optional[Tuple[float, float]]]:
+    """Подписи делений у нижнего края поля (ось X) и у левого края (ось Y) → отображения осей."""
+    x0, y0, x1, y1 = rect
+    h, w = y1 - y0, x1 - x0
+    # Подписи оси X стоят в одну строку, оси Y — выровнены по правому краю в один столбец;
+    # угловая подпись «0» попадает в обе полосы, поэтому строку X выбираем первой и исключаем из Y
+    bottom = [s for s in spans if x0 <= s[0] <= x1 and y1 - 0.15 * h <= s[1] <= y1 + 25]
+    xs = _largest_group(bottom, key=lambda s: s[1], tol=2.0)
+    left = [s for s in spans if s not in xs and y0 <= s[1] <= y1 and x0 - 40 <= s[0] <= x0 + 0.12 * w]
+    ys = _largest_group(left, key=lambda s: s[2], tol=3.0)
+    return {
+        "x": fit_axis([s[0] for s in xs], [s[3] for s in xs]),
+        "y": fit_axis([s[1] for s in ys], [s[3] for s in ys]),
+    }
+
+
+def _path_points(d) -> List[Tuple[float, float]]:
+    pts = []
+    for item in d.get("items", []):
+        op = item[0]
+        if op == "l":
+            pts.extend([(item[1].x, item[1].y), (item[2].x, item[2].y)])
+        elif op == "c":
+            pts.extend([(item[1].x, item[1].y), (item[4].x, item[4].y)])
+    return pts
+
+
+def digitize_page(page) -> dict:
+    """Кривые одной страницы: {"graphs": [{"graph_id", "rect", "calibrated", "curves": {color: (x, y)}}]}."""
+    import numpy as np
+
+    drawings = page.get_drawings()
+    rects = plot_rects(drawings)
+    spans = _numeric_spans(page)
+    points: Dict[str, List[Tuple[float, float]]] = {c: [] for c in COLORS}
+    for d in drawings:
+        color = classify_color(d.get("color"))
+        if color is not None:
+            points[color].extend(_path_points(d))
+    if not rects and any(points.values()):
+        # Поле графика не найдено — один график по охвату всех кривых
+        allp = np.array([p for c in COLORS for p in points[c]])
+        rects = [(float(allp[:, 0].min()), float(allp[:, 1].min()), float(allp[:, 0].max()), float(allp[:, 1].max()))]
+
+    graphs = []
+    for gi, rect in enumerate(rects):
+        axes = calibrate(rect, spans)
+        curves = {}
+        for color in COLORS:
+            pts = np.array([p for p in points[color] if rect[0] <= p[0] <= rect[2] and rect[1] <= p[1] <= rect[3]])
+            if pts.size == 0:
+                continue
+            order = np.argsort(pts[:, 0], kind="stable")
+            px, py = pts[order, 0], pts[order, 1]
+            # Экранная ось Y направлена вниз: без калибровки переворачиваем относительно низа поля
+            x = axes["x"][0] * px + axes["x"][1] if axes["x"] else px - rect[0]
+            y = axes["y"][0] * py + axes["y"][1] if axes["y"] else rect[3] - py
+            curves[color] = (x.astype("float32"), y.astype("float32"))
+        graphs.append({
+            "graph_id": gi + 1,
+            "rect": [round(v, 2) for v in rect],
+            "calibrated": bool(axes["x"] and axes["y"]),
+            "curves": curves,
+        })
+    return {"page": page.number + 1, "graphs": graphs}
+
+
+_DOC = None
+
+
+def _init_worker(pdf_path: str) -> None:
+    global _DOC
+    import fitz  # PyMuPDF
+
+    _DOC = fitz.open(pdf_path)
+
+
+def _digitize_index(index: int) -> dict:
+    return digitize_page(_DOC[index])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Оцифровка векторных кривых ССИ из PDF с графиками")
+    parser.add_argument("--coverage", action="store_true", help="graphics_with_coverage.pdf")
+    parser.add_argument("--pdf", type=str, default=None, help="Другой PDF")
+    parser.add_argument("--out", type=str, default=None, help="Префикс выходных файлов (.npz и .json)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Процессов в пуле")
+    args = parser.parse_args()
+
+    pdf_path = Path(args.pdf) if args.pdf else (PDF_COVERAGE if args.coverage else PDF_WITHOUT)
+    out = Path(args.out) if args.out else (OUT_COVERAGE if args.coverage else OUT_WITHOUT)
+    if not pdf_path.exists():
+        print(f"Файл не найден: {pdf_path}", file=sys.stderr)
+        return 1
+    try:
+        import fitz  # PyMuPDF
+        import numpy as np
+    except ImportError:
+        print("Install: pip install pymupdf numpy", file=sys.stderr)
+        return 1
+
+    with fitz.open(pdf_path) as doc:
+        n_pages = len(doc)
+    workers = max(1, min(args.workers, n_pages))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(str(pdf_path),)) as pool:
+        results = list(pool.map(_digitize_index, range(n_pages), chunksize=max(1, n_pages // (workers * 4))))
+
+    arrays = {}
+    summary = {"source": str(pdf_path.name), "pages": []}
+    n_curves = 0
+    for res in results:
+        page_entry = {"page": res["page"], "graphs": []}
+        for g in res["graphs"]:
+            metrics = {}
+            for color, (x, y) in g["curves"].items():
+                key = f"p{res['page']:03d}_g{g['graph_id']}_{color}"
+                arrays[f"{key}_x"] = x
+                arrays[f"{key}_y"] = y
+                metrics[color] = curve_metrics(x, y)
+                n_curves += 1
+            page_entry["graphs"].append({
+                "graph_id": g["graph_id"],
+                "rect": g["rect"],
+                "calibrated": g["calibrated"],
+                "y_metrics_max": {c: metrics[c]["max"] if c in metrics else None for c in COLORS},
+                "curves": metrics,
+            })
+        summary["pages"].append(page_entry)
+
+    out.parent.mkdir(parents=True, exist_ok=True)
+    np.savez_compressed(out.with_suffix(".npz"), **arrays)
+    with open(out.with_suffix(".json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+
+    print(f"Страниц: {n_pages}, кривых: {n_curves}")
+    if n_curves == 0:
+        print("Векторных кривых не найдено (графики растровые?) — используйте digitize_raster_curves.py")
+    print(f"Результаты: {out.with_suffix('.npz')}, {out.with_suffix('.json')}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
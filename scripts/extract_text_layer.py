@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+Быстрый путь без vision-модели: чтение текстового слоя PDF с графиками (PyMuPDF, get_text("dict")).
+Всё, что в PDF есть настоящим текстом — заголовок приложения, строка заголовка над графиком
+(образец, индекс кристалличности K, протонная плотность Pr), подпись к иллюстрации, строки лога
+и строка состояния, — раскладывается в те же поля, что и ответ LLM (header_data, caption_data,
+log_panel_data, status_bar_data, page_context), с bbox в координатах страницы PDF (пункты).
+
+Для каждой страницы в missing_fields перечислены поля, которых в текстовом слое нет
+(и "graphs", если графиков меньше, чем полей графиков в векторной графике страницы):
+analyze_graphics_llm.py --text-layer отправляет такие страницы в API целиком, а для полных
+запрашивает у модели только graph_statistics (оси, y_metrics_max) — их в тексте нет. Найденные
+здесь значения имеют приоритет над ответом модели.
+
+Результат: data/graphics_text[_coverage]/page_XXX.json
+
+Пример запуска:
+  python scripts/extract_text_layer.py
+  python scripts/extract_text_layer.py --coverage
+"""
+import argparse
+import json
+import re
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+from digitize_vector_curves import plot_rects
+from vision_json import get_path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+PDF_WITHOUT = PROJECT_ROOT / "graphics_without_coverage.pdf"
+PDF_COVERAGE = PROJECT_ROOT / "graphics_with_coverage.pdf"
+OUT_DIR_WITHOUT = PROJECT_ROOT / "data" / "graphics_text"
+OUT_DIR_COVERAGE = PROJECT_ROOT / "data" / "graphics_text_coverage"
+
+NUMBER = r"([-+]?\d+(?:[.,]\d+)?)"
+TIMESTAMP_RE = re.compile(r"^\s*(\d{1,2}:\d{2}:\d{2})\s*:?\s*")
+HEADER_RE = re.compile(
+    r"(?P<ref>Образец\s*№\s*\d+[^;]*?)\s*;\s*Индекс кристалличности\s*=\s*" + NUMBER
+    + r"\s*;\s*Протонная плотность\s*=\s*" + NUMBER,
+    re.IGNORECASE,
+)
+CAPTION_RE = re.compile(r"Иллюстрация\s*(№\s*\d+)\s*\.?", re.IGNORECASE)
+CAPTION_DETAILS_RE = re.compile(
+    r"одного из\s+(?P<object>ЯМР участк\w*\s+исследуемых\s+\w+)\s+(?P<source>.+?)\s+в предоставленном",
+    re.IGNORECASE,
+)
+OBJECT_RE = re.compile(r"Объект\w*\s*(№\s*\d+)", re.IGNORECASE)
+CONDITION_RE = re.compile(r"(при\s+\w+\s+проколе)", re.IGNORECASE)
+TITLE_RE = re.compile(r"^(Приложение\s*№|Изображения графиков)", re.IGNORECASE)
+
+LOG_PATTERNS = {
+    "research_date": re.compile(r"Дата исследования\s*[-=]\s*(\d{2}\.\d{2}\.\d{4})", re.IGNORECASE),
+    "relaxation_time_short_component_mks": re.compile(r"Время релаксации короткой компоненты\s*[-=]\s*" + NUMBER, re.IGNORECASE),
+    "relaxation_time_long_component_mks": re.compile(r"Время релаксации длинной компоненты\s*[-=]\s*" + NUMBER, re.IGNORECASE),
+    "amplitude_short_component_au": re.compile(r"Амплитуда короткой компоненты\s*[-=]\s*" + NUMBER, re.IGNORECASE),
+    "amplitude_long_component_au": re.compile(r"Амплитуда длинной компоненты\s*[-=]\s*" + NUMBER, re.IGNORECASE),
+    "calculated_crystallinity_index": re.compile(r"Индекс кристалличности\s*[-=]\s*" + NUMBER, re.IGNORECASE),
+    "calculated_proton_density": re.compile(r"Протонная плотность\s*[-=]\s*" + NUMBER, re.IGNORECASE),
+}
+STATUS_RE = re.compile(
+    r"URTB\s*(?P<urtb>\S+)\s*(?:АЦП|ADC)\s*(?P<adc>\S+)\s*Баз\.?\s*смещ\.?:?\s*(?P<base_offset>\S+\s+\S+)"
+    r"\s*(?P<operation>Чтение буфера\s*\S)?\s*(?P<numbers>[\d.\s]*)",
+    re.IGNORECASE,
+)
+
+# Пустое значение поля: при наложении не перекрывает ответ модели и не считается прочитанным моделью
+EMPTY = (None, "", [], {})
+# Поля, без которых страница считается неполной (тогда нужен vision-запрос)
+REQUIRED_FIELDS = (
+    "header_data.structured_metrics.crystallinity_index",
+    "header_data.structured_metrics.proton_density",
+    "header_data.structured_metrics.sample_reference",
+    "caption_data.illustration_number",
+    "caption_data.full_text",
+)
+REQUIRED_FIELDS_COVERAGE = REQUIRED_FIELDS + tuple(
+    f"log_panel_data.structured_log_metrics.{k}" for k in LOG_PATTERNS
+)
+
+
+def _float(s: str) -> float:
+    return float(s.replace(",", "."))
+
+
+def _union(boxes: List[List[float]]) -> List[float]:
+    return [
+        round(min(b[0] for b in boxes), 2),
+        round(min(b[1] for b in boxes), 2),
+        round(max(b[2] for b in boxes), 2),
+        round(max(b[3] for b in boxes), 2),
+    ]
+
+
+def page_blocks(page) -> List[dict]:
+    """Текстовые блоки страницы: {"text", "lines": [{"text", "bbox"}], "bbox"}, сверху вниз."""
+    blocks = []
+    for b in page.get_text("dict")["blocks"]:
+        if b.get("type") != 0:
+            continue
+        lines = []
+        for line in b.get("lines", []):
+            text = "".join(span["text"] for span in line["spans"]).strip()
+            if text:
+                lines.append({"text": text, "bbox": list(line["bbox"])})
+        if lines:
+            blocks.append({
+                "text": " ".join(line["text"] for line in lines),
+                "lines": lines,
+                "bbox": list(b["bbox"]),
+            })
+    blocks.sort(key=lambda b: (b["bbox"][1], b["bbox"][0]))
+    return blocks
+
+
+def parse_header(text: str) -> Optional[dict]:
+    m = HEADER_RE.search(text)
+    if not m:
+        return None
+    return {
+        "full_text": m.group(0).strip(),
+        "structured_metrics": {
+            "sample_reference": re.sub(r"\s+", " ", m.group("ref")).strip(),
+            "crystallinity_index": _float(m.group(2)),
+            "proton_density": _float(m.group(3)),
+        },
+    }
+
+
+def parse_caption(text: str) -> Optional[dict]:
+    m = CAPTION_RE.search(text)
+    if not m:
+        return None
+    full = re.sub(r"\s+", " ", text[m.start():]).strip()
+    details = CAPTION_DETAILS_RE.search(full)
+    obj = OBJECT_RE.search(full)
+    obj_number = re.sub(r"\s+", "", obj.group(1)) if obj else ""
+    cond = CONDITION_RE.search(full)
+    return {
+        "illustration_number": re.sub(r"\s+", "", m.group(1)),
+        "full_text": full,
+        "structured_details": {
+            "object_type": details.group("object") if details else "",
+            "source_item": details.group("source") if details else "",
+            "investigation_object": f"Объект {obj_number}" if obj else "",
+            "condition": cond.group(1) if cond else "",
+        },
+    }
+
+
+def parse_log_lines(lines: List[str]) -> Optional[dict]:
+    """Строки лога (начинаются с ЧЧ:ММ:СС) → log_panel_data."""
+    metrics: Dict[str, Any] = {}
+    raw, timestamp = [], ""
+    for line in lines:
+        ts = TIMESTAMP_RE.match(line)
+        if not ts:
+            continue
+        timestamp = timestamp or ts.group(1)
+        raw.append(line)
+        body = line[ts.end():]
+        for key, pattern in LOG_PATTERNS.items():
+            m = pattern.search(body)
+            if m and key not in metrics:
+                metrics[key] = m.group(1) if key == "research_date" else _float(m.group(1))
+                break
+    if not raw:
+        return None
+    return {"timestamp": timestamp, "raw_lines": raw, "structured_log_metrics": metrics}
+
+
+def parse_status(text: str) -> Optional[dict]:
+    m = STATUS_RE.search(text)
+    if not m:
+        return None
+    return {
+        "urtb": m.group("urtb"),
+        "adc": m.group("adc"),
+        "base_offset": m.group("base_offset"),
+        "operation": (m.group("operation") or "").strip(),
+        "numeric_values": " ".join(m.group("numbers").split()),
+    }
+
+
+def missing_fields(
+    graphs: List[dict], coverage: bool, expected_graphs: int = 1, required: Optional[Sequence[str]] = None
+) -> List[str]:
+    """Список "graph_id:поле", которых нет в текстовом слое (или в другом источнике со своим списком required)."""
+    if required is None:
+        required = REQUIRED_FIELDS_COVERAGE if coverage else REQUIRED_FIELDS
+    out = []
+    if len(graphs) < expected_graphs:
+        out.append("graphs")
+    for g in graphs:
+        for field in required:
+            if get_path(g, field) in (None, ""):
+                out.append(f"{g['graph_id']}:{field}")
+    return out
+
+
+def extract_page(page, coverage: bool) -> dict:
+    """
+    Разобрать текстовый слой одной страницы. Графики нумеруются по порядку строк заголовка
+    (сверху вниз); подпись, лог и строка состояния относятся к ближайшему заголовку выше.
+    """
+    blocks = page_blocks(page)
+    graphs: List[dict] = []
+    page_context = None
+    for b in blocks:
+        header = parse_header(b["text"])
+        if header:
+            header["bbox"] = b["bbox"]
+            graphs.append({"graph_id": len(graphs) + 1, "header_data": header})
+            continue
+        if not graphs and page_context is None and TITLE_RE.search(b["text"]):
+            page_context = {"title": b["text"], "bbox": b["bbox"]}
+            continue
+        caption = parse_caption(b["text"])
+        if caption:
+            if not graphs or "caption_data" in graphs[-1]:
+                # Подпись без текстового заголовка над ней — график есть, но строка заголовка растровая
+                graphs.append({"graph_id": len(graphs) + 1})
+            caption["bbox"] = b["bbox"]
+            graphs[-1]["caption_data"] = caption
+            continue
+        if not graphs:
+            continue
+        log_lines = [line for line in b["lines"] if TIMESTAMP_RE.match(line["text"])]
+        if log_lines:
+            log = parse_log_lines([line["text"] for line in log_lines])
+            log["bbox"] = _union([line["bbox"] for line in log_lines])
+            graphs[-1]["log_panel_data"] = log
+            continue
+        status = parse_status(b["text"])
+        if status:
+            status["bbox"] = b["bbox"]
+            graphs[-1]["status_bar_data"] = status
+    if graphs and page_context is not None:
+        graphs[0]["page_context"] = page_context
+    return {
+        "page": page.number + 1,
+        "source": "text_layer",
+        "graphs": graphs,
+        # Число графиков — по полям графиков в векторной графике; у растровой страницы их не найти
+        "missing_fields": missing_fields(graphs, coverage, max(1, len(plot_rects(page.get_drawings())))),
+    }
+
+
+def overlay_text_layer(
+    graphs: Optional[List[dict]], text_graphs: List[dict], fill_only: bool = False,
+) -> Optional[List[dict]]:
+    """
+    Подставить в ответ модели значения из текстового слоя (они точнее распознанных).
+    Графики сопоставляются по graph_id; отсутствующие в ответе модели — добавляются.
+    fill_only (поля офлайн-OCR): заполняются только поля, которых в ответе модели нет, —
+    прочитанное моделью не перекрывается.
+    """
+    if graphs is None:
+        return [dict(g) for g in text_graphs] if text_graphs else None
+    by_id = {g.get("graph_id"): g for g in graphs if isinstance(g, dict)}
+    for tg in text_graphs:
+        g = by_id.get(tg["graph_id"])
+        if g is None:
+            graphs.append(dict(tg))
+            continue
+        for key, value in tg.items():
+            if key == "graph_id":
+                continue
+            if isinstance(value, dict) and isinstance(g.get(key), dict):
+                g[key] = _deep_merge(g[key], value, fill_only)
+            elif not fill_only or g.get(key) in EMPTY:
+                g[key] = value
+    return graphs
+
+
+def _deep_merge(base: dict, top: dict, fill_only: bool = False) -> dict:
+    out = dict(base)
+    for k, v in top.items():
+        if isinstance(v, dict) and isinstance(out.get(k), dict):
+            out[k] = _deep_merge(out[k], v, fill_only)
+        elif v not in EMPTY and (not fill_only or out.get(k) in EMPTY):
+            out[k] = v
+    return out
+
+
+def load_text_layer(text_dir: Path, page: int) -> Optional[dict]:
+    path = text_dir / f"page_{page:03d}.json"
+    if not path.exists():
+        return None
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (json.JSONDecodeError, OSError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Извлечение заголовков, подписей и лога из текстового слоя PDF с графиками")
+    parser.add_argument("--coverage", action="store_true", help="graphics_with_coverage.pdf → data/graphics_text_coverage")
+    parser.add_argument("--pdf", type=str, default=None, help="Другой PDF (по умолчанию graphics_without_coverage.pdf / graphics_with_coverage.pdf)")
+    parser.add_argument("--out-dir", type=str, default=None, help="Каталог для page_XXX.json")
+    args = parser.parse_args()
+
+    pdf_path = Path(args.pdf) if args.pdf else (PDF_COVERAGE if args.coverage else PDF_WITHOUT)
+    out_dir = Path(args.out_dir) if args.out_dir else (OUT_DIR_COVERAGE if args.coverage else OUT_DIR_WITHOUT)
+    if not pdf_path.exists():
+        print(f"Файл не найден: {pdf_path}", file=sys.stderr)
+        return 1
+    try:
+        import fitz  # PyMuPDF
+    except ImportError:
+        print("PyMuPDF не установлен. Выполните: pip install pymupdf", file=sys.stderr)
+        return 1
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    complete = 0
+    field_counts: Dict[str, int] = {}
+    doc = fitz.open(pdf_path)
+    for page in doc:
+        result = extract_page(page, args.coverage)
+        with open(out_dir / f"page_{page.number + 1:03d}.json", "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        if not result["missing_fields"]:
+            complete += 1
+        for field in result["missing_fields"]:
+            name = field.split(":", 1)[-1]
+            field_counts[name] = field_counts.get(name, 0) + 1
+    n_pages = len(doc)
+    doc.close()
+
+    print(f"Страниц: {n_pages}, полностью из текстового слоя: {complete}, нужен vision-запрос: {n_pages - complete}")
+    for name, n in sorted(field_counts.items(), key=lambda kv: -kv[1]):
+        print(f"  нет в текстовом слое: {name} — {n}")
+    print(f"Результаты: {out_dir}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
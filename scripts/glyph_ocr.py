@@ -0,0 +1,756 @@
+#!/usr/bin/env python3
+"""
+Офлайн-чтение чисел из интерфейса программы ЯМР по шаблонам символов (Pillow + NumPy, без API).
+
+Строка заголовка (K, Pr), панель лога (времена релаксации, амплитуды, K, Pr, дата) и строка
+состояния набраны фиксированными шрифтами программы: «ui» — заголовок и строка состояния
+(тёмный текст на светлом), «log» — моноширинный текст лога (светлый на синем). Поэтому вместо
+распознавания общего вида достаточно шаблонов символов:
+
+  1) --bootstrap: на нескольких страницах с уже известными значениями (ответы vision-модели
+     в data/graphics_llm*) строки режутся на слова и символы; слово, где число символов совпало
+     с эталоном, даёт образцы символов. Образцы усредняются, выбросы (ошибки эталона) отсекаются;
+     шаблоны сохраняются в data/glyph_templates.npz;
+  2) чтение: каждый символ сравнивается со всеми шаблонами (и их сдвигами на 1–2 пикселя)
+     нормированной взаимной корреляцией — одним матричным произведением NumPy на строку.
+
+Уверенность поля — минимальный по символам значения отрыв корреляции лучшего шаблона от
+второго кандидата. Уверенность 0 получает значение не в формате поля (K и Pr заголовка — ровно
+пять знаков после точки) и значение, ширина которого не сходится с предсказанной по шагу цифр
+(слипшиеся цифры режутся как один символ, и число теряет цифры). K и Pr выведены и в заголовке,
+и в логе: совпавшие чтения получают уверенность 1, разошедшиеся — 0; на страницах с покрытием
+значение, которое не с чем сверить, — тоже 0. Поля с уверенностью не ниже --min-confidence
+записываются в те же места, что у текстового слоя (header_data.structured_metrics,
+log_panel_data.structured_log_metrics, status_bar_data); распознанный текст строк — в ocr_text /
+ocr_lines, не в full_text / raw_lines. Подписи, номера иллюстраций и шифра образца на изображении
+нет, поэтому полнота страницы проверяется по своему списку OCR_REQUIRED_FIELDS (K и Pr; с
+покрытием — и строки лога): чего не хватает — в missing_fields, и analyze_graphics_llm.py --ocr
+отправляет в API только такие страницы. Значения, которые модель прочитала сама, OCR не перекрывает.
+
+Точность: каждый запуск сверяет OCR с размеченными вручную страницами data/ocr_benchmark.json,
+по которым шаблоны не строились (страницы --bootstrap хранятся в файле шаблонов), и пишет
+accuracy.json в каталог результатов; analyze_graphics_llm.py --ocr не запускается, если
+accuracy.json нет, ни одно поле эталона не прочитано уверенно или есть хоть одна ошибка.
+
+Результат: data/graphics_ocr[_coverage]/page_XXX.json (bbox_px — пиксели PNG страницы) и accuracy.json
+
+Пример запуска:
+  python scripts/glyph_ocr.py --coverage --bootstrap --pages 1,2,3,4,5
+  python scripts/glyph_ocr.py --coverage
+"""
+import argparse
+import difflib
+import json
+import re
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from detect_page_regions import detect_regions, mask_runs
+from extract_text_layer import missing_fields
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+TEMPLATES_PATH = PROJECT_ROOT / "data" / "glyph_templates.npz"
+OUT_DIR_WITHOUT = PROJECT_ROOT / "data" / "graphics_ocr"
+OUT_DIR_COVERAGE = PROJECT_ROOT / "data" / "graphics_ocr_coverage"
+
+# Холст символа (строки, столбцы) — чуть больше символа: пустые поля холста одинаковы у всех
+# символов и только завышают корреляцию
+CELLS = {"ui": (16, 14), "log": (10, 7), "tick": (10, 8)}
+SHIFTS = [(dy, dx) for dy in (-2, -1, 0, 1, 2) for dx in (-1, 0, 1)]
+INK_FRACTION = 0.5        # порог «чернил» от максимума контраста области
+MIN_LINE_HEIGHT = 4
+SPACE_GAP = {"ui": 4, "log": 5}   # пустых столбцов между словами
+MONOSPACE = ("log",)
+PITCH_RANGE = (4.0, 10.0)  # допустимый шаг знакомест моноширинного шрифта, пиксели
+OUTLIER_NCC = 0.8         # образец, непохожий на среднее шаблона, — ошибка эталона
+TEMPLATES_PER_CHAR = 3
+MIN_CLUSTER_SHARE = 0.2   # кластер меньше этой доли образцов — систематическая ошибка эталона
+MIN_CONFIDENCE = 0.05      # минимальный отрыв NCC от второго кандидата по каждому символу поля
+REGION_FONTS = {"header": "ui", "status": "ui", "log": "log"}
+# Шаг знакомест цифр пропорционального шрифта (цифры в нём одной ширины) и узких знаков «.,:;»,
+# просвет за последним символом — по ним ширина числа предсказывается по числу символов, пиксели
+DIGIT_PITCH = {"ui": 8.0}
+NARROW_PITCH = {"ui": 4.0}
+GLYPH_GAP = {"ui": 2.0}
+NARROW_CHARS = ".,:;"
+# Размеченные вручную K и Pr страниц, не входивших в --bootstrap: точность OCR проверяется на них
+BENCHMARK_PATH = PROJECT_ROOT / "data" / "ocr_benchmark.json"
+ACCURACY_FILE = "accuracy.json"
+
+# Подписи строк лога, как они выведены программой (ключи — как в LOG_PATTERNS), и единицы
+LOG_LABELS = {
+    "research_date": ("Дата исследования", ""),
+    "relaxation_time_short_component_mks": ("Время релаксации короткой компоненты", "mks"),
+    "relaxation_time_long_component_mks": ("Время релаксации длинной компоненты", "mks"),
+    "amplitude_short_component_au": ("Амплитуда короткой компоненты", "a.u."),
+    "amplitude_long_component_au": ("Амплитуда длинной компоненты", "a.u."),
+    "calculated_crystallinity_index": ("Индекс кристалличности", ""),
+    "calculated_proton_density": ("Протонная плотность", ""),
+}
+# Поля, которые OCR читает с изображения; страница полна, если все они прочитаны уверенно
+OCR_REQUIRED_FIELDS = (
+    "header_data.structured_metrics.crystallinity_index",
+    "header_data.structured_metrics.proton_density",
+)
+OCR_REQUIRED_FIELDS_COVERAGE = OCR_REQUIRED_FIELDS + tuple(
+    f"log_panel_data.structured_log_metrics.{k}" for k in LOG_LABELS
+)
+HEADER_TAIL = "Индекс кристалличности = {k}; Протонная плотность = {pr}"
+NUMBER_RE = re.compile(r"^[-+]?\d+(?:\.\d+)?$")
+# K и Pr в строке заголовка программа выводит с пятью знаками после точки
+HEADER_VALUE_RE = re.compile(r"^\d+\.\d{5}$")
+DATE_RE = re.compile(r"^\d{2}\.\d{2}\.\d{4}$")
+TIME_RE = re.compile(r"^\d{1,2}:\d{2}:\d{2}$")
+NUMERIC_CHARS = "0123456789.:;-%"
+
+
+def ink_image(rgb):
+    """Контраст с фоном области (0..1): фон — медиана яркости, текст любого цвета светлее или темнее."""
+    import numpy as np
+
+    gray = rgb.astype("float32").mean(axis=2)
+    ink = np.abs(gray - np.median(gray))
+    peak = ink.max()
+    return ink / peak if peak > 0 else ink
+
+
+def _line_rows(mask) -> List[Tuple[int, int]]:
+    return mask_runs(mask.any(axis=1), min_len=MIN_LINE_HEIGHT)
+
+
+def monospace_pitch(mask) -> Tuple[float, float]:
+    """
+    Шаг и начало сетки знакомест моноширинного текста: левые края символов во всех строках
+    ложатся на решётку origin + k * pitch; шаг — максимум периодограммы по PITCH_RANGE.
+    """
+    import numpy as np
+
+    starts = np.array([s for y0, y1 in _line_rows(mask) for s, _ in mask_runs(mask[y0:y1].any(axis=0))], dtype=float)
+    if starts.size < 2:
+        return 0.0, 0.0
+    x0 = starts.min()
+    pitches = np.arange(PITCH_RANGE[0], PITCH_RANGE[1], 0.005)
+    phases = np.exp(2j * np.pi * (starts[None, :] - x0) / pitches[:, None]).mean(axis=1)
+    i = int(np.abs(phases).argmax())
+    pitch = float(pitches[i])
+    return pitch, x0 + float(np.angle(phases[i])) / (2 * np.pi) * pitch
+
+
+def segment(ink, font: str) -> List[List[List[Tuple[int, int, int, int]]]]:
+    """
+    Строки → слова → символы (bbox y0, y1, x0, x1 в пикселях области). Пропорциональный шрифт
+    режется по пустым столбцам, моноширинный — по сетке знакомест (слипшиеся при сжатии
+    символы не мешают).
+    """
+    import numpy as np
+
+    mask = ink > INK_FRACTION
+    pitch, origin = monospace_pitch(mask) if font in MONOSPACE else (0.0, 0.0)
+    lines = []
+    for y0, y1 in _line_rows(mask):
+        cols = mask_runs(mask[y0:y1].any(axis=0))
+        if not cols:
+            continue
+        if pitch:
+            k0 = int(np.floor((cols[0][0] - origin) / pitch + 0.5))
+            k1 = int(np.ceil((cols[-1][1] - origin) / pitch))
+            edges = [int(round(origin + k * pitch)) for k in range(k0, k1 + 1)]
+            # Знакоместо пустое, если чернила только в крайних столбцах — это край соседнего символа
+            cols = [(a, b) for a, b in zip(edges[:-1], edges[1:]) if mask[y0:y1, max(a + 1, 0):b - 1].any()]
+        words: List[List[Tuple[int, int]]] = []
+        prev_end = None
+        for x0, x1 in cols:
+            gap = SPACE_GAP[font] if not pitch else 1
+            if prev_end is None or x0 - prev_end >= gap:
+                words.append([])
+            words[-1].append((x0, x1))
+            prev_end = x1
+        # Вертикаль — по центру масс чернил первого слова: у всех строк лога это время, и
+        # строки, сдвинутые при сжатии на долю пикселя, ложатся на холст одинаково
+        a, b = max(words[0][0][0], 0), words[0][-1][1]
+        rows = ink[y0:y1, a:b].sum(axis=1)
+        cy = y0 + float((rows * np.arange(len(rows))).sum() / max(rows.sum(), 1e-6))
+        top = max(0, int(round(cy - (CELLS[font][0] - 1) / 2)))
+        lines.append([[(top, top + CELLS[font][0], max(x0, 0), x1) for x0, x1 in word] for word in words])
+    return lines
+
+
+def glyph_canvas(ink, box, font: str):
+    """
+    Символ на холсте шрифта: по вертикали — строка целиком (bbox из segment), по горизонтали — центр масс чернил
+    в центре холста (границы знакомест и столбцов режутся с точностью до пикселя, центр масс — нет).
+    """
+    import numpy as np
+
+    y0, y1, x0, x1 = box
+    h, w = CELLS[font]
+    crop = ink[y0:min(y1, y0 + h), x0:x1]
+    canvas = np.zeros((h, w), dtype="float32")
+    mass = crop.sum(axis=0)
+    if mass.sum() <= 0:
+        return canvas
+    cx = float((mass * np.arange(crop.shape[1])).sum() / mass.sum())
+    shift = int(round((w - 1) / 2 - cx))
+    src = np.arange(crop.shape[1])
+    dst = src + shift
+    ok = (dst >= 0) & (dst < w)
+    canvas[:crop.shape[0], dst[ok]] = crop[:, src[ok]]
+    return canvas
+
+
+def normalize_rows(vectors):
+    import numpy as np
+
+    v = vectors - vectors.mean(axis=1, keepdims=True)
+    norm = np.linalg.norm(v, axis=1, keepdims=True)
+    return v / np.maximum(norm, 1e-6)
+
+
+class GlyphTemplates:
+    """
+    Шаблоны символов по шрифтам: {font: (chars, templates[T, H, W])}; chars отсортированы, символ может повторяться.
+    pages — страницы (coverage, page), по которым шаблоны построены: в оценку точности они не входят.
+    """
+
+    def __init__(
+        self, fonts: Optional[Dict[str, Tuple[List[str], "object"]]] = None,
+        pages: Optional[List[Tuple[bool, int]]] = None,
+    ):
+        self.fonts = fonts or {}
+        self.pages = pages or []
+        self._bank: Dict[str, tuple] = {}
+
+    @classmethod
+    def load(cls, path: Path = TEMPLATES_PATH) -> "GlyphTemplates":
+        import numpy as np
+
+        data = np.load(path)
+        fonts = {}
+        for key in data.files:
+            if key.endswith("_chars"):
+                font = key[: -len("_chars")]
+                fonts[font] = ([str(c) for c in data[key]], data[f"{font}_templates"])
+        pages = [(bool(c), int(p)) for c, p in data["pages"]] if "pages" in data.files else []
+        return cls(fonts, pages)
+
+    def save(self, path: Path = TEMPLATES_PATH) -> None:
+        import numpy as np
+
+        arrays = {}
+        for font, (chars, templates) in self.fonts.items():
+            arrays[f"{font}_chars"] = np.array(chars)
+            arrays[f"{font}_templates"] = templates
+        arrays["pages"] = np.array(self.pages, dtype=int).reshape(-1, 2)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez_compressed(path, **arrays)
+
+    def _shifted(self, font: str):
+        """Матрица нормированных шаблонов со сдвигами SHIFTS: (T * len(SHIFTS), H * W) и индекс символа."""
+        import numpy as np
+
+        if font not in self._bank:
+            chars, templates = self.fonts[font]
+            variants = [np.roll(templates, (dy, dx), axis=(1, 2)) for dy, dx in SHIFTS]
+            bank = np.concatenate(variants).reshape(len(variants) * len(chars), -1)
+            owner = np.tile(np.arange(len(chars)), len(variants))
+            self._bank[font] = (normalize_rows(bank), owner)
+        return self._bank[font]
+
+    def match(self, font: str, canvases, charset: Optional[str] = None) -> Tuple[List[str], "object"]:
+        """
+        Символы и уверенность для стопки холстов [N, H, W]; charset ограничивает алфавит.
+        Уверенность — отрыв NCC лучшего шаблона от лучшего шаблона другого символа: похожие пары
+        (3/8, 2/7) на мелком шрифте дают высокую корреляцию с обоими, и сама корреляция ошибку не выдаёт.
+        """
+        import numpy as np
+
+        chars = self.fonts[font][0]
+        bank, _ = self._shifted(font)
+        scores = normalize_rows(canvases.reshape(len(canvases), -1)) @ bank.T
+        best = scores.reshape(len(canvases), len(SHIFTS), len(chars)).max(axis=1)
+        # Несколько шаблонов одного символа (шаблоны отсортированы по символу) → максимум по символу
+        starts = [0] + [i for i in range(1, len(chars)) if chars[i] != chars[i - 1]]
+        names = [chars[i] for i in starts]
+        per_char = np.maximum.reduceat(best, starts, axis=1)
+        if charset is not None:
+            allowed = [j for j, c in enumerate(names) if c in charset]
+            names = [names[j] for j in allowed]
+            per_char = per_char[:, allowed]
+        idx = per_char.argmax(axis=1)
+        if len(names) < 2:
+            return [names[0]] * len(canvases), per_char[:, 0]
+        top2 = np.partition(per_char, -2, axis=1)[:, -2:]
+        return [names[i] for i in idx], top2[:, 1] - top2[:, 0]
+
+
+def _is_numeric(text: str) -> bool:
+    return sum(c in NUMERIC_CHARS for c in text) * 2 >= len(text)
+
+
+def predicted_width(text: str, font: str) -> float:
+    """Ширина числа пропорционального шрифта в пикселях по числу цифр и узких знаков."""
+    return sum(NARROW_PITCH[font] if c in NARROW_CHARS else DIGIT_PITCH[font] for c in text) - GLYPH_GAP[font]
+
+
+def read_region(ink, font: str, templates: GlyphTemplates) -> List[List[Tuple[str, float]]]:
+    """
+    Строки области → слова (текст, уверенность = минимум по символам). Слова после «=» и слова
+    преимущественно из цифр перечитываются только по цифрам и разделителям (NUMERIC_CHARS):
+    на мелком шрифте цифры легко спутать с буквами (4/а, 8/В), а в числе букв не бывает.
+    Значение после «=» в пропорциональном шрифте, ширина которого не сходится с предсказанной
+    по числу символов (predicted_width), получает уверенность 0: слипшиеся цифры режутся как
+    один символ, и число читается с пропущенными цифрами.
+    """
+    import numpy as np
+
+    lines = segment(ink, font)
+    boxes = [box for words in lines for word in words for box in word]
+    if not boxes:
+        return []
+    canvases = np.stack([glyph_canvas(ink, b, font) for b in boxes])
+    chars, scores = templates.match(font, canvases)
+    spans: List[List[Tuple[int, int]]] = []
+    numeric: List[int] = []
+    widths: Dict[int, int] = {}
+    i = 0
+    for words in lines:
+        line = []
+        for w, word in enumerate(words):
+            text = "".join(chars[i:i + len(word)])
+            after_eq = w > 0 and "".join(chars[line[-1][0]:line[-1][1]]) == "="
+            if after_eq or _is_numeric(text):
+                numeric.extend(range(i, i + len(word)))
+            if after_eq and font in DIGIT_PITCH:
+                widths[i] = word[-1][3] - word[0][2]
+            line.append((i, i + len(word)))
+            i += len(word)
+        spans.append(line)
+    if numeric:
+        num_chars, num_scores = templates.match(font, canvases[numeric], NUMERIC_CHARS)
+        scores = scores.copy()
+        for j, c, sc in zip(numeric, num_chars, num_scores):
+            chars[j], scores[j] = c, sc
+    out = []
+    for line in spans:
+        words = []
+        for a, b in line:
+            text, score = "".join(chars[a:b]), float(scores[a:b].min())
+            if a in widths and abs(widths[a] - predicted_width(text, font)) > DIGIT_PITCH[font] / 2:
+                score = 0.0
+            words.append((text, score))
+        out.append(words)
+    return out
+
+
+def _value(word: Tuple[str, float], pattern=NUMBER_RE) -> Tuple[Optional[str], float]:
+    """Слово-значение без завершающей «;» → (текст, уверенность); не число — уверенность 0."""
+    text, score = word
+    text = text.rstrip(";")
+    return (text, score) if pattern.match(text) else (None, 0.0)
+
+
+def _put(section: dict, confidence: dict, key: str, text: Optional[str], score: float, number: bool = True) -> None:
+    confidence[key] = round(score, 4)
+    if text is not None:
+        section[key] = float(text) if number else text
+
+
+def parse_header_words(line: List[Tuple[str, float]]) -> dict:
+    """
+    Слова строки заголовка → header_data: значения после первого и второго «=» (ровно пять знаков
+    после точки). Распознанный текст строки — в ocr_text, а не в full_text: в нём бывают ошибки,
+    и подставлять его вместо текста, прочитанного моделью, нельзя.
+    """
+    texts = [w[0] for w in line]
+    eq = [i for i, t in enumerate(texts) if t == "=" and i + 1 < len(line)]
+    metrics: dict = {}
+    confidence: dict = {}
+    for key, i in zip(("crystallinity_index", "proton_density"), eq):
+        _put(metrics, confidence, key, *_value(line[i + 1], HEADER_VALUE_RE))
+    return {"ocr_text": " ".join(texts), "structured_metrics": metrics, "ocr_confidence": confidence}
+
+
+def _log_key(label: str, index: int) -> str:
+    """Ключ строки лога по распознанной подписи; при плохом распознавании — по порядку строк."""
+    names = {v[0]: k for k, v in LOG_LABELS.items()}
+    best = difflib.get_close_matches(label, list(names), n=1, cutoff=0.6)
+    if best:
+        return names[best[0]]
+    keys = list(LOG_LABELS)
+    return keys[min(index, len(keys) - 1)]
+
+
+def parse_log_words(lines: List[List[Tuple[str, float]]]) -> dict:
+    """Строки лога «ЧЧ:ММ:СС подпись = значение [единица]» → log_panel_data (распознанные строки — в ocr_lines)."""
+    metrics: dict = {}
+    confidence: dict = {}
+    raw, timestamp = [], ""
+    for index, line in enumerate(lines):
+        texts = [w[0] for w in line]
+        raw.append(" ".join(texts))
+        if texts and TIME_RE.match(texts[0]) and not timestamp:
+            timestamp = texts[0]
+        if "=" not in texts:
+            continue
+        eq = texts.index("=")
+        if eq + 1 >= len(line):
+            continue
+        key = _log_key(" ".join(texts[1:eq]), index)
+        if key in confidence:
+            continue
+        if key == "research_date":
+            _put(metrics, confidence, key, *_value(line[eq + 1], DATE_RE), number=False)
+        else:
+            _put(metrics, confidence, key, *_value(line[eq + 1]))
+    return {"timestamp": timestamp, "ocr_lines": raw, "structured_log_metrics": metrics, "ocr_confidence": confidence}
+
+
+def parse_status_words(line: List[Tuple[str, float]]) -> dict:
+    """Строка состояния: URTB %, АЦП %, два % смещения базы, затем числа буфера."""
+    percents = [w for w in line if w[0].endswith("%") and NUMBER_RE.match(w[0][:-1])]
+    numbers = [w for w in line if NUMBER_RE.match(w[0])]
+    out: dict = {}
+    confidence: dict = {}
+    for key, word in zip(("urtb", "adc"), percents[:2]):
+        _put(out, confidence, key, word[0], word[1], number=False)
+    if len(percents) >= 4:
+        _put(out, confidence, "base_offset", f"{percents[2][0]} {percents[3][0]}", min(percents[2][1], percents[3][1]), number=False)
+    if numbers:
+        _put(out, confidence, "numeric_values", " ".join(w[0] for w in numbers), min(w[1] for w in numbers), number=False)
+    out["ocr_confidence"] = confidence
+    return out
+
+
+# K и Pr выведены дважды — в строке заголовка и в логе; два независимых чтения проверяют друг друга
+CROSS_CHECK = (
+    ("crystallinity_index", "calculated_crystallinity_index"),
+    ("proton_density", "calculated_proton_density"),
+)
+
+
+def cross_check(graph: dict, require_both: bool = False) -> None:
+    """
+    Совпали K/Pr в заголовке и логе — уверенность 1; разошлись — 0 (поле уходит в API).
+    require_both (страницы с покрытием, где лог есть всегда): значение, которое не с чем сверить, — тоже 0.
+    """
+    header, log = graph.get("header_data"), graph.get("log_panel_data")
+    if not (header and log) and not require_both:
+        return
+    for hk, lk in CROSS_CHECK:
+        hv = header["structured_metrics"].get(hk) if header else None
+        lv = log["structured_log_metrics"].get(lk) if log else None
+        if hv is None and lv is None or (hv is None or lv is None) and not require_both:
+            continue
+        score = 1.0 if hv == lv else 0.0
+        if header:
+            header["ocr_confidence"][hk] = score
+        if log:
+            log["ocr_confidence"][lk] = score
+
+
+def _drop_unconfident(values: dict, confidence: dict, min_conf: float) -> None:
+    for key, score in confidence.items():
+        if score < min_conf:
+            values.pop(key, None)
+
+
+def ocr_page(rgb, page: int, templates: GlyphTemplates, coverage: bool, min_conf: float = MIN_CONFIDENCE) -> dict:
+    """Поля одной PNG-страницы в формате extract_text_layer.py (source = glyph_ocr)."""
+    graphs: Dict[int, dict] = {}
+    regions = detect_regions(rgb)
+    n_plots = len({r["graph_id"] for r in regions if r["kind"] == "plot"})
+    for region in regions:
+        font = REGION_FONTS.get(region["kind"])
+        if font is None or font not in templates.fonts or region["graph_id"] is None:
+            continue
+        x0, y0, x1, y1 = region["bbox"]
+        lines = read_region(ink_image(rgb[y0:y1, x0:x1]), font, templates)
+        if not lines:
+            continue
+        g = graphs.setdefault(region["graph_id"], {"graph_id": region["graph_id"]})
+        if region["kind"] == "header":
+            g["header_data"] = parse_header_words(lines[0])
+            g["header_data"]["bbox_px"] = region["bbox"]
+        elif region["kind"] == "log":
+            g["log_panel_data"] = parse_log_words(lines)
+            g["log_panel_data"]["bbox_px"] = region["bbox"]
+        else:
+            g["status_bar_data"] = parse_status_words(lines[0])
+            g["status_bar_data"]["bbox_px"] = region["bbox"]
+    ordered = [graphs[k] for k in sorted(graphs)]
+    for g in ordered:
+        cross_check(g, require_both=coverage)
+        if "header_data" in g:
+            _drop_unconfident(g["header_data"]["structured_metrics"], g["header_data"]["ocr_confidence"], min_conf)
+        if "log_panel_data" in g:
+            _drop_unconfident(g["log_panel_data"]["structured_log_metrics"], g["log_panel_data"]["ocr_confidence"], min_conf)
+        if "status_bar_data" in g:
+            _drop_unconfident(g["status_bar_data"], g["status_bar_data"]["ocr_confidence"], min_conf)
+    required = OCR_REQUIRED_FIELDS_COVERAGE if coverage else OCR_REQUIRED_FIELDS
+    missing = missing_fields(ordered, coverage, max(1, n_plots), required)
+    return {"page": page, "source": "glyph_ocr", "graphs": ordered, "missing_fields": missing}
+
+
+def score_benchmark(results: Dict[int, dict], entries: List[dict], coverage: bool) -> dict:
+    """
+    Сверка OCR с размеченными страницами: checked — уверенно прочитанные поля эталонных графиков
+    (K/Pr в заголовке и, с покрытием, в логе; размеченные строки лога из log), wrong — из них
+    неверные, unread — ушедшие бы в API.
+    """
+    checked = wrong = unread = 0
+    errors = []
+    for entry in entries:
+        graph = next((g for g in results[entry["page"]]["graphs"] if g["graph_id"] == entry["graph_id"]), {})
+        fields = [("header_data.structured_metrics", hk, entry[hk]) for hk, _ in CROSS_CHECK]
+        if coverage:
+            fields += [("log_panel_data.structured_log_metrics", lk, entry[hk]) for hk, lk in CROSS_CHECK]
+        fields += [("log_panel_data.structured_log_metrics", k, v) for k, v in (entry.get("log") or {}).items()]
+        for path, key, expected in fields:
+            section, values = path.split(".")
+            read = ((graph.get(section) or {}).get(values) or {}).get(key)
+            if read is None:
+                unread += 1
+                continue
+            checked += 1
+            if read != expected:
+                wrong += 1
+                errors.append({
+                    "page": entry["page"], "graph_id": entry["graph_id"],
+                    "field": f"{path}.{key}", "expected": expected, "read": read,
+                })
+    return {
+        "benchmark": str(BENCHMARK_PATH), "pages": sorted({e["page"] for e in entries}),
+        "checked": checked, "wrong": wrong, "unread": unread, "errors": errors,
+    }
+
+
+def accuracy_problem(out_dir: Path) -> Optional[str]:
+    """
+    Почему уверенным полям OCR из out_dir нельзя доверять пропуск запроса к API (None — можно):
+    точность на размеченных страницах (accuracy.json) не измерена, не проверено ни одно поле или есть ошибки.
+    """
+    path = out_dir / ACCURACY_FILE
+    try:
+        with open(path, encoding="utf-8") as f:
+            accuracy = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return f"нет {path}: точность OCR на размеченных страницах не измерена (запустите glyph_ocr.py)"
+    if not accuracy.get("checked"):
+        return f"ни одно поле размеченных страниц не прочитано уверенно ({path})"
+    if accuracy.get("wrong"):
+        return f"на размеченных страницах неверно {accuracy['wrong']} из {accuracy['checked']} уверенных полей ({path})"
+    return None
+
+
+def _fmt(value) -> Optional[str]:
+    if isinstance(value, (int, float)):
+        return repr(float(value)) if isinstance(value, float) else str(value)
+    return value if isinstance(value, str) and value else None
+
+
+def reference_lines(graph: dict, kind: str) -> List[Optional[str]]:
+    """Эталонный текст строк области из ответа vision-модели; None — строку не использовать."""
+    if kind == "header":
+        m = (graph.get("header_data") or {}).get("structured_metrics") or {}
+        k, pr = _fmt(m.get("crystallinity_index")), _fmt(m.get("proton_density"))
+        return [HEADER_TAIL.format(k=k, pr=pr)] if k and pr else [None]
+    log = graph.get("log_panel_data") or {}
+    m = log.get("structured_log_metrics") or {}
+    ts = log.get("timestamp") or ""
+    out = []
+    for key, (label, unit) in LOG_LABELS.items():
+        value = _fmt(m.get(key))
+        out.append(" ".join(t for t in (ts, label, "=", value, unit) if t) if value and ts else None)
+    return out
+
+
+def collect_samples(ink, font: str, refs: List[Optional[str]], samples: Dict[str, list], align_end: bool) -> int:
+    """
+    Образцы символов из строк области по эталонному тексту. Слова сопоставляются с конца строки
+    (align_end — у заголовка известен только хвост) или с начала; берутся слова с совпавшим числом символов.
+    """
+    lines = segment(ink, font)
+    if len(lines) != len(refs):
+        # Лишняя или пропущенная строка сдвинула бы все эталоны на строку
+        return 0
+    n = 0
+    for words, ref in zip(lines, refs):
+        if not ref:
+            continue
+        ref_words = ref.split()
+        if not align_end and len(words) != len(ref_words):
+            continue
+        pairs = zip(reversed(words), reversed(ref_words)) if align_end else zip(words, ref_words)
+        for boxes, text in pairs:
+            if len(boxes) != len(text):
+                continue
+            for box, ch in zip(boxes, text):
+                samples.setdefault(ch, []).append(glyph_canvas(ink, box, font))
+                n += 1
+    return n
+
+
+def build_templates(samples: Dict[str, list]) -> Tuple[List[str], "object"]:
+    """
+    До TEMPLATES_PER_CHAR шаблонов на символ: образцы кластеризуются по корреляции (k-средних) —
+    у мелкого шрифта один символ выглядит по-разному в зависимости от сдвига строки на доли пикселя.
+    Образцы, непохожие на свой кластер (NCC ниже OUTLIER_NCC), и мелкие кластеры считаются ошибками эталона.
+    """
+    import numpy as np
+
+    chars, templates = [], []
+    for ch in sorted(samples):
+        stack = np.stack(samples[ch])
+        vectors = normalize_rows(stack.reshape(len(stack), -1))
+        k = min(TEMPLATES_PER_CHAR, len(stack))
+        # Начальные центры — самые непохожие друг на друга образцы
+        centers = [int(np.argmax(vectors @ vectors.mean(axis=0)))]
+        while len(centers) < k:
+            centers.append(int(np.argmin((vectors @ vectors[centers].T).max(axis=1))))
+        centroids = vectors[centers]
+        for _ in range(10):
+            sim = vectors @ centroids.T
+            label = sim.argmax(axis=1)
+            keep = sim.max(axis=1) >= OUTLIER_NCC
+            centroids = normalize_rows(np.stack([
+                vectors[(label == j) & keep].mean(axis=0) if ((label == j) & keep).any() else centroids[j]
+                for j in range(k)
+            ]))
+        for j in range(k):
+            members = (label == j) & keep
+            if members.sum() >= MIN_CLUSTER_SHARE * len(stack):
+                chars.append(ch)
+                templates.append(stack[members].mean(axis=0).astype("float32"))
+    return chars, np.stack(templates)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Чтение K, Pr, лога и строки состояния по шаблонам символов")
+    parser.add_argument("--coverage", action="store_true", help="Страницы «с покрытием» (data/graphics_pages_coverage)")
+    parser.add_argument("--pages", type=str, default=None, help="Номера страниц через запятую (по умолчанию — все)")
+    parser.add_argument("--bootstrap", action="store_true", help="Построить шаблоны по страницам --pages и ответам vision-модели")
+    parser.add_argument("--templates", type=str, default=str(TEMPLATES_PATH), help="Файл шаблонов (.npz)")
+    parser.add_argument("--min-confidence", type=float, default=MIN_CONFIDENCE, help="Минимальный отрыв NCC по символам поля (иначе поле уходит в API)")
+    parser.add_argument("--out-dir", type=str, default=None, help="Каталог для page_XXX.json")
+    args = parser.parse_args()
+
+    try:
+        import numpy as np
+        from PIL import Image
+    except ImportError:
+        print("Install: pip install numpy Pillow", file=sys.stderr)
+        return 1
+
+    suffix = "_coverage" if args.coverage else ""
+    pages_dir = PROJECT_ROOT / "data" / f"graphics_pages{suffix}"
+    llm_dir = PROJECT_ROOT / "data" / f"graphics_llm{suffix}"
+    templates_path = Path(args.templates)
+    paths = sorted(pages_dir.glob("page_*.png"))
+    if args.pages:
+        wanted = {int(x.strip()) for x in args.pages.split(",")}
+        paths = [p for p in paths if int(p.stem.split("_")[1]) in wanted]
+    if not paths:
+        print(f"Нет page_*.png в {pages_dir}. Сначала выполните extract_graphics_pages.py", file=sys.stderr)
+        return 1
+
+    if args.bootstrap:
+        samples: Dict[str, Dict[str, list]] = {}
+        used: List[Tuple[bool, int]] = []
+        n = 0
+        for path in paths:
+            ref_file = llm_dir / f"page_{int(path.stem.split('_')[1]):03d}.json"
+            if not ref_file.exists():
+                continue
+            used.append((args.coverage, int(path.stem.split("_")[1])))
+            with open(ref_file, encoding="utf-8") as f:
+                refs = {g.get("graph_id"): g for g in json.load(f).get("graphs") or [] if isinstance(g, dict)}
+            rgb = np.asarray(Image.open(path).convert("RGB"))
+            for region in detect_regions(rgb):
+                if region["kind"] not in ("header", "log") or region["graph_id"] not in refs:
+                    continue
+                x0, y0, x1, y1 = region["bbox"]
+                font = REGION_FONTS[region["kind"]]
+                n += collect_samples(
+                    ink_image(rgb[y0:y1, x0:x1]), font, reference_lines(refs[region["graph_id"]], region["kind"]),
+                    samples.setdefault(font, {}), align_end=region["kind"] == "header",
+                )
+        templates = GlyphTemplates({font: build_templates(s) for font, s in samples.items() if s}, used)
+        if not templates.fonts:
+            print(f"Нет образцов: нужны ответы vision-модели в {llm_dir} для выбранных страниц", file=sys.stderr)
+            return 1
+        templates.save(templates_path)
+        for font, (chars, _) in templates.fonts.items():
+            print(f"Шрифт {font}: {len(chars)} символов ({''.join(chars)})")
+        print(f"Образцов: {n}. Шаблоны: {templates_path}")
+        return 0
+
+    if not templates_path.exists():
+        print(f"Нет шаблонов {templates_path}. Сначала: python scripts/glyph_ocr.py --bootstrap --pages 1,2,3", file=sys.stderr)
+        return 1
+    templates = GlyphTemplates.load(templates_path)
+    out_dir = Path(args.out_dir) if args.out_dir else (OUT_DIR_COVERAGE if args.coverage else OUT_DIR_WITHOUT)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    t0 = time.perf_counter()
+    complete = n_fields = n_confident = n_graphs = 0
+    field_counts: Dict[str, int] = {}
+    results: Dict[int, dict] = {}
+    for path in paths:
+        page = int(path.stem.split("_")[1])
+        result = results[page] = ocr_page(
+            np.asarray(Image.open(path).convert("RGB")), page, templates, args.coverage, args.min_confidence,
+        )
+        with open(out_dir / f"page_{page:03d}.json", "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        n_graphs += len(result["graphs"])
+        for g in result["graphs"]:
+            for section in ("header_data", "log_panel_data", "status_bar_data"):
+                conf = (g.get(section) or {}).get("ocr_confidence") or {}
+                n_fields += len(conf)
+                n_confident += sum(1 for s in conf.values() if s >= args.min_confidence)
+        if not result["missing_fields"]:
+            complete += 1
+        for field in result["missing_fields"]:
+            name = field.split(":", 1)[-1]
+            field_counts[name] = field_counts.get(name, 0) + 1
+    elapsed = time.perf_counter() - t0
+
+    # Точность — на размеченных страницах, по которым шаблоны не строились; analyze_graphics_llm.py --ocr
+    # без accuracy.json или с ошибками на эталоне не запускается
+    held_out = []
+    if BENCHMARK_PATH.exists():
+        with open(BENCHMARK_PATH, encoding="utf-8") as f:
+            held_out = [
+                e for e in json.load(f)["pages"]
+                if e["coverage"] == args.coverage and (args.coverage, e["page"]) not in templates.pages
+                and (pages_dir / f"page_{e['page']:03d}.png").exists()
+            ]
+    for page in sorted({e["page"] for e in held_out} - set(results)):
+        rgb = np.asarray(Image.open(pages_dir / f"page_{page:03d}.png").convert("RGB"))
+        results[page] = ocr_page(rgb, page, templates, args.coverage, args.min_confidence)
+    accuracy = score_benchmark(results, held_out, args.coverage)
+    with open(out_dir / ACCURACY_FILE, "w", encoding="utf-8") as f:
+        json.dump(accuracy, f, ensure_ascii=False, indent=2)
+
+    print(f"Страниц: {len(paths)}, полностью без API: {complete}, нужен vision-запрос: {len(paths) - complete}")
+    print(
+        f"Полей прочитано: {n_fields}, уверенно: {n_confident}; {n_fields / max(elapsed, 1e-9):.0f} полей/с, "
+        f"уверенных {n_confident / max(elapsed, 1e-9):.0f} полей/с (с разметкой страниц)"
+    )
+    print(f"Обязательные поля OCR не прочитаны уверенно (из {n_graphs} графиков):")
+    for name, n in sorted(field_counts.items(), key=lambda kv: -kv[1]):
+        print(f"  {name} — {n}")
+    print(
+        f"Эталон {BENCHMARK_PATH.name} ({len(accuracy['pages'])} страниц вне --bootstrap): уверенно прочитано "
+        f"{accuracy['checked']} полей, из них неверно {accuracy['wrong']}; не прочитано {accuracy['unread']}"
+    )
+    for e in accuracy["errors"]:
+        print(f"  страница {e['page']}, график {e['graph_id']}: {e['field']} = {e['read']}, в эталоне {e['expected']}")
+    print(f"Результаты: {out_dir}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
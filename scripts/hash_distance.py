@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Расстояния Хэмминга между 64-битными перцептивными хэшами (phash/dhash/whash, hash_size 8)
+одним векторным проходом NumPy вместо двойного цикла по объектам imagehash.
+
+Хэши упаковываются в массив uint64; матрица попарных расстояний считается плитками
+TILE: XOR строк плитки со столбцами и popcount (np.bitwise_count, для NumPy < 2 —
+побитовый SWAR). Запрос по порогу сразу возвращает пары (i, j, расстояние), полная матрица
+в память не кладётся. Для одного набора берётся только верхний треугольник (i < j).
+
+Бенчмарк (случайные хэши с подмешанными близкими копиями, сверка с imagehash на малом n):
+  python scripts/hash_distance.py --n 100000
+"""
+import argparse
+import sys
+import time
+from typing import Iterable, Tuple
+
+TILE = (128, 4096)   # строки × столбцы плитки: 4 МБ XOR остаются в кэше (квадрат 2048×2048 вдвое медленнее)
+
+# Маски SWAR-popcount для NumPy без bitwise_count
+_M1, _M2, _M4, _H01 = 0x5555555555555555, 0x3333333333333333, 0x0F0F0F0F0F0F0F0F, 0x0101010101010101
+
+
+def pack_hashes(hex_hashes: Iterable[str]):
+    """Строки imagehash (16 hex-символов) → uint64; расстояние то же, что у hex_to_hash(a) - hex_to_hash(b)."""
+    import numpy as np
+
+    out = []
+    for h in hex_hashes:
+        if len(h) != 16:
+            raise ValueError(f"ожидается 64-битный хэш (16 hex-символов), получено {h!r}")
+        out.append(int(h, 16))
+    return np.array(out, dtype=np.uint64)
+
+
+def popcount(x, out=None):
+    """Число единичных битов каждого элемента uint64 (uint8)."""
+    import numpy as np
+
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(x, out=out)
+    m1, m2, m4, h01 = (np.uint64(m) for m in (_M1, _M2, _M4, _H01))
+    x = x - ((x >> np.uint64(1)) & m1)
+    x = (x & m2) + ((x >> np.uint64(2)) & m2)
+    x = (x + (x >> np.uint64(4))) & m4
+    res = ((x * h01) >> np.uint64(56)).astype(np.uint8)
+    if out is not None:
+        out[...] = res
+        return out
+    return res
+
+
+def distance_matrix(a, b=None):
+    """Полная матрица расстояний len(a)×len(b) (uint8) — для небольших наборов."""
+    b = a if b is None else b
+    return popcount(a[:, None] ^ b[None, :])
+
+
+def pairs_within(
+    a, max_distance: int, b=None, min_distance: int = 0, tile: Tuple[int, int] = TILE,
+) -> tuple:
+    """
+    Пары с min_distance ≤ расстояние ≤ max_distance: массивы (i, j, d), отсортированные по (i, j).
+    Без b — пары внутри a (uint64) с i < j; с b — все пары a[i]×b[j].
+    """
+    import numpy as np
+
+    same = b is None
+    b = a if same else b
+    rows_n, cols_n = tile
+    xor = np.empty(rows_n * cols_n, dtype=np.uint64)
+    cnt = np.empty(rows_n * cols_n, dtype=np.uint8)
+    hit = np.empty(rows_n * cols_n, dtype=bool)
+    found_i, found_j, found_d = [], [], []
+    for i0 in range(0, len(a), rows_n):
+        rows = a[i0:i0 + rows_n]
+        # Для одного набора — только плитки, задевающие верхний треугольник
+        for j0 in range((i0 // cols_n) * cols_n if same else 0, len(b), cols_n):
+            cols = b[j0:j0 + cols_n]
+            size = len(rows) * len(cols)
+            x = xor[:size].reshape(len(rows), len(cols))
+            c, m = cnt[:size], hit[:size]
+            np.bitwise_xor(rows[:, None], cols[None, :], out=x)
+            popcount(xor[:size], out=c)
+            np.less_equal(c, max_distance, out=m)
+            if min_distance > 0:
+                m &= c >= min_distance
+            flat = np.flatnonzero(m)
+            if not len(flat):
+                continue
+            ii, jj = np.divmod(flat, len(cols))
+            ii += i0
+            jj += j0
+            d = c[flat]
+            if same and j0 < i0 + len(rows):
+                keep = ii < jj
+                ii, jj, d = ii[keep], jj[keep], d[keep]
+            found_i.append(ii)
+            found_j.append(jj)
+            found_d.append(d)
+    if not found_i:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty.copy(), np.empty(0, dtype=np.uint8)
+    i, j, d = np.concatenate(found_i), np.concatenate(found_j), np.concatenate(found_d)
+    order = np.lexsort((j, i))
+    return i[order], j[order], d[order]
+
+
+def _synthetic(n: int, near_fraction: float, rng):
+    """Случайные хэши; часть — копии других с 1–3 перевёрнутыми битами."""
+    import numpy as np
+
+    a = rng.integers(0, np.iinfo(np.uint64).max, size=n, dtype=np.uint64, endpoint=True)
+    n_near = int(n * near_fraction)
+    src = rng.integers(0, n, size=n_near)
+    dst = rng.integers(0, n, size=n_near)
+    for s, d in zip(src, dst):
+        flip = 0
+        for bit in rng.choice(64, size=int(rng.integers(1, 4)), replace=False):
+            flip |= 1 << int(bit)
+        a[d] = a[s] ^ np.uint64(flip)
+    return a
+
+
+def _naive(hexes, threshold: int):
+    """Прежний поиск graphics_duplicate_check.py: двойной цикл с hex_to_hash во внутреннем цикле."""
+    import imagehash
+
+    pairs = []
+    for i, x in enumerate(hexes):
+        hx = imagehash.hex_to_hash(x)
+        for j in range(i + 1, len(hexes)):
+            d = hx - imagehash.hex_to_hash(hexes[j])
+            if d <= threshold:
+                pairs.append((i, j, int(d)))
+    return pairs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк поиска близких 64-битных хэшей: векторный XOR+popcount против двойного цикла")
+    parser.add_argument("--n", type=str, default="1000,10000,100000", help="Размеры наборов через запятую")
+    parser.add_argument("--threshold", type=int, default=3, help="Порог расстояния (как NEAR_DUP_THRESHOLD)")
+    parser.add_argument("--check", type=int, default=800, help="Размер набора для сверки с imagehash и замера старого цикла (0 — без сверки)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    try:
+        import numpy as np
+    except ImportError:
+        print("Install: pip install numpy", file=sys.stderr)
+        return 1
+    rng = np.random.default_rng(args.seed)
+    popcount_kind = "np.bitwise_count" if hasattr(np, "bitwise_count") else "SWAR"
+    print(f"NumPy {np.__version__}, popcount: {popcount_kind}, плитка {TILE[0]}×{TILE[1]}, порог {args.threshold}")
+
+    if args.check:
+        try:
+            import imagehash  # noqa: F401
+        except ImportError:
+            print("Install: pip install imagehash", file=sys.stderr)
+            return 1
+        a = _synthetic(args.check, 0.05, rng)
+        hexes = [f"{int(h):016x}" for h in a]
+        t0 = time.perf_counter()
+        expected = _naive(hexes, args.threshold)
+        naive_s = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        i, j, d = pairs_within(pack_hashes(hexes), args.threshold)
+        fast_s = time.perf_counter() - t0
+        got = list(zip(i.tolist(), j.tolist(), d.tolist()))
+        if got != expected:
+            print(f"Расхождение с imagehash: {len(got)} пар против {len(expected)}", file=sys.stderr)
+            return 1
+        per_pair = naive_s / (args.check * (args.check - 1) / 2)
+        print(f"Сверка n={args.check}: пар {len(got)} совпадают с imagehash; двойной цикл {naive_s:.2f} с, "
+              f"векторно {fast_s * 1000:.1f} мс (двойной цикл на 100k — около {per_pair * 100_000 ** 2 / 2 / 3600:.0f} ч)")
+
+    for n in (int(x) for x in args.n.split(",")):
+        a = _synthetic(n, 0.01, rng)
+        t0 = time.perf_counter()
+        i, j, d = pairs_within(a, args.threshold)
+        elapsed = time.perf_counter() - t0
+        pairs = n * (n - 1) / 2
+        print(f"n={n}: {pairs:.3g} пар за {elapsed:.2f} с ({elapsed / pairs * 1e9:.2f} нс/пара), найдено {len(i)} пар ≤ {args.threshold}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+"""
+Постоянный индекс перцептивных хэшей по всем делам (SQLite): повтор кривой ЯМР может
+прийти из другого заключения, а graphics_hashes.json покрывает только текущее.
+
+Хранятся 64-битные хэши с меткой дела, источника (PDF или каталог страниц) и режима
+получения хэша (mode): phash страницы из 2x PNG и из PDF, отрисованного в 256 px, отличаются
+на 0–2 бита, поэтому сравниваются только хэши одного режима. Виды хэшей:
+  - phash/dhash/whash страницы целиком (graph_id = 0; режим "png" или "pdf<сторона>");
+  - phash маски каждой кривой поля графика — curve_red / curve_blue / curve_green
+    (panel_fingerprints.py; режим "panel" — поле вырезается в полном разрешении в обоих режимах).
+
+Поиск соседей — multi-index hashing: хэш делится на CHUNKS частей по 16 бит, у каждой части
+свой индекс SQLite. Если расстояние до хэша ≤ r, то хотя бы одна часть отличается не больше
+чем на r // CHUNKS бит (принцип Дирихле), поэтому кандидаты — записи, у которых какая-либо
+часть совпадает с одним из соседей части запроса; точное расстояние считается только по ним.
+Это быстро, только если значения частей разнообразны. У phash страниц этого набора меняются
+18 бит из 64 (старшие 32 бита одинаковы у всех страниц), корзины частей содержат все записи,
+и запрос по странице целиком — полный перебор (около 3.5 мс на тысячу записей). Поэтому
+запрос вида страницы к индексу, где записей этого вида и режима больше PAGE_SCAN_LIMIT,
+отклоняется (PageScanRefused), если перебор не разрешён явно. Хэши масок кривых меняются
+почти во всех битах (на 312 полях 220–286 разных значений каждой части), поэтому совпадения
+между делами ищутся по кривым, а хэши страниц хранятся для справки и ручных запросов.
+
+graphics_duplicate_check.py --case ИМЯ пополняет индекс и дописывает в отчёт совпадения
+с другими делами. Отдельно:
+  python scripts/hash_index.py                       # дела и число записей
+  python scripts/hash_index.py --add data/graphics_hashes.json --case дело-1 --mode png
+  python scripts/hash_index.py --query fa7a857a85c07a85 --kind curve_red --radius 9
+  python scripts/hash_index.py --benchmark 1000000 --kind curve_red --radius 9   # кривые data/graphics_pages
+  python scripts/hash_index.py --benchmark 100000 --like data/graphics_hashes.json
+"""
+import argparse
+import json
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from itertools import combinations
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+INDEX_PATH = PROJECT_ROOT / "data" / "hash_index.sqlite"
+PAGES_DIR = PROJECT_ROOT / "data" / "graphics_pages"
+
+HASH_KINDS = ("phash", "dhash", "whash")
+CURVE_KINDS = ("curve_red", "curve_blue", "curve_green")
+PANEL_MODE = "panel"
+CHUNKS = 4
+CHUNK_BITS = 64 // CHUNKS
+DEFAULT_RADIUS = 3   # как NEAR_DUP_THRESHOLD в graphics_duplicate_check.py
+PAGE_SCAN_LIMIT = 10_000   # записей вида страницы одного режима: больше — запрос перебирает слишком долго
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (
+    case_name TEXT NOT NULL,
+    source TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    graph_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    hash INTEGER NOT NULL,
+    c0 INTEGER NOT NULL,
+    c1 INTEGER NOT NULL,
+    c2 INTEGER NOT NULL,
+    c3 INTEGER NOT NULL,
+    added REAL NOT NULL,
+    PRIMARY KEY (case_name, source, mode, page, graph_id, kind)
+);
+""" + "".join(f"CREATE INDEX IF NOT EXISTS hashes_c{k} ON hashes (kind, mode, c{k});\n" for k in range(CHUNKS))
+
+
+def chunks_of(value: int) -> List[int]:
+    """64-битный хэш → CHUNKS частей по CHUNK_BITS бит (старшая первой)."""
+    mask = (1 << CHUNK_BITS) - 1
+    return [(value >> (CHUNK_BITS * (CHUNKS - 1 - k))) & mask for k in range(CHUNKS)]
+
+
+def _signed(value: int) -> int:
+    """SQLite хранит INTEGER со знаком: uint64 → int64 того же битового вида."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _unsigned(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+def _neighbours(chunk: int, radius: int) -> List[int]:
+    """Все значения части на расстоянии ≤ radius бит от chunk."""
+    out = [chunk]
+    for r in range(1, radius + 1):
+        for bits in combinations(range(CHUNK_BITS), r):
+            flip = 0
+            for b in bits:
+                flip |= 1 << b
+            out.append(chunk ^ flip)
+    return out
+
+
+def _as_int(value) -> int:
+    return int(value, 16) if isinstance(value, str) else int(value)
+
+
+class PageScanRefused(ValueError):
+    """Запрос хэша страницы к большому индексу: корзины частей не отсеивают записи, был бы полный перебор."""
+
+
+class HashIndex:
+    """Индекс хэшей страниц и кривых полей; один объект можно использовать из нескольких потоков."""
+
+    def __init__(self, path: Path = INDEX_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._migrate()
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+        self.candidates = 0   # кандидатов, проверенных последним query (для --benchmark)
+        self._counts: Dict[tuple, int] = {}   # записей по (kind, mode) для PAGE_SCAN_LIMIT
+
+    def _migrate(self) -> None:
+        """Индекс без режима хэша: записи сохраняются с mode = "" и ни с чем не сравниваются."""
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(hashes)")]
+        if not columns or "mode" in columns:
+            return
+        self._conn.execute("ALTER TABLE hashes RENAME TO hashes_v1")
+        for k in range(CHUNKS):
+            self._conn.execute(f"DROP INDEX IF EXISTS hashes_c{k}")
+        self._conn.executescript(_SCHEMA)
+        self._conn.execute(
+            "INSERT INTO hashes SELECT case_name, source, '', page, 0, kind, hash, c0, c1, c2, c3, added FROM hashes_v1"
+        )
+        self._conn.execute("DROP TABLE hashes_v1")
+        self._conn.commit()
+
+    def _insert(self, rows: List[tuple]) -> int:
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO hashes (case_name, source, mode, page, graph_id, kind, hash, c0, c1, c2, c3, added) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+            self._counts.clear()
+        return len(rows)
+
+    def add(self, case: str, source: str, mode: str, pages: Iterable[dict], kinds: Iterable[str] = HASH_KINDS) -> int:
+        """
+        Записать хэши страниц дела (записи как в graphics_hashes.json: page и hex-хэши по видам),
+        полученные в режиме mode; повторная запись той же страницы заменяет прежнюю. Число записей.
+        """
+        now = time.time()
+        rows = []
+        for p in pages:
+            for kind in kinds:
+                if not p.get(kind):
+                    continue
+                value = _as_int(p[kind])
+                rows.append((case, source, mode, int(p["page"]), 0, kind, _signed(value), *chunks_of(value), now))
+        return self._insert(rows)
+
+    def add_panels(self, case: str, source: str, panels: Iterable[dict]) -> int:
+        """Записать phash масок кривых полей графиков (записи panel_fingerprints.py). Число записей."""
+        now = time.time()
+        rows = []
+        for panel in panels:
+            for color, curve in panel["curves"].items():
+                value = _as_int(curve["phash"])
+                rows.append((
+                    case, source, PANEL_MODE, int(panel["page"]), int(panel["graph_id"]), f"curve_{color}",
+                    _signed(value), *chunks_of(value), now,
+                ))
+        return self._insert(rows)
+
+    def count(self, kind: str, mode: str) -> int:
+        """Число записей вида kind и режима mode."""
+        with self._lock:
+            if (kind, mode) not in self._counts:
+                self._counts[kind, mode] = self._conn.execute(
+                    "SELECT COUNT(*) FROM hashes WHERE kind = ? AND mode = ?", (kind, mode)
+                ).fetchone()[0]
+            return self._counts[kind, mode]
+
+    def query(
+        self, value, kind: str = "phash", mode: str = "png", radius: int = DEFAULT_RADIUS,
+        exclude_case: Optional[str] = None, allow_scan: bool = False,
+    ) -> List[dict]:
+        """
+        Записи индекса вида kind и режима mode на расстоянии ≤ radius от хэша value (hex или int), ближние первыми.
+        Вид страницы (HASH_KINDS) при числе записей больше PAGE_SCAN_LIMIT — PageScanRefused, если не allow_scan.
+        """
+        if kind in HASH_KINDS and not allow_scan and self.count(kind, mode) > PAGE_SCAN_LIMIT:
+            raise PageScanRefused(
+                f"{kind} ({mode}): {self.count(kind, mode)} записей больше PAGE_SCAN_LIMIT = {PAGE_SCAN_LIMIT}; "
+                "запрос по странице целиком — полный перебор индекса, ищите по кривым полей"
+            )
+        value = _as_int(value)
+        probe = [_neighbours(c, radius // CHUNKS) for c in chunks_of(value)]
+        parts = []
+        params: list = []
+        for k, values in enumerate(probe):
+            parts.append(
+                "SELECT case_name, source, page, graph_id, hash FROM hashes "
+                f"WHERE kind = ? AND mode = ? AND c{k} IN ({', '.join('?' * len(values))})"
+            )
+            params += [kind, mode, *values]
+        with self._lock:
+            rows = self._conn.execute(" UNION ".join(parts), params).fetchall()
+        self.candidates = len(rows)
+        out = []
+        for case, source, page, graph_id, stored in rows:
+            if case == exclude_case:
+                continue
+            distance = (value ^ _unsigned(stored)).bit_count()
+            if distance <= radius:
+                out.append({"case": case, "source": source, "page": page, "graph_id": graph_id, "distance": distance})
+        out.sort(key=lambda m: (m["distance"], m["case"], m["source"], m["page"], m["graph_id"]))
+        return out
+
+    def panel_curves(self, case: str, source: str, page: int, graph_id: int) -> Dict[str, str]:
+        """Hex-phash масок кривых одного поля из индекса: {color: hash}."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT kind, hash FROM hashes WHERE case_name = ? AND source = ? AND mode = ? AND page = ? AND graph_id = ?",
+                (case, source, PANEL_MODE, page, graph_id),
+            ).fetchall()
+        return {kind[len("curve_"):]: f"{_unsigned(h):016x}" for kind, h in rows if kind in CURVE_KINDS}
+
+    def cases(self) -> List[dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT case_name, COUNT(DISTINCT source || '#' || page), COUNT(DISTINCT source), "
+                "GROUP_CONCAT(DISTINCT mode), MAX(added) FROM hashes GROUP BY case_name ORDER BY MAX(added)"
+            ).fetchall()
+        return [{"case": c, "pages": p, "sources": s, "modes": (m or "").split(","), "added": a} for c, p, s, m, a in rows]
+
+    def remove_case(self, case: str) -> int:
+        with self._lock:
+            n = self._conn.execute("DELETE FROM hashes WHERE case_name = ?", (case,)).rowcount
+            self._conn.commit()
+            self._counts.clear()
+        return n
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def like_hashes(path: Path, kind: str) -> List[int]:
+    """
+    Хэши вида kind из graphics_hashes.json (виды страницы) или graphics_panel_hashes.json (curve_*).
+    path — каталог page_*.png: хэши считаются по страницам на месте, кривые — panel_fingerprints
+    (graphics_panel_hashes.json пишется только с graphics_duplicate_check.py --panels).
+    """
+    if path.is_dir():
+        import numpy as np
+        from PIL import Image
+
+        out = []
+        for png in sorted(path.glob("page_*.png")):
+            with Image.open(png) as img:
+                img.load()
+                if kind in CURVE_KINDS:
+                    from panel_fingerprints import panel_fingerprints
+
+                    color = kind[len("curve_"):]
+                    panels = panel_fingerprints(np.asarray(img.convert("RGB")), 0)
+                    out += [_as_int(p["curves"][color]["phash"]) for p in panels if color in p["curves"]]
+                else:
+                    import imagehash
+
+                    out.append(_as_int(str(getattr(imagehash, kind)(img))))
+        return out
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if kind in CURVE_KINDS:
+        color = kind[len("curve_"):]
+        return [_as_int(p["curves"][color]["phash"]) for p in data.get("panels") or [] if color in p["curves"]]
+    return [_as_int(h[kind]) for h in data.get("hashes") or [] if h.get(kind)]
+
+
+def sample_like(real: List[int], size: int, rng):
+    """
+    Случайные хэши с той же долей единиц в каждом бите, что у real: постоянные биты реальных
+    хэшей (и перекос корзин частей) сохраняются. Без real — равномерные 64 бита.
+    """
+    import numpy as np
+
+    if not real:
+        return rng.integers(0, np.iinfo(np.uint64).max, size=size, dtype=np.uint64, endpoint=True)
+    values = np.array(real, dtype=np.uint64)
+    shifts = np.arange(64, dtype=np.uint64)
+    p = ((values[:, None] >> shifts) & np.uint64(1)).mean(axis=0)
+    bits = (rng.random((size, 64)) < p).astype(np.uint64)
+    return (bits << shifts).sum(axis=1, dtype=np.uint64)
+
+
+def benchmark(n: int, queries: int, radius: int, kind: str = "phash", like: Optional[Path] = None) -> Dict[str, float]:
+    """
+    Временный индекс из n хэшей (с распределением битов как у хэшей файла like, иначе равномерных;
+    у части запросов — подмешанные соседи): время вставки, среднее и p99 время запроса, кандидатов
+    на запрос; ответы сверяются с полным перебором hash_distance.pairs_within.
+    """
+    import numpy as np
+
+    from hash_distance import pairs_within
+    from vision_metrics import percentile
+
+    rng = np.random.default_rng(0)
+    real = like_hashes(like, kind) if like else []
+    values = sample_like(real, n, rng)
+    q = sample_like(real, queries, rng)
+    # Половина запросов — копии записей индекса с 1..radius перевёрнутыми битами
+    for k in range(queries // 2):
+        flip = 0
+        for b in rng.choice(64, size=int(rng.integers(1, radius + 1)), replace=False):
+            flip |= 1 << int(b)
+        q[k] = values[rng.integers(0, n)] ^ np.uint64(flip)
+
+    mode = PANEL_MODE if kind in CURVE_KINDS else "bench"
+    with tempfile.TemporaryDirectory() as tmp:
+        index = HashIndex(Path(tmp) / "bench.sqlite")
+        t0 = time.perf_counter()
+        batch = 100_000
+        for s in range(0, n, batch):
+            index.add("bench", "synthetic", mode, ({"page": s + i, kind: int(v)} for i, v in enumerate(values[s:s + batch].tolist())), (kind,))
+        insert_s = time.perf_counter() - t0
+        times, found, candidates = [], 0, 0
+        for v in q.tolist():
+            t0 = time.perf_counter()
+            found += len(index.query(v, kind, mode, radius, allow_scan=True))
+            times.append(time.perf_counter() - t0)
+            candidates += index.candidates
+        index.close()
+    expected = len(pairs_within(q, radius, b=values)[0])
+    return {
+        "n": n,
+        "like": len(real),
+        "insert_s": insert_s,
+        "query_ms_mean": 1000 * sum(times) / len(times),
+        "query_ms_p99": 1000 * percentile(times, 99),
+        "candidates_mean": candidates / len(times),
+        "found": found,
+        "expected": expected,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Индекс перцептивных хэшей страниц и кривых по всем делам")
+    parser.add_argument("--path", type=str, default=str(INDEX_PATH), help="Файл индекса")
+    parser.add_argument("--add", type=str, default=None, help="Добавить хэши из graphics_hashes.json (нужны --case и --mode)")
+    parser.add_argument("--case", type=str, default=None, help="Метка дела для --add")
+    parser.add_argument("--source", type=str, default=None, help="Источник для --add (по умолчанию — имя JSON)")
+    parser.add_argument("--mode", type=str, default=None, help="Режим хэшей: png (2x PNG), pdf256 (PDF в 256 px), panel (кривые полей)")
+    parser.add_argument("--remove", type=str, default=None, help="Удалить все записи дела")
+    parser.add_argument("--query", type=str, default=None, help="Hex-хэш: ближайшие записи индекса")
+    parser.add_argument("--kind", choices=HASH_KINDS + CURVE_KINDS, default="phash")
+    parser.add_argument("--radius", type=int, default=DEFAULT_RADIUS, help="Максимальное расстояние Хэмминга")
+    parser.add_argument("--benchmark", type=int, default=None, metavar="N", help="Замер на временном индексе из N хэшей")
+    parser.add_argument("--like", type=str, default=None,
+                        help="Для --benchmark: распределение битов как у хэшей --kind из graphics_hashes.json, graphics_panel_hashes.json "
+                             "или каталога page_*.png (для кривых по умолчанию — data/graphics_pages; для видов страницы — равномерные)")
+    parser.add_argument("--allow-scan", action="store_true",
+                        help=f"Для --query вида страницы: перебирать индекс и при числе записей больше {PAGE_SCAN_LIMIT}")
+    parser.add_argument("--queries", type=int, default=1000, help="Запросов в --benchmark")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        try:
+            import numpy  # noqa: F401
+        except ImportError:
+            print("Install: pip install numpy", file=sys.stderr)
+            return 1
+        like = Path(args.like) if args.like else (PAGES_DIR if args.kind in CURVE_KINDS else None)
+        res = benchmark(args.benchmark, args.queries, args.radius, args.kind, like)
+        if like and not res["like"]:
+            print(f"В {like} нет хэшей {args.kind}", file=sys.stderr)
+            return 1
+        dist = f"как у {res['like']} хэшей {args.kind} из {like.name}" if like else "равномерные"
+        print(f"Индекс из {res['n']} хэшей ({dist}): вставка {res['insert_s']:.1f} с; запрос (радиус {args.radius}) "
+              f"в среднем {res['query_ms_mean']:.2f} мс, p99 {res['query_ms_p99']:.2f} мс, "
+              f"кандидатов {res['candidates_mean']:.0f} ({100 * res['candidates_mean'] / res['n']:.1f} % индекса)")
+        status = "совпадает" if res["found"] == res["expected"] else "НЕ совпадает"
+        print(f"Найдено соседей {res['found']}, полный перебор — {res['expected']} ({status})")
+        return 0 if res["found"] == res["expected"] else 1
+
+    index = HashIndex(Path(args.path))
+    if args.add:
+        if not args.case or not args.mode:
+            parser.error("--add требует --case и --mode")
+        with open(args.add, encoding="utf-8") as f:
+            pages = json.load(f)["hashes"]
+        n = index.add(args.case, args.source or Path(args.add).name, args.mode, pages)
+        print(f"Добавлено записей: {n} (дело {args.case}, страниц {len(pages)}, режим {args.mode})")
+    if args.remove:
+        print(f"Удалено записей: {index.remove_case(args.remove)} (дело {args.remove})")
+    if args.query:
+        mode = args.mode or (PANEL_MODE if args.kind in CURVE_KINDS else "png")
+        try:
+            matches = index.query(args.query, args.kind, mode, args.radius, allow_scan=args.allow_scan)
+        except PageScanRefused as e:
+            print(f"{e} (или --allow-scan)", file=sys.stderr)
+            index.close()
+            return 1
+        print(f"{args.kind} {args.query} ({mode}), радиус {args.radius}: {len(matches)} совпадений")
+        for m in matches:
+            where = f"стр. {m['page']}" + (f", гр. {m['graph_id']}" if m["graph_id"] else "")
+            print(f"  {m['case']} / {m['source']}, {where}: расстояние {m['distance']}")
+    if not (args.add or args.remove or args.query):
+        cases = index.cases()
+        print(f"{index.path}: дел {len(cases)}")
+        for c in cases:
+            print(f"  {c['case']}: страниц {c['pages']}, источников {c['sources']}, режимы {', '.join(c['modes'])}, "
+                  f"обновлено {time.strftime('%Y-%m-%d %H:%M', time.localtime(c['added']))}")
+    index.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
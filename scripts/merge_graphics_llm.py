@@ -5,6 +5,10 @@
 
 Пример запуска (первые 3 страницы):
   python scripts/merge_graphics_llm.py --pages 1,2,3
+
+Если страницы получены парным режимом (analyze_graphics_llm.py --paired), записи в
+graphics_llm_paired уже слиты — они только собираются в общий файл:
+  python scripts/merge_graphics_llm.py --paired
 """
 import argparse
 import json
@@ -14,6 +18,7 @@ from typing import Any, Dict, List, Optional
 PROJECT_ROOT = Path(__file__).resolve().parent.parent
 DIR_WITHOUT = PROJECT_ROOT / "data" / "graphics_llm"
 DIR_COVERAGE = PROJECT_ROOT / "data" / "graphics_llm_coverage"
+DIR_PAIRED = PROJECT_ROOT / "data" / "graphics_llm_paired"
 OUT_JSON = PROJECT_ROOT / "data" / "graphics_merged.json"
 
 
@@ -75,6 +80,7 @@ def main():
     parser = argparse.ArgumentParser(description="Слияние graphics_llm и graphics_llm_coverage в единый JSON")
     parser.add_argument("--pages", type=str, default=', '.join([str(i) for i in range(1, 65)]), help="Номера страниц через запятую (по умолчанию 1,2,3)")
     parser.add_argument("--out", type=str, default=None, help="Выходной JSON (по умолчанию data/graphics_merged.json)")
+    parser.add_argument("--paired", action="store_true", help="Собрать из data/graphics_llm_paired (результат analyze_graphics_llm.py --paired)")
     args = parser.parse_args()
 
     page_numbers = [int(x.strip()) for x in args.pages.split(",")]
@@ -88,8 +94,16 @@ def main():
         "pages": [],
         "graphs": [],
     }
+    if args.paired:
+        merged["source"] = {"paired": str(DIR_PAIRED)}
 
     for page in page_numbers:
+        if args.paired:
+            graphs_paired = get_graphs(load_page(DIR_PAIRED / f"page_{page:03d}.json"))
+            merged["pages"].append({"page": page, "graph_ids": [g.get("graph_id") for g in graphs_paired]})
+            merged["graphs"].extend(graphs_paired)
+            continue
+
         without_data = load_page(DIR_WITHOUT / f"page_{page:03d}.json")
         coverage_data = load_page(DIR_COVERAGE / f"page_{page:03d}.json")
 
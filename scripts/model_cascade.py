@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Каскад моделей для analyze_graphics_llm.py --cascade: сначала дешёвая модель (gpt-4o-mini),
+ответ проверяется локально, и только непрошедшие страницы или поля переспрашиваются
+у старшей модели (gpt-4o).
+
+Проверки ответа дешёвой модели:
+  - JSON распарсен и на странице столько графиков, сколько полей графиков нашёл
+    detect_page_regions.py;
+  - обязательные поля заполнены (те же, что у текстового слоя: extract_text_layer.REQUIRED_FIELDS),
+    подписи осей visible_min < visible_max;
+  - числа в физических диапазонах: K в [0, 1], Pr > 0, времена релаксации и амплитуды > 0;
+  - на страницах «с покрытием» K и Pr в заголовке совпадают с K и Pr в логе.
+
+Нет JSON или не хватает графика — страница целиком уходит старшей модели с тем же промптом.
+Иначе старшей модели отправляется короткий промпт только с непрошедшими полями, и её ответ
+подставляется в эти поля. По каждому уровню считаются вызовы, токены и задержка; отчёт —
+cascade_report.json в каталоге результатов.
+"""
+import json
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from extract_text_layer import REQUIRED_FIELDS, REQUIRED_FIELDS_COVERAGE
+from vision_json import get_path, set_path
+
+CHEAP_MODEL = "gpt-4o-mini"
+TIERS = ("cheap", "strong")
+
+AXIS_FIELDS = tuple(
+    f"graph_statistics.axes.{axis}.{bound}" for axis in ("x_axis", "y_axis") for bound in ("visible_min", "visible_max")
+)
+# Поля, которые читаются только с изображения графика: в текстовом слое и OCR подписей их нет
+VISION_FIELDS = tuple(
+    f"graph_statistics.axes.{axis}.{key}" for axis in ("x_axis", "y_axis") for key in ("visible_min", "visible_max", "step_interval")
+) + tuple(f"graph_statistics.y_metrics_max.{color}" for color in ("red", "blue", "green"))
+# Физически допустимые значения (границы включительно); None — без ограничения сверху
+RANGES: Dict[str, Tuple[float, Optional[float]]] = {
+    "header_data.structured_metrics.crystallinity_index": (0.0, 1.0),
+    "header_data.structured_metrics.proton_density": (1e-6, None),
+    "log_panel_data.structured_log_metrics.calculated_crystallinity_index": (0.0, 1.0),
+    "log_panel_data.structured_log_metrics.calculated_proton_density": (1e-6, None),
+    "log_panel_data.structured_log_metrics.relaxation_time_short_component_mks": (1e-6, None),
+    "log_panel_data.structured_log_metrics.relaxation_time_long_component_mks": (1e-6, None),
+    "log_panel_data.structured_log_metrics.amplitude_short_component_au": (1e-6, None),
+    "log_panel_data.structured_log_metrics.amplitude_long_component_au": (1e-6, None),
+}
+# K и Pr программа выводит дважды — в заголовке и в логе
+CROSS_CHECK = (
+    ("header_data.structured_metrics.crystallinity_index", "log_panel_data.structured_log_metrics.calculated_crystallinity_index"),
+    ("header_data.structured_metrics.proton_density", "log_panel_data.structured_log_metrics.calculated_proton_density"),
+)
+CROSS_CHECK_TOLERANCE = 1e-3
+
+FIELD_HINTS = {
+    "crystallinity_index": "индекс кристалличности K из строки заголовка, число",
+    "proton_density": "протонная плотность Pr из строки заголовка, число",
+    "sample_reference": "ссылка на образец из строки заголовка",
+    "illustration_number": "номер иллюстрации из подписи, например «№155»",
+    "full_text": "полный текст",
+    "visible_min": "число, подписанное у начала шкалы",
+    "visible_max": "число, подписанное у конца шкалы",
+    "step_interval": "шаг между подписанными делениями, число; null, если не виден",
+    "red": "максимум красной кривой по оси Y, число; null, если кривой нет",
+    "blue": "максимум синей кривой по оси Y, число; null, если кривой нет",
+    "green": "максимум зелёной кривой по оси Y, число; null, если кривой нет",
+    "research_date": "дата исследования из лога, ДД.ММ.ГГГГ",
+    "relaxation_time_short_component_mks": "время релаксации короткой компоненты из лога, мкс",
+    "relaxation_time_long_component_mks": "время релаксации длинной компоненты из лога, мкс",
+    "amplitude_short_component_au": "амплитуда короткой компоненты из лога, a.u.",
+    "amplitude_long_component_au": "амплитуда длинной компоненты из лога, a.u.",
+    "calculated_crystallinity_index": "индекс кристалличности из лога, число",
+    "calculated_proton_density": "протонная плотность из лога, число",
+}
+
+FOCUS_INTRO = "Предыдущее чтение части полей оказалось пустым или неправдоподобным. Прочитай заново только эти поля:"
+# Текстовые поля страницы уже известны (текстовый слой или OCR) — нужны только оси и максимумы кривых
+STATS_INTRO = "Подписи, заголовок и лог уже прочитаны. Прочитай только шкалы осей и максимумы кривых:"
+# Часть текстовых полей прочитать не удалось — они и оси с максимумами кривых
+PARTIAL_INTRO = "Часть полей уже прочитана. Прочитай только недостающие поля, шкалы осей и максимумы кривых:"
+FOCUS_PROMPT = """На изображении — страница с графиками ЯМР (спад свободной индукции, ССИ). {intro}
+{fields}
+
+Верни **строго один JSON-массив** без обёртки в markdown: по элементу на каждый упомянутый график, с полем graph_id и только перечисленными полями в той же вложенности, например:
+{example}
+Числа — только числа (float), даты — строки. null — только если поле действительно не читается."""
+
+
+def expected_graphs(page_png: Path) -> int:
+    """Число полей графиков на странице (detect_page_regions.py); 1, если страницу не разметить."""
+    try:
+        import numpy as np
+        from PIL import Image
+
+        from detect_page_regions import detect_regions
+    except ImportError:
+        return 1
+    if not page_png.exists():
+        return 1
+    regions = detect_regions(np.asarray(Image.open(page_png).convert("RGB")))
+    return max(1, len({r["graph_id"] for r in regions if r["kind"] == "plot"}))
+
+
+def _number(value: Any) -> Optional[float]:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return float(value)
+
+
+def validate_graphs(graphs: Optional[List[Any]], coverage: bool, expected: int = 1, check_axes: bool = True) -> List[str]:
+    """
+    Непрошедшие проверки ответа: "json", "graphs" (не хватает графиков) или "graph_id:поле".
+    Пустой список — ответ можно принять без старшей модели.
+    """
+    if not isinstance(graphs, list):
+        return ["json"]
+    items = [g for g in graphs if isinstance(g, dict) and g.get("graph_id") is not None]
+    if len(items) < expected or len(items) < len(graphs):
+        return ["graphs"]
+    fields = list(REQUIRED_FIELDS_COVERAGE if coverage else REQUIRED_FIELDS)
+    if check_axes:
+        fields += AXIS_FIELDS
+    out = []
+    for g in items:
+        gid = g["graph_id"]
+        bad = {f for f in fields if get_path(g, f) in (None, "")}
+        for field, (lo, hi) in RANGES.items():
+            value = get_path(g, field)
+            if value is None or field in bad:
+                continue
+            x = _number(value)
+            if x is None or x < lo or (hi is not None and x > hi):
+                bad.add(field)
+        if check_axes:
+            for axis in ("x_axis", "y_axis"):
+                lo = _number(get_path(g, f"graph_statistics.axes.{axis}.visible_min"))
+                hi = _number(get_path(g, f"graph_statistics.axes.{axis}.visible_max"))
+                if lo is None or hi is None or lo >= hi:
+                    bad.update(f"graph_statistics.axes.{axis}.{b}" for b in ("visible_min", "visible_max"))
+        if coverage:
+            for header_field, log_field in CROSS_CHECK:
+                a, b = _number(get_path(g, header_field)), _number(get_path(g, log_field))
+                if a is not None and b is not None and abs(a - b) > CROSS_CHECK_TOLERANCE * max(abs(a), abs(b), 1.0):
+                    bad.update((header_field, log_field))
+        out.extend(f"{gid}:{f}" for f in fields + [f for f in RANGES if f not in fields] if f in bad)
+    return out
+
+
+def _nested(dotted: str, value: Any) -> dict:
+    out: Any = value
+    for part in reversed(dotted.split(".")):
+        out = {part: out}
+    return out
+
+
+def focused_prompt(problems: List[str], note: str = "", intro: str = FOCUS_INTRO) -> str:
+    """Короткий промпт только с перечисленными полями (непрошедшими проверку или недостающими)."""
+    lines = []
+    for p in problems:
+        gid, field = p.split(":", 1)
+        hint = FIELD_HINTS.get(field.rsplit(".", 1)[-1], "")
+        lines.append(f"- график {gid}: {field}" + (f" — {hint}" if hint else ""))
+    gid, field = problems[0].split(":", 1)
+    example = json.dumps([{"graph_id": int(gid) if gid.isdigit() else gid, **_nested(field, "…")}], ensure_ascii=False)
+    return FOCUS_PROMPT.format(intro=intro, fields="\n".join(lines), example=example) + note
+
+
+def apply_fields(graphs: List[dict], fixes: Optional[List[Any]], problems: List[str]) -> List[str]:
+    """Подставить в graphs значения полей problems из ответа старшей модели; вернуть подставленные."""
+    by_id = {str(g.get("graph_id")): g for g in fixes or [] if isinstance(g, dict)}
+    targets = {str(g.get("graph_id")): g for g in graphs if isinstance(g, dict)}
+    applied = []
+    for p in problems:
+        gid, field = p.split(":", 1)
+        value = get_path(by_id.get(gid) or {}, field)
+        if value in (None, "") or gid not in targets:
+            continue
+        set_path(targets[gid], field, value)
+        applied.append(p)
+    return applied
+
+
+def _usage_tokens(usage: Optional[dict]) -> Tuple[int, int]:
+    usage = usage or {}
+    return int(usage.get("prompt_tokens") or 0), int(usage.get("completion_tokens") or 0)
+
+
+class TierStats:
+    """Вызовы, токены и задержка по уровням каскада; потокобезопасен — один экземпляр на пул."""
+
+    def __init__(self, models: Dict[str, str]):
+        self.models = models
+        self._lock = threading.Lock()
+        self._calls: Dict[str, List[dict]] = {t: [] for t in TIERS}
+        self.pages = 0
+        self.escalated_pages = 0
+        self.full_escalations = 0
+
+    def record(self, tier: str, payload: dict, latency: float, focused: bool = False) -> dict:
+        prompt_tokens, completion_tokens = _usage_tokens(payload.get("usage"))
+        call = {
+            "model": payload.get("model") or self.models[tier],
+            "cached": bool(payload.get("cached")),
+            "focused": focused,
+            "latency_s": round(latency, 3),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+        }
+        with self._lock:
+            self._calls[tier].append(call)
+        return call
+
+    def page_done(self, escalated: bool, full: bool) -> None:
+        with self._lock:
+            self.pages += 1
+            self.escalated_pages += int(escalated)
+            self.full_escalations += int(full)
+
+    def summary(self) -> dict:
+        with self._lock:
+            tiers = {}
+            for tier, calls in self._calls.items():
+                api = [c for c in calls if not c["cached"]]
+                latencies = sorted(c["latency_s"] for c in api)
+                tiers[tier] = {
+                    "model": self.models[tier],
+                    "calls": len(api),
+                    "cached": len(calls) - len(api),
+                    "prompt_tokens": sum(c["prompt_tokens"] for c in api),
+                    "completion_tokens": sum(c["completion_tokens"] for c in api),
+                    "latency_s_total": round(sum(latencies), 2),
+                    "latency_s_p50": latencies[len(latencies) // 2] if latencies else None,
+                }
+            cheap = tiers["cheap"]
+            # Без каскада каждая страница — один запрос старшей модели с тем же полным промптом и изображением;
+            # число токенов у моделей одного семейства почти одинаково, поэтому берём среднее дешёвого уровня
+            per_page = (cheap["prompt_tokens"] + cheap["completion_tokens"]) / cheap["calls"] if cheap["calls"] else None
+            # Время — по запросам старшей модели с полным промптом (страницы, переспрошенные целиком)
+            full = [c["latency_s"] for c in self._calls["strong"] if not c["cached"] and not c["focused"]]
+            return {
+                "pages": self.pages,
+                "escalated_pages": self.escalated_pages,
+                "full_escalations": self.full_escalations,
+                "tiers": tiers,
+                "strong_only_estimate": {
+                    "calls": self.pages,
+                    "tokens": round(per_page * self.pages) if per_page is not None else None,
+                    "latency_s": round(sum(full) / len(full) * self.pages, 1) if full else None,
+                },
+            }
+
+    def report_lines(self) -> List[str]:
+        s = self.summary()
+        lines = [f"Каскад: страниц {s['pages']}, переспрошено у старшей модели {s['escalated_pages']} (целиком {s['full_escalations']})"]
+        for tier, t in s["tiers"].items():
+            p50 = f"{t['latency_s_p50']:.1f} с" if t["latency_s_p50"] is not None else "—"
+            lines.append(
+                f"  {tier} ({t['model']}): вызовов {t['calls']}, из кэша {t['cached']}, токенов {t['prompt_tokens']} + {t['completion_tokens']}, "
+                f"время {t['latency_s_total']:.1f} с, медиана {p50}"
+            )
+        est = s["strong_only_estimate"]
+        if est["tokens"] is not None:
+            strong = s["tiers"]["strong"]
+            lines.append(
+                f"  без каскада ({strong['model']} на всех страницах): ≈{est['calls']} вызовов и ≈{est['tokens']} токенов "
+                f"против {strong['calls']} вызовов и {strong['prompt_tokens'] + strong['completion_tokens']} токенов старшей модели"
+            )
+        if est["latency_s"] is not None:
+            total = sum(t["latency_s_total"] for t in s["tiers"].values())
+            lines.append(f"  суммарное время запросов: ≈{est['latency_s']:.0f} с без каскада против {total:.0f} с с каскадом")
+        return lines
+
+    def save(self, path: Path) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, ensure_ascii=False, indent=2)
+
+
+def run_cascade(
+    call: Callable[[str, str], Tuple[dict, float]],
+    prompt: str,
+    models: Dict[str, str],
+    stats: TierStats,
+    coverage: bool,
+    expected: int = 1,
+    check_axes: bool = True,
+    note: str = "",
+) -> dict:
+    """
+    Одна страница через каскад. call(model, prompt) → (запись analyze_page, задержка).
+    В записи страницы остаётся поле cascade: уровень, непрошедшие поля и вызовы.
+    """
+    payload, latency = call(models["cheap"], prompt)
+    calls = [stats.record("cheap", payload, latency)]
+    problems = validate_graphs(payload["graphs"], coverage, expected, check_axes)
+    info: Dict[str, Any] = {"tier": "cheap", "problems": problems}
+    if problems and problems[0] in ("json", "graphs"):
+        strong, latency = call(models["strong"], prompt)
+        calls.append(stats.record("strong", strong, latency))
+        payload = strong
+        info["tier"] = "strong"
+        info["unresolved"] = validate_graphs(payload["graphs"], coverage, expected, check_axes)
+    elif problems:
+        fixes, latency = call(models["strong"], focused_prompt(problems, note))
+        calls.append(stats.record("strong", fixes, latency, focused=True))
+        info["tier"] = "cheap+strong"
+        info["applied"] = apply_fields(payload["graphs"], fixes["graphs"], problems)
+        info["unresolved"] = validate_graphs(payload["graphs"], coverage, expected, check_axes)
+    info["calls"] = calls
+    stats.page_done(bool(problems), info["tier"] == "strong")
+    payload["cascade"] = info
+    return payload
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+Уменьшение изображений страниц перед отправкой в vision API: для каждой страницы выбирается
+самый лёгкий вариант разрешения и кодирования, на котором текстовые поля читаются так же.
+
+Кандидаты: масштаб × кодирование (PNG с палитрой 64 цвета, JPEG и WebP с качеством 90 / 75).
+Масштабы — 1.0 / 0.9 / 0.8 от page_XXX.png в 2x и наибольшие масштабы, на которых оценка
+токенов становится меньше (tile_scales). API и так уменьшает страницу до короткой стороны 768 px,
+поэтому 0.9 и 0.8 токенов не экономят, только объём; меньше токенов — только ниже порогов
+плиток (у страницы 1191×1684: 1105 → 765 при ×0.60 и → 425 при ×0.43). Кандидаты проверяются
+от меньшего к большему; принимается первый, прошедший проверку, иначе остаётся исходный PNG:
+
+  - вариант декодируется, возвращается к исходному размеру и читается офлайн-OCR (glyph_ocr.py)
+    так же, как исходная страница;
+  - ни одно поле, прочитанное в обоих, не изменилось, и не пропало ни одно поле, прочитанное
+    на исходной странице уверенно (отрыв не ниже KEEP_CONFIDENCE);
+  - на размеченных страницах (ответы vision-модели, data/graphics_llm*) не потеряно ни одно
+    поле K/Pr (и лога для «с покрытием»), которое OCR читал верно на исходной странице;
+  - если на странице нет ни одного уверенного и ни одного размеченного поля, проверять нечем —
+    остаётся исходный PNG.
+
+Отчёт сравнивает долю размеченных полей, прочитанных OCR верно, на исходных и выбранных
+изображениях и число потерянных и добавленных верных полей. Токены изображения оцениваются
+по правилу high detail OpenAI (вписать в 2048, короткая сторона 768, плитки 512 px).
+
+Выбор кэшируется по sha256 исходного PNG и настройкам: data/graphics_payload[_coverage]/
+page_XXX.{png,jpg,webp} + manifest.json. analyze_graphics_llm.py --optimized отправляет эти файлы.
+
+Пример запуска:
+  python scripts/optimize_payload.py --coverage --workers 4
+"""
+import argparse
+import hashlib
+import io
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from glyph_ocr import TEMPLATES_PATH, GlyphTemplates, ocr_page
+from vision_cache import sha256_file
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+# Меньше 0.8 текст лога на 2x-страницах OCR уже не читает; пороги плиток (tile_scales) всё равно
+# проверяются — только они уменьшают токены
+SCALES = (1.0, 0.9, 0.8)
+MIN_TILE_SCALE = 0.4
+# (формат, параметр): для PNG8 — число цветов палитры, для JPEG/WebP — качество
+ENCODINGS = (("png8", 64), ("jpeg", 90), ("jpeg", 75), ("webp", 90), ("webp", 75))
+SUFFIX = {"png": ".png", "png8": ".png", "jpeg": ".jpg", "webp": ".webp"}
+KEEP_CONFIDENCE = 0.1   # уверенно прочитанное поле исходника обязано остаться в варианте
+# Состав полей OCR, по которым сравниваются варианты
+OCR_SECTIONS = (("header_data", "structured_metrics"), ("log_panel_data", "structured_log_metrics"))
+
+_TEMPLATES: Optional[GlyphTemplates] = None
+
+
+def payload_dir_for(pages_dir: Path) -> Path:
+    """data/graphics_pages[_coverage] → data/graphics_payload[_coverage]."""
+    return pages_dir.parent / pages_dir.name.replace("graphics_pages", "graphics_payload")
+
+
+def optimized_path(page_png: Path) -> Optional[Path]:
+    """Выбранный вариант страницы по manifest.json или None, если страница не обработана либо PNG изменился."""
+    out_dir = payload_dir_for(page_png.parent)
+    manifest_path = out_dir / "manifest.json"
+    if not manifest_path.exists():
+        return None
+    with open(manifest_path, encoding="utf-8") as f:
+        entry = json.load(f).get("pages", {}).get(str(int(page_png.stem.split("_")[1])))
+    if not entry or not (out_dir / entry["file"]).exists() or entry["source_sha256"] != sha256_file(page_png):
+        return None
+    return out_dir / entry["file"]
+
+
+def image_tokens(width: int, height: int) -> int:
+    """Оценка токенов изображения (high detail): 85 + 170 на каждую плитку 512×512 после масштабирования API."""
+    scale = min(1.0, 2048 / max(width, height))
+    w, h = width * scale, height * scale
+    scale = min(1.0, 768 / min(w, h))
+    w, h = w * scale, h * scale
+    return 85 + 170 * math.ceil(w / 512) * math.ceil(h / 512)
+
+
+def tile_scales(width: int, height: int) -> Tuple[float, ...]:
+    """Наибольшие масштабы (шаг 0.01, не меньше MIN_TILE_SCALE), на которых image_tokens становится меньше."""
+    out = []
+    tokens = image_tokens(width, height)
+    for step in range(100, round(MIN_TILE_SCALE * 100) - 1, -1):
+        scale = step / 100
+        t = image_tokens(round(width * scale), round(height * scale))
+        if t < tokens:
+            out.append(scale)
+            tokens = t
+    return tuple(out)
+
+
+def settings_key() -> str:
+    """Отпечаток настроек выбора: при смене кандидатов, порога или шаблонов OCR кэш пересчитывается."""
+    templates = sha256_file(TEMPLATES_PATH) if TEMPLATES_PATH.exists() else ""
+    raw = json.dumps([SCALES, MIN_TILE_SCALE, ENCODINGS, KEEP_CONFIDENCE, templates])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def encode(img, fmt: str, param: Optional[int]) -> bytes:
+    from PIL import Image
+
+    # Быстрые режимы кодеров: медленные (optimize, MEDIANCUT, method=4+) дают на 2–10 % меньше,
+    # но в 3–6 раз дольше, а кандидатов на страницу полтора десятка
+    buf = io.BytesIO()
+    if fmt == "png8":
+        img.quantize(colors=param, method=Image.Quantize.FASTOCTREE).save(buf, "PNG")
+    elif fmt == "jpeg":
+        img.save(buf, "JPEG", quality=param)
+    else:
+        img.save(buf, "WEBP", quality=param, method=2)
+    return buf.getvalue()
+
+
+def ocr_fields(rgb, page: int, coverage: bool) -> Dict[str, Tuple[object, float]]:
+    """Прочитанные OCR поля страницы: {"graph_id:ключ": (значение, уверенность)}."""
+    out = {}
+    for g in ocr_page(rgb, page, _TEMPLATES, coverage)["graphs"]:
+        for section, key in OCR_SECTIONS:
+            data = g.get(section) or {}
+            confidence = data.get("ocr_confidence") or {}
+            for name, value in (data.get(key) or {}).items():
+                out[f"{g['graph_id']}:{name}"] = (value, confidence.get(name, 0.0))
+    return out
+
+
+def same_fields(reference: Dict[str, Tuple[object, float]], candidate: Dict[str, Tuple[object, float]]) -> bool:
+    for key, (value, confidence) in reference.items():
+        if key in candidate:
+            if candidate[key][0] != value:
+                return False
+        elif confidence >= KEEP_CONFIDENCE:
+            return False
+    return True
+
+
+def keeps_labels(reference: Dict[str, Tuple[object, float]], candidate: Dict[str, Tuple[object, float]], labels: Dict[str, object]) -> bool:
+    """Каждое размеченное поле, верно прочитанное на исходной странице, верно прочитано и в варианте."""
+    for key, value in labels.items():
+        if key in reference and reference[key][0] == value and (key not in candidate or candidate[key][0] != value):
+            return False
+    return True
+
+
+def _init_worker(templates_path: str) -> None:
+    global _TEMPLATES
+    _TEMPLATES = GlyphTemplates.load(Path(templates_path))
+
+
+def choose_variant(args: Tuple[Path, bool, Dict[str, object]]) -> dict:
+    """Самый лёгкий вариант страницы, прошедший проверку OCR: {"format", "param", "scale", "data", …}."""
+    import numpy as np
+    from PIL import Image
+
+    path, coverage, labels = args
+    page = int(path.stem.split("_")[1])
+    t0 = time.perf_counter()
+    with Image.open(path) as im:
+        img = im.convert("RGB")
+    width, height = img.size
+    reference = ocr_fields(np.asarray(img), page, coverage)
+    checkable = any(c >= KEEP_CONFIDENCE for _, c in reference.values()) or any(
+        k in reference and reference[k][0] == v for k, v in labels.items()
+    )
+
+    source = path.read_bytes()
+    candidates = [(source, "png", None, 1.0, (width, height))]
+    scales = sorted(set(SCALES) | set(tile_scales(width, height)), reverse=True)
+    for scale in scales if checkable else ():
+        size = (round(width * scale), round(height * scale))
+        scaled = img if scale == 1.0 else img.resize(size, Image.LANCZOS)
+        for fmt, param in ENCODINGS:
+            candidates.append((encode(scaled, fmt, param), fmt, param, scale, size))
+    candidates.sort(key=lambda c: len(c[0]))
+
+    chosen, fields, tried = None, reference, 0
+    for data, fmt, param, scale, size in candidates:
+        if data is source:
+            chosen = (data, fmt, param, scale, size)
+            break
+        tried += 1
+        with Image.open(io.BytesIO(data)) as im:
+            back = im.convert("RGB").resize((width, height), Image.BICUBIC) if scale != 1.0 else im.convert("RGB")
+        got = ocr_fields(np.asarray(back), page, coverage)
+        if same_fields(reference, got) and keeps_labels(reference, got, labels):
+            chosen, fields = (data, fmt, param, scale, size), got
+            break
+    data, fmt, param, scale, size = chosen
+    return {
+        "page": page,
+        "format": fmt,
+        "param": param,
+        "scale": scale,
+        "size": list(size),
+        "data": data,
+        "source_bytes": path.stat().st_size,
+        "bytes": len(data),
+        "source_tokens": image_tokens(width, height),
+        "tokens": image_tokens(*size),
+        "checked_fields": sum(1 for _, c in reference.values() if c >= KEEP_CONFIDENCE),
+        "candidates_tried": tried,
+        "reference_values": {k: v for k, (v, _) in reference.items()},
+        "chosen_values": {k: v for k, (v, _) in fields.items()},
+        "seconds": round(time.perf_counter() - t0, 2),
+    }
+
+
+def label_values(llm_dir: Path, page: int, coverage: bool) -> Dict[str, object]:
+    """Эталон размеченного подмножества: K/Pr заголовка (и поля лога) из ответа vision-модели."""
+    path = llm_dir / f"page_{page:03d}.json"
+    if not path.exists():
+        return {}
+    with open(path, encoding="utf-8") as f:
+        graphs = json.load(f).get("graphs") or []
+    out = {}
+    for g in graphs:
+        if not isinstance(g, dict):
+            continue
+        sections = OCR_SECTIONS if coverage else OCR_SECTIONS[:1]
+        for section, key in sections:
+            for name, value in ((g.get(section) or {}).get(key) or {}).items():
+                if isinstance(value, (int, float, str)) and value not in ("", None) and name != "sample_reference":
+                    out[f"{g.get('graph_id')}:{name}"] = value
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Выбор разрешения и кодирования страниц для vision API с проверкой полей офлайн-OCR")
+    parser.add_argument("--coverage", action="store_true", help="Страницы «с покрытием» (data/graphics_pages_coverage)")
+    parser.add_argument("--pages", type=str, default=None, help="Номера страниц через запятую (по умолчанию — все)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Процессов в пуле")
+    parser.add_argument("--force", action="store_true", help="Пересчитать страницы, уже выбранные с теми же настройками")
+    args = parser.parse_args()
+
+    try:
+        import numpy  # noqa: F401
+        from PIL import Image  # noqa: F401
+    except ImportError:
+        print("Install: pip install numpy Pillow", file=sys.stderr)
+        return 1
+    if not TEMPLATES_PATH.exists():
+        print(f"Нет шаблонов {TEMPLATES_PATH}. Сначала: python scripts/glyph_ocr.py --coverage --bootstrap --pages 1,2,3", file=sys.stderr)
+        return 1
+
+    suffix = "_coverage" if args.coverage else ""
+    pages_dir = PROJECT_ROOT / "data" / f"graphics_pages{suffix}"
+    llm_dir = PROJECT_ROOT / "data" / f"graphics_llm{suffix}"
+    out_dir = payload_dir_for(pages_dir)
+    paths = sorted(pages_dir.glob("page_*.png"))
+    if args.pages:
+        wanted = {int(x.strip()) for x in args.pages.split(",")}
+        paths = [p for p in paths if int(p.stem.split("_")[1]) in wanted]
+    if not paths:
+        print(f"Нет page_*.png в {pages_dir}. Сначала выполните extract_graphics_pages.py", file=sys.stderr)
+        return 1
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    manifest_path = out_dir / "manifest.json"
+    manifest: dict = {"settings": settings_key(), "pages": {}}
+    if manifest_path.exists():
+        with open(manifest_path, encoding="utf-8") as f:
+            old = json.load(f)
+        if old.get("settings") == manifest["settings"]:
+            manifest = old
+
+    todo, cached = [], 0
+    for p in paths:
+        entry = manifest["pages"].get(str(int(p.stem.split("_")[1])))
+        if not args.force and entry and entry["source_sha256"] == sha256_file(p) and (out_dir / entry["file"]).exists():
+            cached += 1
+            continue
+        todo.append(p)
+
+    t0 = time.perf_counter()
+    workers = max(1, min(args.workers, len(todo) or 1))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(str(TEMPLATES_PATH),)) as pool:
+        tasks = [(p, args.coverage, label_values(llm_dir, int(p.stem.split("_")[1]), args.coverage)) for p in todo]
+        results = list(pool.map(choose_variant, tasks))
+    elapsed = time.perf_counter() - t0
+
+    for path, res in zip(todo, results):
+        name = f"page_{res['page']:03d}{SUFFIX[res['format']]}"
+        for stale in out_dir.glob(f"page_{res['page']:03d}.*"):
+            stale.unlink()
+        (out_dir / name).write_bytes(res.pop("data"))
+        res["file"] = name
+        res["source_sha256"] = sha256_file(path)
+        manifest["pages"][str(res["page"])] = res
+    manifest["pages"] = dict(sorted(manifest["pages"].items(), key=lambda kv: int(kv[0])))
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    entries = [manifest["pages"][str(int(p.stem.split("_")[1]))] for p in paths]
+    src_bytes = sum(e["source_bytes"] for e in entries)
+    out_bytes = sum(e["bytes"] for e in entries)
+    src_tokens = sum(e["source_tokens"] for e in entries)
+    out_tokens = sum(e["tokens"] for e in entries)
+    choices: Dict[str, int] = {}
+    for e in entries:
+        label = f"{e['format']}{'' if e['param'] is None else '-' + str(e['param'])} x{e['scale']:g}"
+        choices[label] = choices.get(label, 0) + 1
+    n_labels = ok_ref = ok_chosen = lost = gained = 0
+    for e in entries:
+        labels = label_values(llm_dir, e["page"], args.coverage)
+        for key, value in labels.items():
+            ref, chosen = e["reference_values"].get(key) == value, e["chosen_values"].get(key) == value
+            n_labels += 1
+            ok_ref += ref
+            ok_chosen += chosen
+            lost += ref and not chosen
+            gained += chosen and not ref
+    fewer_tokens = sum(1 for e in entries if e["tokens"] < e["source_tokens"])
+
+    print(f"Страниц: {len(entries)} (из кэша {cached}), время {elapsed:.1f} с, {workers} процессов")
+    print(f"Объём: {src_bytes / 1024 / 1024:.1f} МБ → {out_bytes / 1024 / 1024:.1f} МБ ({100 * (1 - out_bytes / max(src_bytes, 1)):.0f} % меньше)")
+    print(f"Токены изображений (оценка high detail): {src_tokens} → {out_tokens}, меньше плиток на {fewer_tokens} страницах")
+    print("Выбранные варианты: " + ", ".join(f"{k} — {v}" for k, v in sorted(choices.items(), key=lambda kv: -kv[1])))
+    if n_labels:
+        print(f"Размеченные поля ({llm_dir.name}): OCR верно на исходных {ok_ref}/{n_labels}, на выбранных {ok_chosen}/{n_labels} "
+              f"(потеряно {lost}, добавлено {gained})")
+    print(f"Результаты: {out_dir}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
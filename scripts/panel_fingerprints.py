@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Отпечатки отдельных полей графиков для проверки на дубликаты (graphics_duplicate_check.py).
+
+phash страницы целиком почти не различает страницы: у всех «тонкие линии на тёмном фоне»,
+рамка программы, сетка и подписи одинаковые. Здесь хэшируется то, что у графиков разное:
+
+  - поле графика внутри рамки сетки (detect_page_regions.py + axis_calibration.plot_geometry) —
+    phash и dhash;
+  - каждая кривая отдельно: маска красной, синей и зелёной кривой (пороги
+    digitize_raster_curves.curve_masks) как чёрно-белое изображение — phash, dhash и число пикселей;
+  - грубая цветовая гистограмма поля (HIST_LEVELS уровней на канал), доли в 1/10000.
+
+Всё считается из одного массива RGB страницы (для PNG — тот же декод, из которого берётся
+хэш страницы; с --pdf — отдельный рендер с zoom ZOOM).
+
+Сравнение «подобного с подобным» — по кривым: у обоих полей один и тот же набор кривых,
+среднее по кривым расстояние phash масок ≤ CURVE_PHASH_MEAN и ни одна кривая не дальше
+CURVE_PHASH_MAX; гистограмма — грубый фильтр (HIST_THRESHOLD). Кандидаты — пары, у которых
+phash маски хотя бы одного цвета ≤ CURVE_PHASH_MEAN (векторный поиск hash_distance.pairs_within
+по каждому цвету): если среднее ≤ порога, то и минимум ≤ порога, так что проверяются только
+они. Пороги подобраны на 78 страницах «без покрытия» и их повторной отрисовке через PDF:
+сумма расстояний трёх кривых у одного и того же поля после пересэмплирования — до 22,
+у разных полей — от 34. phash поля целиком и гистограмма разные поля почти не различают
+(расстояние phash от 2, гистограмм от 0.005), они записываются для справки.
+"""
+from typing import Dict, List, Optional
+
+from axis_calibration import plot_geometry
+from detect_page_regions import detect_regions
+from digitize_raster_curves import curve_masks
+from digitize_vector_curves import COLORS
+from hash_distance import pack_hashes, pairs_within
+
+HIST_LEVELS = 4
+MIN_CURVE_FRACTION = 0.002   # кривая занимает меньше 0.2 % поля — считается отсутствующей
+CURVE_PHASH_MEAN = 9         # среднее расстояние phash масок кривых у дубликата
+CURVE_PHASH_MAX = 16         # и предел для каждой кривой
+HIST_THRESHOLD = 0.25        # L1-расстояние долей гистограммы (0..2); повторная отрисовка даёт до 0.13
+
+
+def _hashes(gray) -> Dict[str, str]:
+    import imagehash
+    from PIL import Image
+
+    image = Image.fromarray(gray)
+    return {"phash": str(imagehash.phash(image)), "dhash": str(imagehash.dhash(image))}
+
+
+def color_histogram(rgb) -> List[int]:
+    """Доли пикселей по HIST_LEVELS³ ячейкам цвета, в 1/10000."""
+    import numpy as np
+
+    q = (rgb.reshape(-1, 3) // (256 // HIST_LEVELS)).astype(np.int64)
+    cells = (q[:, 0] * HIST_LEVELS + q[:, 1]) * HIST_LEVELS + q[:, 2]
+    counts = np.bincount(cells, minlength=HIST_LEVELS ** 3)
+    return [int(round(c)) for c in counts * 10000 / max(len(cells), 1)]
+
+
+def hist_distance(a: List[int], b: List[int]) -> float:
+    return sum(abs(x - y) for x, y in zip(a, b)) / 10000
+
+
+def panel_fingerprints(rgb, page: int) -> List[dict]:
+    """Отпечатки всех полей графиков страницы по её массиву RGB (HxWx3, uint8)."""
+    import numpy as np
+
+    out = []
+    for region in detect_regions(rgb):
+        if region["kind"] != "plot":
+            continue
+        x0, y0, x1, y1 = region["bbox"]
+        panel = rgb[y0:y1, x0:x1]
+        geometry = plot_geometry(panel)
+        frame = None
+        if geometry is not None:
+            # Внутри рамки сетки: подписи осей одинаковы у всех графиков и только сближают хэши
+            fx0, fy0, fx1, fy1 = geometry["frame"]
+            if fx1 - fx0 > 8 and fy1 - fy0 > 8:
+                panel = panel[fy0 + 1:fy1, fx0 + 1:fx1]
+                frame = [x0 + fx0 + 1, y0 + fy0 + 1, x0 + fx1, y0 + fy1]
+        gray = np.asarray(panel.mean(axis=2), dtype=np.uint8)
+        curves = {}
+        for color, mask in curve_masks(panel).items():
+            if mask.mean() < MIN_CURVE_FRACTION:
+                continue
+            curves[color] = {**_hashes(mask.astype(np.uint8) * 255), "pixels": int(mask.sum())}
+        out.append({
+            "page": page,
+            "graph_id": region["graph_id"],
+            "bbox": region["bbox"],
+            "frame": frame,
+            **_hashes(gray),
+            "hist": color_histogram(panel),
+            "curves": curves,
+        })
+    return out
+
+
+def _distance(a: str, b: str) -> int:
+    return (int(a, 16) ^ int(b, 16)).bit_count()
+
+
+def curve_match(a: Dict[str, str], b: Dict[str, str]) -> Optional[Dict[str, int]]:
+    """
+    phash-расстояния масок кривых пары полей ({color: hex}), если по кривым это дубликат:
+    тот же набор цветов, среднее ≤ CURVE_PHASH_MEAN и каждая ≤ CURVE_PHASH_MAX; иначе None.
+    """
+    if not a or set(a) != set(b):
+        return None
+    d = {color: _distance(a[color], b[color]) for color in COLORS if color in a}
+    if sum(d.values()) / len(d) > CURVE_PHASH_MEAN or max(d.values()) > CURVE_PHASH_MAX:
+        return None
+    return d
+
+
+def compare_panels(a: dict, b: dict) -> Optional[dict]:
+    """Расстояния пары полей, если это подтверждённый дубликат, иначе None."""
+    phash = curve_match({c: v["phash"] for c, v in a["curves"].items()}, {c: v["phash"] for c, v in b["curves"].items()})
+    if phash is None:
+        return None
+    curves = {
+        color: {"phash": d, "dhash": _distance(a["curves"][color]["dhash"], b["curves"][color]["dhash"])}
+        for color, d in phash.items()
+    }
+    mean = sum(phash.values()) / len(phash)
+    hist = round(hist_distance(a["hist"], b["hist"]), 4)
+    if hist > HIST_THRESHOLD:
+        return None
+    return {
+        "curve_phash_mean": round(mean, 2),
+        "curves": curves,
+        "panel": {"phash": _distance(a["phash"], b["phash"]), "dhash": _distance(a["dhash"], b["dhash"])},
+        "hist": hist,
+    }
+
+
+def panel_duplicates(panels: List[dict]) -> dict:
+    """
+    Кандидаты по совпавшему phash кривой одного цвета и подтверждённые дубликаты:
+    {"candidates": число пар, "duplicates": [{"a": (page, graph_id), "b": ..., "distances": ...}]}.
+    """
+    candidates = set()
+    for color in COLORS:
+        ids = [i for i, p in enumerate(panels) if color in p["curves"]]
+        if len(ids) < 2:
+            continue
+        ii, jj, _ = pairs_within(pack_hashes(panels[i]["curves"][color]["phash"] for i in ids), CURVE_PHASH_MEAN)
+        candidates.update((ids[i], ids[j]) for i, j in zip(ii.tolist(), jj.tolist()))
+    duplicates = []
+    for i, j in sorted(candidates):
+        res = compare_panels(panels[i], panels[j])
+        if res is not None:
+            duplicates.append({
+                "a": (panels[i]["page"], panels[i]["graph_id"]),
+                "b": (panels[j]["page"], panels[j]["graph_id"]),
+                "distances": res,
+            })
+    return {"candidates": len(candidates), "duplicates": duplicates}
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Растеризация страниц PDF в page_XXX.png — общий движок extract_graphics_pages.py
+и extract_graphics_pages_coverage.py.
+
+Страницы делятся на куски и раздаются пулу процессов; каждый процесс открывает PDF один раз
+(fitz.Document в инициализаторе пула) и обрабатывает свои куски. Перерисовывается только
+страница, у которой изменилось содержимое в PDF или zoom: отпечаток страницы — sha256 по её
+объекту и всему, на что он ссылается (потоки содержимого, шрифты, изображения, аннотации),
+без ссылки на родительский узел дерева страниц и без номеров объектов. Отпечаток считается
+по распакованным потокам, без отрисовки, поэтому повторный запуск после правки нескольких страниц занимает секунды.
+
+Рядом со страницами пишется manifest.json: для каждой страницы отпечаток содержимого, zoom,
+sha256 и размер PNG, ширина и высота в пикселях, время отрисовки. PNG, которого нет в новом
+PDF (страниц стало меньше), удаляется, если он был записан этим движком.
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+ZOOM = 2
+CHUNKS_PER_WORKER = 4   # куски мельче числа процессов — пул выравнивает нагрузку по страницам
+# Обратные ссылки (страница → дерево страниц, аннотация → страница) в отпечаток не входят
+_BACK_REF = re.compile(r"/(Parent|P)\s+\d+\s+0\s+R")
+_REF = re.compile(r"(\d+)\s+0\s+R")
+# Ключи кодирования потока: при пересжатии меняются, а содержимое — нет
+_STREAM_KEYS = re.compile(r"/(Length|Filter|DecodeParms)\s*(\d+\s+0\s+R|\d+|/\w+|\[[^\]]*\]|<<[^>]*>>)")
+
+_DOC = None
+_DIGESTS: Dict[int, bytes] = {}
+
+
+def _init_worker(pdf: str) -> None:
+    global _DOC
+    import fitz  # PyMuPDF
+
+    _DOC = fitz.open(pdf)
+    _DIGESTS.clear()
+
+
+def _object_digest(doc, xref: int, active: set) -> bytes:
+    """sha256 объекта xref вместе со всеми объектами, на которые он ссылается (результаты общие для страниц процесса)."""
+    if xref in _DIGESTS:
+        return _DIGESTS[xref]
+    if xref in active:
+        # Цикл ссылок: объект уже учитывается выше по цепочке
+        return f"cycle {xref}".encode()
+    active.add(xref)
+    source = _BACK_REF.sub("", doc.xref_object(xref, compressed=True))
+    stream = doc.xref_stream(xref) if doc.xref_is_stream(xref) else None
+    if stream is not None:
+        # Распакованный поток без ключей кодирования: пересжатие при сохранении PDF не в счёт
+        source = _STREAM_KEYS.sub("", source)
+    # Номера объектов не важны (полное пересохранение PDF их меняет) — важно содержимое по ссылкам
+    h = hashlib.sha256(_REF.sub("R", source).encode())
+    h.update(stream or b"")
+    for ref in _REF.findall(source):
+        h.update(_object_digest(doc, int(ref), active))
+    active.discard(xref)
+    _DIGESTS[xref] = h.digest()
+    return _DIGESTS[xref]
+
+
+def page_fingerprint(doc, index: int) -> str:
+    """Отпечаток содержимого страницы index (с 0) в открытом fitz.Document."""
+    page = doc[index]
+    h = hashlib.sha256(f"{tuple(page.mediabox)} {page.rotation}".encode())
+    h.update(_object_digest(doc, page.xref, set()))
+    return h.hexdigest()
+
+
+def _render_chunk(task: Tuple[List[int], float, str, Dict[str, dict], bool]) -> List[dict]:
+    """Страницы куска: отпечаток, сверка с манифестом, отрисовка изменившихся. Записи манифеста с полем rendered."""
+    import fitz  # PyMuPDF
+
+    indices, zoom, out_dir, known, force = task
+    out = []
+    for i in indices:
+        page_no = i + 1
+        name = f"page_{page_no:03d}.png"
+        path = Path(out_dir) / name
+        content = page_fingerprint(_DOC, i)
+        entry = known.get(str(page_no))
+        if (
+            not force and entry and entry["content_sha256"] == content and entry["zoom"] == zoom
+            and path.exists() and path.stat().st_size == entry["bytes"]
+        ):
+            out.append({**entry, "rendered": False})
+            continue
+        t0 = time.perf_counter()
+        pix = _DOC[i].get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+        data = pix.tobytes("png")
+        tmp = path.with_name(f".{name}.{os.getpid()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        out.append({
+            "page": page_no,
+            "file": name,
+            "content_sha256": content,
+            "zoom": zoom,
+            "sha256": hashlib.sha256(data).hexdigest(),
+            "bytes": len(data),
+            "width": pix.width,
+            "height": pix.height,
+            "render_s": round(time.perf_counter() - t0, 3),
+            "rendered": True,
+        })
+    return out
+
+
+def rasterize(pdf: Path, out_dir: Path, zoom: float = ZOOM, workers: Optional[int] = None, force: bool = False) -> dict:
+    """
+    Привести out_dir/page_XXX.png и manifest.json в соответствие с pdf. Возвращает сводку:
+    pages, rendered, unchanged, removed, render_s (сумма по страницам), elapsed_s, workers.
+    """
+    import fitz  # PyMuPDF
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = out_dir / "manifest.json"
+    known: Dict[str, dict] = {}
+    if manifest_path.exists():
+        with open(manifest_path, encoding="utf-8") as f:
+            known = json.load(f).get("pages", {})
+    with fitz.open(pdf) as doc:
+        n = len(doc)
+
+    t0 = time.perf_counter()
+    workers = max(1, min(workers or os.cpu_count() or 1, n or 1))
+    size = max(1, -(-n // (workers * CHUNKS_PER_WORKER)))
+    tasks = [(list(range(s, min(s + size, n))), zoom, str(out_dir), known, force) for s in range(0, n, size)]
+    if workers == 1:
+        # Без пула: тот же код в текущем процессе, без накладных расходов на запуск процессов
+        _init_worker(str(pdf))
+        chunks = [_render_chunk(t) for t in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(str(pdf),)) as pool:
+            chunks = list(pool.map(_render_chunk, tasks))
+    entries = [e for chunk in chunks for e in chunk]
+
+    removed = 0
+    for key, entry in known.items():
+        if int(key) > n:
+            stale = out_dir / entry["file"]
+            if stale.exists():
+                stale.unlink()
+                removed += 1
+    fresh = [e for e in entries if e.pop("rendered")]
+    manifest = {"pdf": pdf.name, "pages": {str(e["page"]): e for e in entries}}
+    tmp = manifest_path.with_name(f".{manifest_path.name}.{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, manifest_path)
+    return {
+        "pages": n,
+        "rendered": len(fresh),
+        "unchanged": n - len(fresh),
+        "removed": removed,
+        "render_s": sum(e["render_s"] for e in fresh),
+        "elapsed_s": time.perf_counter() - t0,
+        "workers": workers,
+    }
+
+
+def main(pdf: Path, out_dir: Path, description: str) -> int:
+    """Командная строка extract_graphics_pages*.py: --zoom, --workers, --force."""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--zoom", type=float, default=ZOOM, help=f"Масштаб отрисовки (по умолчанию {ZOOM}: 144 dpi)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Процессов в пуле")
+    parser.add_argument("--force", action="store_true", help="Перерисовать все страницы, даже без изменений")
+    args = parser.parse_args()
+
+    if not pdf.exists():
+        print(f"Файл не найден: {pdf}", file=sys.stderr)
+        return 1
+    try:
+        import fitz  # noqa: F401
+    except ImportError:
+        print("PyMuPDF не установлен. Выполните: pip install pymupdf", file=sys.stderr)
+        return 1
+    res = rasterize(pdf, out_dir, args.zoom, args.workers, args.force)
+    print(
+        f"Страниц {res['pages']}: отрисовано {res['rendered']}, без изменений {res['unchanged']}"
+        + (f", удалено лишних {res['removed']}" if res["removed"] else "")
+        + f"; {res['elapsed_s']:.1f} с, {res['workers']} процессов"
+    )
+    print(f"Страницы и manifest.json: {out_dir}")
+    return 0
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Голосование по нескольким ответам модели (self-consistency) для analyze_graphics_llm.py --vote K.
+
+Одна и та же страница отправляется несколько раз (ответы различаются из-за сэмплирования),
+и по каждому числовому полю графика — K, Pr, величины лога, подписи осей, максимумы кривых —
+берётся значение большинства. Числа считаются одинаковыми с точностью CROSS_CHECK_TOLERANCE
+(та же, что у сверки заголовка с логом в model_cascade.py).
+
+Ранняя остановка: запросы идут волнами, первая — из двух параллельных. Поле решено, когда его
+лидирующее значение опережает следующее на margin голосов (по умолчанию 2: два совпавших
+ответа против ни одного). Если решены все поля, страница готова. Иначе следующая волна
+запрашивает столько ответов параллельно, сколько нужно самому спорному полю, но не больше K
+всего. Поэтому согласованные страницы стоят два запроса, а спорные — до K. Если после K
+ответов голоса делятся поровну, поле остаётся за первым ответом и попадает в unresolved.
+
+В page_XXX.json пишется поле vote: число ответов и дополнительных запросов, доля согласия
+по каждому полю (голосов за итоговое значение / ответов), спорные и нерешённые поля.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from model_cascade import AXIS_FIELDS, CROSS_CHECK_TOLERANCE, RANGES
+from vision_json import get_path, set_path
+
+CURVE_FIELDS = tuple(f"graph_statistics.y_metrics_max.{c}" for c in ("red", "blue", "green"))
+FIRST_WAVE = 2
+DEFAULT_MARGIN = 2
+
+
+def vote_fields(coverage: bool, check_axes: bool = True) -> List[str]:
+    """Поля, по которым идёт голосование: K/Pr заголовка (и лога для «с покрытием»), оси, максимумы кривых."""
+    fields = [f for f in RANGES if coverage or f.startswith("header_data.")]
+    if check_axes:
+        fields += list(AXIS_FIELDS) + list(CURVE_FIELDS)
+    return fields
+
+
+def _same(a: Any, b: Any) -> bool:
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)) and not isinstance(a, bool) and not isinstance(b, bool):
+        return abs(a - b) <= CROSS_CHECK_TOLERANCE * max(abs(a), abs(b), 1.0)
+    return a == b
+
+
+def _by_id(graphs: Optional[List[Any]]) -> Dict[str, dict]:
+    return {str(g.get("graph_id")): g for g in graphs or [] if isinstance(g, dict) and g.get("graph_id") is not None}
+
+
+def tally(samples: List[Optional[List[Any]]], fields: List[str]) -> Dict[str, List[Tuple[Any, int]]]:
+    """
+    Голоса по полям «graph_id:поле»: список (значение, голосов) по убыванию голосов; при равенстве
+    впереди значение, встреченное раньше. Графики — из первого разобранного ответа.
+    """
+    parsed = [_by_id(s) for s in samples if isinstance(s, list)]
+    if not parsed:
+        return {}
+    out = {}
+    for gid in parsed[0]:
+        for field in fields:
+            clusters: List[List[Any]] = []
+            for graphs in parsed:
+                value = get_path(graphs.get(gid) or {}, field)
+                if value in (None, ""):
+                    continue
+                for c in clusters:
+                    if _same(c[0], value):
+                        c[1] += 1
+                        break
+                else:
+                    clusters.append([value, 1])
+            if clusters:
+                ordered = sorted(enumerate(clusters), key=lambda ic: (-ic[1][1], ic[0]))
+                out[f"{gid}:{field}"] = [(c[0], c[1]) for _, c in ordered]
+    return out
+
+
+def shortfall(votes: Dict[str, List[Tuple[Any, int]]], margin: int) -> int:
+    """Сколько ещё ответов нужно самому спорному полю, чтобы лидер мог оторваться на margin."""
+    need = 0
+    for clusters in votes.values():
+        lead = clusters[0][1] - (clusters[1][1] if len(clusters) > 1 else 0)
+        need = max(need, margin - lead)
+    return need
+
+
+def run_vote(
+    call: Callable[[int], dict],
+    k: int,
+    coverage: bool,
+    margin: int = DEFAULT_MARGIN,
+    check_axes: bool = True,
+) -> dict:
+    """
+    Одна страница с голосованием. call(номер ответа) → запись analyze_page; номер входит в ключ кэша,
+    так что повторный прогон берёт те же ответы. Итог — запись первого разобранного ответа
+    с подставленными значениями большинства и полем vote.
+    """
+    k = max(1, k)
+    fields = vote_fields(coverage, check_axes)
+    results: List[dict] = []
+    wave = min(FIRST_WAVE, k)
+    with ThreadPoolExecutor(max_workers=k) as pool:
+        while wave > 0:
+            start = len(results)
+            results.extend(pool.map(call, range(start, start + wave)))
+            votes = tally([r["graphs"] for r in results], fields)
+            parsed = sum(isinstance(r["graphs"], list) for r in results)
+            need = shortfall(votes, margin) if parsed else FIRST_WAVE
+            wave = min(need, k - len(results))
+
+    base = next((r for r in results if isinstance(r["graphs"], list)), results[0])
+    n = sum(isinstance(r["graphs"], list) for r in results)
+    agreement, disputed, unresolved = {}, [], []
+    targets = _by_id(base["graphs"])
+    for key, clusters in votes.items():
+        gid, field = key.split(":", 1)
+        value, count = clusters[0]
+        if len(clusters) > 1 and clusters[1][1] == count:
+            # Ничья: остаётся значение первого ответа
+            unresolved.append(key)
+        else:
+            set_path(targets[gid], field, value)
+        agreement[key] = round(count / n, 3) if n else 0.0
+        if len(clusters) > 1:
+            disputed.append(key)
+    usage = {"prompt_tokens": 0, "completion_tokens": 0}
+    for r in results:
+        for name in usage:
+            usage[name] += int((r.get("usage") or {}).get(name) or 0)
+    base["vote"] = {
+        "samples": len(results),
+        "parsed": n,
+        "extra_calls": len(results) - 1,
+        "margin": margin,
+        "agreement_rate": round(sum(agreement.values()) / len(agreement), 3) if agreement else None,
+        "agreement": agreement,
+        "disputed": disputed,
+        "unresolved": unresolved,
+        "usage": usage,
+        "cached": sum(1 for r in results if r.get("cached")),
+    }
+    return base
+
+
+def vote_summary(payloads: List[dict]) -> List[str]:
+    """Строки итога прогона: запросов на страницу, согласие, спорные страницы."""
+    votes = [p["vote"] for p in payloads if "vote" in p]
+    if not votes:
+        return []
+    samples = [v["samples"] for v in votes]
+    rates = [v["agreement_rate"] for v in votes if v["agreement_rate"] is not None]
+    by_count: Dict[int, int] = {}
+    for s in samples:
+        by_count[s] = by_count.get(s, 0) + 1
+    lines = [
+        f"Голосование: страниц {len(votes)}, ответов {sum(samples)} (в среднем {sum(samples) / len(votes):.2f} на страницу; "
+        + ", ".join(f"{n} отв. — {c} стр." for n, c in sorted(by_count.items())) + ")",
+        f"  дополнительных ответов {sum(v['extra_calls'] for v in votes)} (из кэша {sum(v['cached'] for v in votes)}), среднее согласие по полям "
+        f"{(sum(rates) / len(rates)) if rates else 0:.3f}, страниц со спорными полями {sum(1 for v in votes if v['disputed'])}, "
+        f"с нерешёнными {sum(1 for v in votes if v['unresolved'])}",
+    ]
+    return lines
+
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Контент-адресуемый кэш ответов vision API (SQLite).
+
+Ключ — sha256(байты изображения) + sha256(промпт) + модель: если PNG, промпт и модель
+не менялись, повторный прогон (--force, сравнение промптов, перепарсинг ответа
+исправленным parse_response_json) берёт сырой ответ из кэша без запроса к API.
+Хранится полный ответ API (dict) и usage. Размер ограничен, вытеснение — LRU по last_access.
+
+Статистика кэша:
+  python scripts/vision_cache.py
+  python scripts/vision_cache.py --clear
+"""
+import argparse
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+CACHE_PATH = PROJECT_ROOT / "data" / "vision_cache.sqlite"
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    image_sha256 TEXT NOT NULL,
+    prompt_sha256 TEXT NOT NULL,
+    model TEXT NOT NULL,
+    response TEXT NOT NULL,
+    usage TEXT,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_access REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS responses_lru ON responses (last_access);
+"""
+
+
+def sha256_hex(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def sha256_file(path: Path, chunk: int = 1024 * 1024) -> str:
+    """sha256 файла, прочитанного кусками (PNG целиком в память не читается)."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def cache_key(image_sha256: str, prompt: str, model: str) -> str:
+    """Ключ записи: хэш изображения, хэш промпта и модель."""
+    prompt_sha256 = sha256_hex(prompt.encode("utf-8"))
+    return f"{image_sha256}:{prompt_sha256}:{model}"
+
+
+class VisionCache:
+    """Кэш ответов API; один объект можно использовать из нескольких потоков."""
+
+    def __init__(self, path: Path = CACHE_PATH, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    def get(self, image_sha256: str, prompt: str, model: str) -> Optional[dict]:
+        """Сырой ответ API из кэша или None (промах)."""
+        key = cache_key(image_sha256, prompt, model)
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE responses SET last_access = ?, hits = hits + 1 WHERE key = ?",
+                (time.time(), key),
+            )
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, image_sha256: str, prompt: str, model: str, response: dict) -> None:
+        """Сохранить сырой ответ API и при превышении лимита вытеснить давно не читанные записи."""
+        key = cache_key(image_sha256, prompt, model)
+        body = json.dumps(response, ensure_ascii=False)
+        completion = response.get("response", response)
+        usage = completion.get("usage") or response.get("usage")
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(key, image_sha256, prompt_sha256, model, response, usage, size, created, last_access, hits) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 0)",
+                (
+                    key,
+                    image_sha256,
+                    key.split(":")[1],
+                    model,
+                    body,
+                    json.dumps(usage) if usage is not None else None,
+                    len(body.encode("utf-8")),
+                    now,
+                    now,
+                ),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        """LRU: удалять самые давно прочитанные записи, пока суммарный размер > max_bytes."""
+        if self.max_bytes <= 0:
+            return
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute("SELECT key, size FROM responses ORDER BY last_access ASC").fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            self.evictions += 1
+
+    def summary(self) -> dict:
+        with self._lock:
+            entries, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        return {
+            "entries": entries,
+            "bytes": total,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+            self._conn.execute("VACUUM")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Статистика и очистка кэша ответов vision API")
+    parser.add_argument("--path", type=str, default=str(CACHE_PATH), help="Файл кэша (по умолчанию data/vision_cache.sqlite)")
+    parser.add_argument("--clear", action="store_true", help="Удалить все записи")
+    args = parser.parse_args()
+
+    cache = VisionCache(Path(args.path))
+    if args.clear:
+        cache.clear()
+        print(f"Кэш очищен: {cache.path}")
+    s = cache.summary()
+    print(f"Кэш: {cache.path}")
+    print(f"  записей: {s['entries']}, объём: {s['bytes'] / 1024:.1f} КБ (лимит {s['max_bytes'] / 1024 / 1024:.0f} МБ)")
+    cache.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+HTTP-уровень vision-запросов: общий keep-alive пул соединений и тело запроса без копий PNG.
+
+  - http_session(): один requests.Session на процесс с пулом соединений по числу потоков
+    (configure_session(--concurrency)). TCP- и TLS-соединение открывается один раз и
+    переиспользуется, а не заново на каждую страницу;
+  - StreamedBody: тело chat completions собирается на лету — JSON промпта до и после картинки
+    и base64 PNG, кодируемый кусками при чтении файла. Целиком в памяти не бывает ни байтов PNG,
+    ни строки base64, ни готового JSON; длина известна заранее (Content-Length, без chunked).
+
+Микробенчмарк (локальный сервер, страницы 2x и 4x): python scripts/vision_payload_bench.py
+"""
+import base64
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Iterator, List, Optional, Sequence, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Кусок файла на одно кодирование; кратен 3, чтобы base64 кусков склеивался без «=» в середине
+B64_CHUNK = 3 * 16 * 1024
+IMAGE_PLACEHOLDER = "\x00image:{}\x00"
+MIME_TYPES = {".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".webp": "image/webp"}
+
+_session: Optional[requests.Session] = None
+_pool_size = 1
+_lock = threading.Lock()
+
+
+def configure_session(pool_size: int) -> None:
+    """Размер пула соединений общего Session (до первого запроса) — по числу одновременных запросов."""
+    global _pool_size
+    with _lock:
+        _pool_size = max(1, pool_size)
+
+
+def http_session() -> requests.Session:
+    """Общий для всех потоков Session с keep-alive пулом соединений."""
+    global _session
+    with _lock:
+        if _session is None:
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=_pool_size)
+            s.mount("https://", adapter)
+            s.mount("http://", adapter)
+            _session = s
+        return _session
+
+
+def b64_len(n: int) -> int:
+    return 4 * ((n + 2) // 3)
+
+
+class StreamedBody:
+    """
+    Тело запроса из кусков: bytes как есть, Path — base64 содержимого файла, кодируемый при чтении.
+    requests отправляет его потоком (есть __iter__ и __len__ → Content-Length).
+    """
+
+    def __init__(self, parts: List[Union[bytes, Path]]):
+        self.parts = parts
+        self._len = sum(len(p) if isinstance(p, bytes) else b64_len(os.path.getsize(p)) for p in parts)
+        self._chunks = self._generate()
+        self._buf = b""
+
+    def __len__(self) -> int:
+        return self._len
+
+    def _generate(self) -> Iterator[bytes]:
+        for part in self.parts:
+            if isinstance(part, bytes):
+                yield part
+                continue
+            with open(part, "rb") as f:
+                while True:
+                    raw = f.read(B64_CHUNK)
+                    if not raw:
+                        break
+                    yield base64.b64encode(raw)
+
+    def __iter__(self) -> Iterator[bytes]:
+        if self._buf:
+            yield self._buf
+            self._buf = b""
+        yield from self._chunks
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            out = self._buf + b"".join(self._chunks)
+            self._buf = b""
+            return out
+        while len(self._buf) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buf += chunk
+        out, self._buf = self._buf[:size], self._buf[size:]
+        return out
+
+
+def chat_body(model: str, prompt: str, image_paths: Sequence[Path], **extra) -> StreamedBody:
+    """
+    Тело chat completions: одно сообщение пользователя с текстом prompt и изображениями
+    (data URL; тип по расширению — PNG, JPEG или WebP из optimize_payload.py). extra — прочие
+    поля запроса (response_format, stream, …).
+    """
+    payload = {
+        "model": model,
+        "messages": [
+            {
+                "role": "user",
+                "content": [{"type": "text", "text": prompt}] + [
+                    {"type": "image_url", "image_url": {"url": f"data:{MIME_TYPES.get(Path(path).suffix.lower(), 'image/png')};base64," + IMAGE_PLACEHOLDER.format(i)}}
+                    for i, path in enumerate(image_paths)
+                ],
+            }
+        ],
+        **extra,
+    }
+    # Заглушки картинок сериализуются как "\u0000image:N\u0000" — по ним JSON режется на куски
+    text = json.dumps(payload, ensure_ascii=False)
+    parts: List[Union[bytes, Path]] = []
+    for i, path in enumerate(image_paths):
+        marker = json.dumps(IMAGE_PLACEHOLDER.format(i))[1:-1]
+        head, text = text.split(marker, 1)
+        parts.extend([head.encode("utf-8"), Path(path)])
+    parts.append(text.encode("utf-8"))
+    return StreamedBody(parts)
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+Журнал заданий vision-прогона (SQLite): состояние каждой страницы, число попыток,
+задержка последнего запроса и текст последней ошибки.
+
+Состояния: pending → in_flight → ok | parse_failed | http_failed.
+Область (scope) — каталог результатов, поэтому прогоны «без покрытия» и «с покрытием»
+ведутся независимо. Прерванный прогон продолжается с того же места: страницы в состоянии
+ok и parse_failed повторно не отправляются (если их page_XXX.json удалён — отправляются снова),
+in_flight (процесс упал посреди запроса) возвращаются в pending.
+
+Очередь для нескольких процессов (analyze_graphics_llm.py --worker): журнал служит очередью
+заданий. Процесс-исполнитель забирает страницу в аренду (claim) на lease секунд и продлевает
+аренду, пока работает (heartbeat). Аренда, не продлённая вовремя (процесс или машина упали),
+истекает, и страница возвращается в pending при следующем claim любого исполнителя. За каждой
+страницей остаётся имя последнего исполнителя, а таблица workers хранит, когда он запущен и когда
+последний раз подавал признаки жизни. По ним печатаются ход прогона и производительность исполнителей.
+
+Состояние журнала:
+  python scripts/vision_journal.py
+  python scripts/vision_journal.py --scope data/graphics_llm_coverage --failed
+Ход распределённого прогона (обновление раз в 10 с):
+  python scripts/vision_journal.py --scope data/graphics_llm_coverage --workers --watch 10
+"""
+import argparse
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+JOURNAL_PATH = PROJECT_ROOT / "data" / "vision_journal.sqlite"
+
+PENDING = "pending"
+IN_FLIGHT = "in_flight"
+OK = "ok"
+PARSE_FAILED = "parse_failed"
+HTTP_FAILED = "http_failed"
+STATES = (PENDING, IN_FLIGHT, OK, PARSE_FAILED, HTTP_FAILED)
+DONE_STATES = (OK, PARSE_FAILED)
+DEFAULT_LEASE_S = 300.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    scope TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_latency_s REAL,
+    last_error TEXT,
+    updated REAL NOT NULL,
+    worker TEXT,
+    lease_until REAL,
+    PRIMARY KEY (scope, page)
+);
+CREATE TABLE IF NOT EXISTS workers (
+    worker TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    started REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    lease_s REAL NOT NULL,
+    PRIMARY KEY (worker, scope)
+);
+"""
+# Колонки, добавленные к jobs после первой версии журнала (старые файлы дополняются при открытии)
+_ADDED_COLUMNS = (("worker", "TEXT"), ("lease_until", "REAL"))
+
+
+class JobJournal:
+    """Потокобезопасный журнал заданий поверх одного соединения SQLite."""
+
+    def __init__(self, path: Path = JOURNAL_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        for name, kind in _ADDED_COLUMNS:
+            if name not in columns:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {kind}")
+        self._conn.commit()
+
+    def enqueue(self, scope: str, pages: List[int], force: bool = False, redo: Iterable[int] = ()) -> None:
+        """
+        Поставить страницы в очередь. Новые — pending; зависшие in_flight (без аренды или с истёкшей)
+        и http_failed — снова pending; при force сбрасываются и завершённые, без force — только
+        завершённые из redo (например, их файл результата удалён). Страницы в действующей
+        аренде другого исполнителя не трогаются.
+        """
+        now = time.time()
+        redo = set(redo)
+        with self._lock:
+            for page in pages:
+                reset = (HTTP_FAILED,) + (DONE_STATES if force or page in redo else ())
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO jobs (scope, page, state, updated) VALUES (?, ?, ?, ?)",
+                    (scope, page, PENDING, now),
+                )
+                self._conn.execute(
+                    f"UPDATE jobs SET state = ?, lease_until = NULL, updated = ? WHERE scope = ? AND page = ? "
+                    f"AND (state IN ({', '.join('?' * len(reset))}) "
+                    f"OR (state = ? AND (lease_until IS NULL OR lease_until < ?)))",
+                    (PENDING, now, scope, page, *reset, IN_FLIGHT, now),
+                )
+            self._conn.commit()
+
+    def state(self, scope: str, page: int) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT state FROM jobs WHERE scope = ? AND page = ?", (scope, page)
+            ).fetchone()
+        return row[0] if row else None
+
+    def pending(self, scope: str, pages: List[int]) -> List[int]:
+        """Страницы из списка, которые ещё нужно отправить (порядок сохраняется)."""
+        with self._lock:
+            rows = self._conn.execute("SELECT page, state FROM jobs WHERE scope = ?", (scope,)).fetchall()
+        states = dict(rows)
+        return [p for p in pages if states.get(p, PENDING) == PENDING]
+
+    def start_attempt(self, scope: str, page: int) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET state = ?, attempts = attempts + 1, updated = ? WHERE scope = ? AND page = ?",
+                (IN_FLIGHT, time.time(), scope, page),
+            )
+            self._conn.commit()
+
+    def finish_attempt(
+        self, scope: str, page: int, state: str, latency_s: Optional[float], error: Optional[str] = None,
+        worker: Optional[str] = None,
+    ) -> bool:
+        """
+        Записать исход попытки. С worker — только если страница всё ещё в аренде у него
+        (False — аренда истекла и страницу забрал другой исполнитель); in_flight сохраняет аренду.
+        """
+        query = (
+            "UPDATE jobs SET state = ?, last_latency_s = ?, last_error = ?, updated = ?"
+            + ("" if state == IN_FLIGHT else ", lease_until = NULL")
+            + " WHERE scope = ? AND page = ?"
+        )
+        params: tuple = (state, latency_s, error, time.time(), scope, page)
+        if worker is not None:
+            query += " AND worker = ? AND state = ?"
+            params += (worker, IN_FLIGHT)
+        with self._lock:
+            updated = self._conn.execute(query, params).rowcount
+            self._conn.commit()
+        return updated > 0
+
+    def register_worker(self, scope: str, worker: str, lease_s: float = DEFAULT_LEASE_S) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO workers (worker, scope, started, last_seen, lease_s) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (worker, scope) DO UPDATE SET started = excluded.started, last_seen = excluded.last_seen, "
+                "lease_s = excluded.lease_s",
+                (worker, scope, now, now, lease_s),
+            )
+            self._conn.commit()
+
+    def requeue_expired(self, scope: str) -> int:
+        """Вернуть в pending страницы с истёкшей арендой; число возвращённых."""
+        now = time.time()
+        with self._lock:
+            n = self._conn.execute(
+                "UPDATE jobs SET state = ?, last_error = 'аренда истекла (' || COALESCE(worker, '?') || ')', "
+                "lease_until = NULL, updated = ? WHERE scope = ? AND state = ? AND lease_until < ?",
+                (PENDING, now, scope, IN_FLIGHT, now),
+            ).rowcount
+            self._conn.commit()
+        return n
+
+    def claim(self, scope: str, worker: str, lease_s: float = DEFAULT_LEASE_S, limit: int = 1) -> List[int]:
+        """
+        Забрать до limit страниц из pending в аренду исполнителю worker на lease_s секунд
+        (сначала возвращаются страницы с истёкшей арендой). Один оператор UPDATE — две
+        конкурирующие записи SQLite не отдадут одну страницу двум исполнителям.
+        """
+        self.requeue_expired(scope)
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                "UPDATE jobs SET state = ?, worker = ?, lease_until = ?, updated = ? "
+                "WHERE scope = ? AND page IN (SELECT page FROM jobs WHERE scope = ? AND state = ? ORDER BY page LIMIT ?) "
+                "RETURNING page",
+                (IN_FLIGHT, worker, now + lease_s, now, scope, scope, PENDING, limit),
+            ).fetchall()
+            self._conn.execute("UPDATE workers SET last_seen = ? WHERE worker = ? AND scope = ?", (now, worker, scope))
+            self._conn.commit()
+        return sorted(r[0] for r in rows)
+
+    def heartbeat(self, scope: str, worker: str, pages: Iterable[int], lease_s: float = DEFAULT_LEASE_S) -> None:
+        """Продлить аренду страниц, которые исполнитель ещё обрабатывает, и отметить, что он жив."""
+        now = time.time()
+        with self._lock:
+            for page in pages:
+                self._conn.execute(
+                    "UPDATE jobs SET lease_until = ? WHERE scope = ? AND page = ? AND worker = ? AND state = ?",
+                    (now + lease_s, scope, page, worker, IN_FLIGHT),
+                )
+            self._conn.execute("UPDATE workers SET last_seen = ? WHERE worker = ? AND scope = ?", (now, worker, scope))
+            self._conn.commit()
+
+    def worker_stats(self, scope: str, window_s: float = 600.0) -> List[dict]:
+        """
+        По исполнителям области: завершённые страницы (всего и за последние window_s секунд),
+        страницы в аренде, ошибки, средняя задержка, время последнего признака жизни
+        (alive — он был не раньше срока аренды этого исполнителя).
+        """
+        now = time.time()
+        with self._lock:
+            workers = self._conn.execute(
+                "SELECT worker, started, last_seen, lease_s FROM workers WHERE scope = ? ORDER BY started", (scope,)
+            ).fetchall()
+            rows = self._conn.execute(
+                "SELECT worker, state, updated, last_latency_s FROM jobs WHERE scope = ? AND worker IS NOT NULL", (scope,)
+            ).fetchall()
+        out = []
+        for worker, started, last_seen, lease_s in workers:
+            mine = [r for r in rows if r[0] == worker]
+            done = [r for r in mine if r[1] in DONE_STATES]
+            latencies = [r[3] for r in done if r[3]]
+            out.append({
+                "worker": worker,
+                "started": started,
+                "last_seen_s": now - last_seen,
+                "alive": now - last_seen < lease_s,
+                "done": len(done),
+                "done_recent": sum(1 for r in done if r[2] >= now - window_s),
+                "in_flight": sum(1 for r in mine if r[1] == IN_FLIGHT),
+                "failed": sum(1 for r in mine if r[1] == HTTP_FAILED),
+                "avg_latency_s": sum(latencies) / len(latencies) if latencies else None,
+                "pages_per_min": len(done) / max(last_seen - started, 1e-9) * 60 if done else 0.0,
+            })
+        return out
+
+    def counts(self, scope: str) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT state, COUNT(*) FROM jobs WHERE scope = ? GROUP BY state", (scope,)
+            ).fetchall()
+        out = {s: 0 for s in STATES}
+        out.update(dict(rows))
+        return out
+
+    def rows(self, scope: Optional[str] = None) -> List[tuple]:
+        query = "SELECT scope, page, state, attempts, last_latency_s, last_error FROM jobs"
+        params: tuple = ()
+        if scope is not None:
+            query += " WHERE scope = ?"
+            params = (scope,)
+        with self._lock:
+            return self._conn.execute(query + " ORDER BY scope, page", params).fetchall()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def scope_for(out_dir: Path) -> str:
+    """Область журнала — путь каталога результатов относительно корня проекта (если внутри него)."""
+    out_dir = Path(out_dir).resolve()
+    try:
+        return str(out_dir.relative_to(PROJECT_ROOT))
+    except ValueError:
+        return str(out_dir)
+
+
+def print_report(journal: JobJournal, scope: Optional[str], failed: bool, workers: bool, window_s: float) -> None:
+    rows = journal.rows(scope)
+    by_scope: Dict[str, List[tuple]] = {}
+    for r in rows:
+        by_scope.setdefault(r[0], []).append(r)
+    if not by_scope:
+        print("Журнал пуст.")
+    for scope, items in by_scope.items():
+        counts = {s: 0 for s in STATES}
+        for r in items:
+            counts[r[2]] = counts.get(r[2], 0) + 1
+        latencies = [r[4] for r in items if r[4] is not None]
+        avg = sum(latencies) / len(latencies) if latencies else 0.0
+        done = sum(counts[s] for s in DONE_STATES)
+        print(f"{scope}: " + ", ".join(f"{s}={n}" for s, n in counts.items()) + f"; готово {done}/{len(items)}; средняя задержка {avg:.2f} с")
+        if failed:
+            for _, page, state, attempts, latency, error in items:
+                if state in (PARSE_FAILED, HTTP_FAILED):
+                    print(f"  стр. {page}: {state}, попыток {attempts}, {error or ''}")
+        if workers:
+            stats = journal.worker_stats(scope, window_s)
+            recent = sum(w["done_recent"] for w in stats)
+            print(f"  исполнителей {len(stats)}, за последние {window_s / 60:.0f} мин: {recent} стр. ({recent / (window_s / 60):.1f} стр/мин)")
+            for w in stats:
+                avg_w = f"{w['avg_latency_s']:.1f} с" if w["avg_latency_s"] is not None else "—"
+                alive = "жив" if w["alive"] else "нет связи"
+                print(
+                    f"  {w['worker']}: готово {w['done']} ({w['pages_per_min']:.1f} стр/мин), в работе {w['in_flight']}, "
+                    f"ошибок {w['failed']}, задержка {avg_w}; последний сигнал {w['last_seen_s']:.0f} с назад ({alive})"
+                )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Состояние журнала vision-прогона и ход распределённой очереди")
+    parser.add_argument("--path", type=str, default=str(JOURNAL_PATH), help="Файл журнала (по умолчанию data/vision_journal.sqlite)")
+    parser.add_argument("--scope", type=str, default=None, help="Каталог результатов, например data/graphics_llm")
+    parser.add_argument("--failed", action="store_true", help="Показать страницы с ошибками")
+    parser.add_argument("--workers", action="store_true", help="Показать исполнителей очереди (analyze_graphics_llm.py --worker): готово, в работе, стр/мин")
+    parser.add_argument("--window", type=float, default=10.0, help="Окно для текущей производительности, мин")
+    parser.add_argument("--watch", type=float, default=0.0, help="Обновлять каждые N секунд и возвращать в очередь страницы с истёкшей арендой (Ctrl+C — выход)")
+    args = parser.parse_args()
+
+    journal = JobJournal(Path(args.path))
+    scope = scope_for(Path(args.scope)) if args.scope else None
+    try:
+        while True:
+            if args.watch > 0:
+                scopes = [scope] if scope else sorted({r[0] for r in journal.rows()})
+                requeued = sum(journal.requeue_expired(s) for s in scopes)
+                print(time.strftime("%H:%M:%S") + (f" — возвращено в очередь по истёкшей аренде: {requeued}" if requeued else ""))
+            print_report(journal, scope, args.failed, args.workers, args.window * 60)
+            if args.watch <= 0:
+                break
+            time.sleep(args.watch)
+            print()
+    except KeyboardInterrupt:
+        pass
+    journal.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
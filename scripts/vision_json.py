@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+Структурированный ответ vision-модели: JSON-схема из промпта, устойчивый разбор и дозапрос
+недостающих ключей.
+
+  - response_format: схема строится из шаблона элемента в самом промпте (PROMPT, PROMPT_COVERAGE,
+    PROMPT_PAIRED) — «<…>» в кавычках становится строкой, «<число…>» без кавычек — числом,
+    массив «[…, ...]» — массивом строк; все поля обязательны и допускают null (strict-режим).
+    Корень схемы — объект {"graphs": [...]}, так требует API;
+  - JsonArrayStream: потоковый разбор массива — элементы отдаются по мере закрытия скобок,
+    обрезанный последний элемент достраивается до последнего целого значения. Ответ с
+    обёрткой ```json, пояснениями до/после или оборванный на середине не теряется целиком;
+  - start_error: при потоковом ответе (--stream) запрос прерывается, как только видно, что
+    модель отвечает не JSON-ом: START_PROSE_LIMIT символов прозы без «[». Пояснение перед
+    массивом («Вот результат: [...]») не прерывается — parse_graphs его спасает;
+  - missing_keys: ключи шаблона, которых нет в разобранных графиках («graph_id:путь»). По ним
+    analyze_graphics_llm.py задаёт короткий дозапрос (model_cascade.focused_prompt) вместо
+    повторной отправки всей страницы.
+
+Проверка на сохранённых ответах (сколько ключей не хватает по страницам):
+  python scripts/vision_json.py --coverage
+"""
+import argparse
+import json
+import re
+from pathlib import Path
+from typing import Any, List, Optional, Tuple
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+# Ключи шаблона, которые модель по правилам промпта может не повторять во втором графике
+OPTIONAL_AFTER_FIRST = ("page_context",)
+# Столько символов прозы без «[» в начале потокового ответа — массива графиков уже не ждём
+START_PROSE_LIMIT = 300
+SCHEMA_NOTE = """
+
+Ответ — JSON-объект {"graphs": [...]} по заданной схеме: в graphs — элементы описанного выше формата."""
+
+_QUOTED_RE = re.compile(r'"<[^">]*>"')
+_BARE_RE = re.compile(r"<[^<>]*>")
+_ELLIPSIS_RE = re.compile(r",\s*\.\.\.\s*\]")
+
+
+def prompt_template(prompt: str) -> Optional[dict]:
+    """Шаблон элемента ответа из промпта: первый блок «{ … }», начинающийся и кончающийся с начала строки."""
+    start = prompt.find("\n{\n")
+    end = prompt.find("\n}\n", start) if start >= 0 else -1
+    if end < 0:
+        end = prompt.find("\n}", start) if start >= 0 else -1
+    if start < 0 or end < 0:
+        return None
+    block = prompt[start + 1:end + 2]
+    block = _ELLIPSIS_RE.sub("]", block)
+    block = _QUOTED_RE.sub('""', block)
+    block = _BARE_RE.sub("0", block)
+    try:
+        template = json.loads(block)
+    except json.JSONDecodeError:
+        return None
+    return template if isinstance(template, dict) else None
+
+
+def _schema_node(value: Any) -> dict:
+    if isinstance(value, dict):
+        return {
+            "type": "object",
+            "properties": {k: _schema_node(v) for k, v in value.items()},
+            "required": list(value),
+            "additionalProperties": False,
+        }
+    if isinstance(value, list):
+        return {"type": "array", "items": _schema_node(value[0] if value else "")}
+    if isinstance(value, (int, float)):
+        return {"type": ["number", "null"]}
+    return {"type": ["string", "null"]}
+
+
+def response_format(prompt: str, name: str = "nmr_graphs") -> Optional[dict]:
+    """Параметр response_format (json_schema, strict) для chat completions по шаблону промпта."""
+    template = prompt_template(prompt)
+    if template is None:
+        return None
+    item = _schema_node(template)
+    if "graph_id" in item["properties"]:
+        item["properties"]["graph_id"] = {"type": "integer"}
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": name,
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {"graphs": {"type": "array", "items": item}},
+                "required": ["graphs"],
+                "additionalProperties": False,
+            },
+        },
+    }
+
+
+class JsonArrayStream:
+    """
+    Потоковый разбор JSON-массива графиков: feed(кусок текста) → новые целые элементы.
+    Массив ищется после первой «[» (или после «"graphs": [» в ответе по схеме); текст до него
+    и после закрывающей скобки игнорируется.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.items: List[Any] = []
+        self.done = False
+        self._pos = 0          # до какого символа buffer уже просмотрен
+        self._start = -1       # индекс «[» массива
+        self._item_start = -1  # начало текущего элемента
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+
+    @property
+    def started(self) -> bool:
+        """Найдено ли начало массива."""
+        return self._start >= 0
+
+    def _find_array(self) -> None:
+        keyed = re.search(r'"graphs"\s*:\s*\[', self.buffer)
+        self._start = keyed.end() - 1 if keyed else self.buffer.find("[")
+        if self._start >= 0:
+            self._pos = self._start + 1
+
+    def feed(self, chunk: str) -> List[Any]:
+        self.buffer += chunk
+        if self.done:
+            return []
+        if self._start < 0:
+            self._find_array()
+            if self._start < 0:
+                return []
+        new = []
+        buf = self.buffer
+        i = self._pos
+        while i < len(buf):
+            ch = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                if not self._stack:
+                    self._item_start = i
+                self._stack.append(ch)
+            elif ch in "}]":
+                if not self._stack:
+                    # Закрылся сам массив
+                    self.done = True
+                    i += 1
+                    break
+                self._stack.pop()
+                if not self._stack:
+                    item = self._parse(buf[self._item_start:i + 1])
+                    if item is not None:
+                        new.append(item)
+                    self._item_start = -1
+            i += 1
+        self._pos = i
+        self.items.extend(new)
+        return new
+
+    @staticmethod
+    def _parse(text: str) -> Any:
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError:
+            return None
+
+    def partial(self) -> Optional[Any]:
+        """Оборванный последний элемент, достроенный до последнего целого значения (или None)."""
+        if self.done or self._item_start < 0 or not self._stack:
+            return None
+        text = self.buffer[self._item_start:self._pos]
+        # Позиции запятых вне строк и состояние скобок на каждой из них: обрезаем по запятой и закрываем скобки
+        cuts: List[Tuple[int, str]] = []
+        stack: List[str] = []
+        in_string = escape = False
+        for i, ch in enumerate(text):
+            if in_string:
+                if escape:
+                    escape = False
+                elif ch == "\\":
+                    escape = True
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"':
+                in_string = True
+            elif ch in "{[":
+                stack.append(ch)
+            elif ch in "}]":
+                if stack:
+                    stack.pop()
+            elif ch == ",":
+                cuts.append((i, "".join("}" if s == "{" else "]" for s in reversed(stack))))
+        for i, closing in reversed(cuts):
+            item = self._parse(text[:i] + closing)
+            if item is not None:
+                return item
+        return None
+
+    def finish(self) -> Optional[List[Any]]:
+        """Все разобранные элементы (с достроенным оборванным); None — массив в тексте не найден."""
+        if self._start < 0:
+            return None
+        items = list(self.items)
+        tail = self.partial()
+        if tail is not None:
+            items.append(tail)
+        return items
+
+
+def start_error(text: str) -> Optional[str]:
+    """
+    Ранняя проверка начала ответа при потоковом чтении: None — пока похоже на JSON (или ещё
+    рано судить), иначе причина прервать запрос (модель отвечает прозой, а массива всё нет).
+    """
+    head = text.lstrip()
+    if head.startswith("```"):
+        newline = head.find("\n")
+        if newline < 0:
+            return None
+        head = head[newline + 1:].lstrip()
+    if not head:
+        return None
+    if head[0] in "[{" or "[" in head or len(head) < START_PROSE_LIMIT:
+        # Пояснение перед массивом parse_graphs спасает; короткое начало ещё может им оказаться
+        return None
+    return f"ответ начинается не с JSON, {len(head)} символов без «[»: {head[:40]!r}"
+
+
+def parse_graphs(text: str) -> Optional[List[Any]]:
+    """Массив графиков из ответа модели: целый JSON, ответ по схеме {"graphs": [...]} или спасённая часть."""
+    raw = text.strip()
+    fence = re.match(r"^```(?:json)?\s*\n(.*?)(?:\n```\s*)?$", raw, re.DOTALL)
+    if fence:
+        raw = fence.group(1).strip()
+    try:
+        data = json.loads(raw)
+    except json.JSONDecodeError:
+        data = None
+    if isinstance(data, list):
+        return data
+    if isinstance(data, dict) and isinstance(data.get("graphs"), list):
+        return data["graphs"]
+    stream = JsonArrayStream()
+    stream.feed(raw)
+    items = stream.finish()
+    return items if items else None
+
+
+def _leaf_paths(template: dict, prefix: str = "") -> List[str]:
+    out = []
+    for k, v in template.items():
+        path = f"{prefix}{k}"
+        if isinstance(v, dict) and v:
+            out.extend(_leaf_paths(v, path + "."))
+        else:
+            out.append(path)
+    return out
+
+
+def get_path(d: Any, dotted: str) -> Any:
+    """Значение по пути «a.b.c» во вложенных словарях графика или None."""
+    for part in dotted.split("."):
+        if not isinstance(d, dict):
+            return None
+        d = d.get(part)
+    return d
+
+
+def set_path(d: dict, dotted: str, value: Any) -> None:
+    """Записать значение по пути «a.b.c», создавая недостающие словари."""
+    *parents, leaf = dotted.split(".")
+    for part in parents:
+        if not isinstance(d.get(part), dict):
+            d[part] = {}
+        d = d[part]
+    d[leaf] = value
+
+
+def _has(d: Any, dotted: str) -> bool:
+    for part in dotted.split("."):
+        if not isinstance(d, dict) or part not in d:
+            return False
+        d = d[part]
+    return True
+
+
+def missing_keys(graphs: Optional[List[Any]], template: Optional[dict]) -> List[str]:
+    """Ключи шаблона, которых нет в ответе («graph_id:путь»); значение null ключом считается."""
+    if not graphs or template is None:
+        return []
+    paths = [p for p in _leaf_paths(template) if p != "graph_id"]
+    out = []
+    for index, g in enumerate(graphs):
+        if not isinstance(g, dict) or g.get("graph_id") is None:
+            continue
+        for p in paths:
+            if index > 0 and p.split(".", 1)[0] in OPTIONAL_AFTER_FIRST:
+                continue
+            if not _has(g, p):
+                out.append(f"{g['graph_id']}:{p}")
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка разбора сохранённых ответов vision-модели и недостающих ключей")
+    parser.add_argument("--coverage", action="store_true", help="data/graphics_llm_coverage и PROMPT_COVERAGE")
+    parser.add_argument("--schema", action="store_true", help="Напечатать response_format для промпта и выйти")
+    args = parser.parse_args()
+
+    from analyze_graphics_llm import PROMPT, PROMPT_COVERAGE
+
+    prompt = PROMPT_COVERAGE if args.coverage else PROMPT
+    if args.schema:
+        print(json.dumps(response_format(prompt), ensure_ascii=False, indent=2))
+        return 0
+    llm_dir = PROJECT_ROOT / "data" / ("graphics_llm_coverage" if args.coverage else "graphics_llm")
+    template = prompt_template(prompt)
+    n_pages = n_parsed = n_missing_pages = n_missing = 0
+    for path in sorted(llm_dir.glob("page_*.json")):
+        with open(path, encoding="utf-8") as f:
+            content = json.load(f).get("content") or ""
+        n_pages += 1
+        graphs = parse_graphs(content)
+        if graphs is None:
+            continue
+        n_parsed += 1
+        missing = missing_keys(graphs, template)
+        n_missing_pages += bool(missing)
+        n_missing += len(missing)
+    print(f"Страниц: {n_pages}, разобрано: {n_parsed}, с недостающими ключами: {n_missing_pages} (ключей {n_missing})")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Телеметрия vision-прогонов (SQLite): каждый вызов модели — строка с размером запроса, токенами,
+задержкой, номером попытки и исходом; каждый запуск analyze_graphics_llm.py — строка прогона.
+
+Что пишется на вызов (таблица calls):
+  - run_id, время, страница, попытка (0 — первая, дальше — повторы после временных ошибок);
+  - модель и версия промпта (имя промпта с режимами и sha256 текста; короткие дозапросы — «focused»);
+  - байты тела запроса, токены промпта и ответа из usage;
+  - задержка запроса (без ожидания лимита частоты) и ожидание лимита частоты отдельно;
+  - исход: ok, parse_failed (JSON не разобран), http_429 / http_5xx…, timeout, connection,
+    stream_aborted; попадания в кэш помечены cached и в задержках не учитываются.
+
+Сводка по прогонам: p50/p95/p99 задержки, токены на страницу, пропускная способность по минутам
+и ошибки по модели и версии промпта; последние прогоны — одной таблицей для сравнения.
+  python scripts/vision_metrics.py                 # последние 10 прогонов + подробно последний
+  python scripts/vision_metrics.py --run 12        # подробно прогон 12
+"""
+import argparse
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import requests
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+METRICS_PATH = PROJECT_ROOT / "data" / "vision_metrics.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    scope TEXT NOT NULL,
+    args TEXT NOT NULL,
+    started REAL NOT NULL,
+    finished REAL
+);
+CREATE TABLE IF NOT EXISTS calls (
+    run_id INTEGER NOT NULL,
+    ts REAL NOT NULL,
+    page INTEGER,
+    attempt INTEGER NOT NULL DEFAULT 0,
+    model TEXT NOT NULL,
+    prompt_version TEXT NOT NULL,
+    cached INTEGER NOT NULL,
+    request_bytes INTEGER,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    latency_s REAL,
+    wait_s REAL,
+    outcome TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS calls_run ON calls (run_id);
+"""
+
+FOCUSED = "focused"
+
+
+def prompt_version(name: str, prompt: str) -> str:
+    """Версия промпта для сводок: имя (режимы через «+») и начало sha256 текста."""
+    return f"{name}:{hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:10]}"
+
+
+def error_outcome(e: Exception) -> str:
+    """Исход вызова, завершившегося исключением: http_<код>, timeout, connection или имя класса."""
+    if isinstance(e, requests.HTTPError) and e.response is not None:
+        return f"http_{e.response.status_code}"
+    if isinstance(e, requests.Timeout):
+        return "timeout"
+    if isinstance(e, requests.ConnectionError):
+        return "connection"
+    if type(e).__name__ == "StreamAborted":
+        return "stream_aborted"
+    return type(e).__name__
+
+
+def percentile(values: Sequence[float], q: float) -> Optional[float]:
+    """Перцентиль по ближайшему рангу (q в процентах); None для пустого списка."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * q // 100))
+    return ordered[int(rank) - 1]
+
+
+class MetricsStore:
+    """Хранилище телеметрии; один объект на процесс, потокобезопасен."""
+
+    def __init__(self, path: Path = METRICS_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    def start_run(self, scope: str, args: dict) -> int:
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT INTO runs (scope, args, started) VALUES (?, ?, ?)",
+                (scope, json.dumps(args, ensure_ascii=False, sort_keys=True), time.time()),
+            )
+            self._conn.commit()
+            return int(cur.lastrowid)
+
+    def finish_run(self, run_id: int) -> None:
+        with self._lock:
+            self._conn.execute("UPDATE runs SET finished = ? WHERE run_id = ?", (time.time(), run_id))
+            self._conn.commit()
+
+    def add_call(self, run_id: int, **fields) -> None:
+        row = {"run_id": run_id, "ts": time.time(), **fields}
+        columns = ", ".join(row)
+        with self._lock:
+            self._conn.execute(
+                f"INSERT INTO calls ({columns}) VALUES ({', '.join('?' * len(row))})", tuple(row.values())
+            )
+            self._conn.commit()
+
+    def runs(self, limit: Optional[int] = None) -> List[dict]:
+        query = "SELECT run_id, scope, args, started, finished FROM runs ORDER BY run_id DESC"
+        if limit:
+            query += f" LIMIT {int(limit)}"
+        with self._lock:
+            rows = self._conn.execute(query).fetchall()
+        return [
+            {"run_id": r[0], "scope": r[1], "args": json.loads(r[2]), "started": r[3], "finished": r[4]}
+            for r in reversed(rows)
+        ]
+
+    def calls(self, run_id: int) -> List[dict]:
+        with self._lock:
+            cur = self._conn.execute("SELECT * FROM calls WHERE run_id = ? ORDER BY ts", (run_id,))
+            names = [d[0] for d in cur.description]
+            return [dict(zip(names, r)) for r in cur.fetchall()]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class CallRecorder:
+    """
+    Запись вызовов одного прогона. Страница и номер попытки задаются в потоке задания (bind),
+    поэтому complete_request в analyze_graphics_llm.py их не принимает. Версии промптов — по тексту:
+    основной промпт прогона регистрируется в конструкторе, остальные (дозапросы) — FOCUSED.
+    """
+
+    def __init__(self, store: MetricsStore, run_id: int, prompts: Dict[str, str]):
+        self.store = store
+        self.run_id = run_id
+        self.prompts = prompts
+        self._local = threading.local()
+
+    def bind(self, page: int, attempt: int) -> None:
+        self._local.page = page
+        self._local.attempt = attempt
+
+    def record(self, model: str, prompt: str, cached: bool, outcome: str, usage: Optional[dict] = None,
+               request_bytes: Optional[int] = None, latency_s: Optional[float] = None,
+               wait_s: Optional[float] = None) -> None:
+        usage = usage or {}
+        self.store.add_call(
+            self.run_id,
+            page=getattr(self._local, "page", None),
+            attempt=getattr(self._local, "attempt", 0),
+            model=model,
+            prompt_version=self.prompts.get(prompt, FOCUSED),
+            cached=int(cached),
+            request_bytes=request_bytes,
+            prompt_tokens=usage.get("prompt_tokens"),
+            completion_tokens=usage.get("completion_tokens"),
+            latency_s=round(latency_s, 4) if latency_s is not None else None,
+            wait_s=round(wait_s, 4) if wait_s is not None else None,
+            outcome=outcome,
+        )
+
+
+def summarize(run: dict, calls: List[dict]) -> dict:
+    """Сводка прогона: задержки, токены на страницу, пропускная способность и ошибки."""
+    api = [c for c in calls if not c["cached"]]
+    latencies = [c["latency_s"] for c in api if c["latency_s"] is not None]
+    pages = {c["page"] for c in calls if c["page"] is not None}
+    tokens = sum((c["prompt_tokens"] or 0) + (c["completion_tokens"] or 0) for c in api)
+    end = run["finished"] or (calls[-1]["ts"] if calls else run["started"])
+    duration = max(end - run["started"], 1e-9)
+    per_minute: Dict[int, int] = {}
+    for c in api:
+        minute = int((c["ts"] - run["started"]) // 60)
+        per_minute[minute] = per_minute.get(minute, 0) + 1
+    groups: Dict[tuple, dict] = {}
+    for c in calls:
+        g = groups.setdefault((c["model"], c["prompt_version"]), {"calls": 0, "cached": 0, "retries": 0, "outcomes": {}})
+        g["calls"] += 1
+        g["cached"] += c["cached"]
+        g["retries"] += int(c["attempt"] > 0)
+        g["outcomes"][c["outcome"]] = g["outcomes"].get(c["outcome"], 0) + 1
+    return {
+        "run_id": run["run_id"],
+        "scope": run["scope"],
+        "started": run["started"],
+        "duration_s": duration,
+        "calls": len(api),
+        "cached": len(calls) - len(api),
+        "pages": len(pages),
+        "errors": sum(1 for c in api if c["outcome"] not in ("ok", "parse_failed")),
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "tokens_per_page": tokens / len(pages) if pages else None,
+        "request_mb": sum(c["request_bytes"] or 0 for c in api) / 1024 / 1024,
+        "calls_per_min": len(api) / duration * 60,
+        "per_minute": [per_minute.get(m, 0) for m in range(max(per_minute) + 1)] if per_minute else [],
+        "groups": groups,
+    }
+
+
+def _s(value: Optional[float]) -> str:
+    return f"{value:.2f}" if value is not None else "—"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сводка телеметрии vision-прогонов: задержки, токены, пропускная способность, ошибки")
+    parser.add_argument("--path", type=str, default=str(METRICS_PATH), help="Файл телеметрии (по умолчанию data/vision_metrics.sqlite)")
+    parser.add_argument("--runs", type=int, default=10, help="Сколько последних прогонов показать в таблице")
+    parser.add_argument("--run", type=int, default=None, help="Подробно показать этот прогон (по умолчанию — последний)")
+    parser.add_argument("--json", action="store_true", help="Вывести сводки в JSON")
+    args = parser.parse_args()
+
+    if not Path(args.path).exists():
+        print(f"Нет {args.path}: телеметрия пишется при запуске analyze_graphics_llm.py")
+        return 1
+    store = MetricsStore(Path(args.path))
+    runs = store.runs(args.runs)
+    if not runs:
+        print("Прогонов нет.")
+        store.close()
+        return 0
+    summaries = [summarize(r, store.calls(r["run_id"])) for r in runs]
+    detail_id = args.run if args.run is not None else runs[-1]["run_id"]
+    detail = next((s for s in summaries if s["run_id"] == detail_id), None)
+    if detail is None:
+        run = next((r for r in store.runs() if r["run_id"] == detail_id), None)
+        if run is None:
+            print(f"Прогона {detail_id} нет.")
+            store.close()
+            return 1
+        detail = summarize(run, store.calls(detail_id))
+    store.close()
+
+    if args.json:
+        print(json.dumps({"runs": summaries, "detail": detail}, ensure_ascii=False, indent=2, default=str))
+        return 0
+    print(f"{'прогон':>6}  {'начат':<16} {'каталог':<28} {'вызовов':>7} {'кэш':>5} {'ошибок':>6} {'p50, с':>7} {'p95, с':>7} {'p99, с':>7} {'ток/стр':>8} {'выз/мин':>8}")
+    for s in summaries:
+        started = time.strftime("%Y-%m-%d %H:%M", time.localtime(s["started"]))
+        tpp = f"{s['tokens_per_page']:.0f}" if s["tokens_per_page"] is not None else "—"
+        print(
+            f"{s['run_id']:>6}  {started:<16} {s['scope'][-28:]:<28} {s['calls']:>7} {s['cached']:>5} {s['errors']:>6} "
+            f"{_s(s['p50']):>7} {_s(s['p95']):>7} {_s(s['p99']):>7} {tpp:>8} {s['calls_per_min']:>8.1f}"
+        )
+    print()
+    print(f"Прогон {detail['run_id']} ({detail['scope']}): страниц {detail['pages']}, вызовов API {detail['calls']}, из кэша {detail['cached']}, "
+          f"отправлено {detail['request_mb']:.1f} МБ за {detail['duration_s']:.0f} с")
+    if detail["per_minute"]:
+        print("  вызовов по минутам: " + " ".join(str(n) for n in detail["per_minute"]))
+    for (model, version), g in sorted(detail["groups"].items()):
+        outcomes = ", ".join(f"{k}={v}" for k, v in sorted(g["outcomes"].items(), key=lambda kv: -kv[1]))
+        print(f"  {model} / {version}: вызовов {g['calls']} (из кэша {g['cached']}, повторов {g['retries']}); {outcomes}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарк отправки страницы в vision API: накладные расходы на запрос и пик памяти.
+
+Сравниваются два способа на локальном HTTP/1.1-сервере (keep-alive, тело читается и
+отбрасывается, ответ — короткий JSON), поэтому измеряется только клиентская сторона:
+  - «было»: requests.post на каждый запрос (новое соединение), PNG читается целиком,
+    base64-строка вставляется в dict и сериализуется в JSON (json=payload);
+  - «стало»: общий Session с пулом соединений (vision_http.http_session) и потоковое тело
+    vision_http.chat_body — base64 кодируется кусками при отправке.
+
+Страницы 2x и 4x: если есть PDF, страница рендерится с zoom 2 и 4 (как extract_graphics_pages.py);
+иначе берётся готовый page_XXX.png (он в 2x), а 4x получается увеличением вдвое.
+Пик памяти — tracemalloc (выделения Python) на один запрос. Соединения по TLS к реальному
+API дороже локальных TCP, так что выигрыш пула там больше, чем здесь.
+
+Пример запуска:
+  python scripts/vision_payload_bench.py --page 1 --requests 20
+"""
+import argparse
+import base64
+import http.server
+import socket
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+import requests
+
+from analyze_graphics_llm import PROMPT
+from vision_http import chat_body, http_session
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+PDF_WITHOUT = PROJECT_ROOT / "graphics_without_coverage.pdf"
+PAGES_DIR = PROJECT_ROOT / "data" / "graphics_pages"
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = 0
+
+    def setup(self):
+        super().setup()
+        # Заголовки и тело ответа уходят отдельными записями: без TCP_NODELAY keep-alive-соединение
+        # ждало бы отложенного ACK клиента (~40 мс) — это артефакт сервера, а не клиента
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        type(self).connections += 1
+
+    def do_POST(self):
+        left = int(self.headers.get("content-length") or 0)
+        while left > 0:
+            left -= len(self.rfile.read(min(left, 1 << 16)))
+        body = b'{"choices": [{"message": {"content": "[]"}}]}'
+        self.send_response(200)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def page_images(page: int, out_dir: Path) -> dict:
+    """PNG страницы в 2x и 4x: {"2x": path, "4x": path}."""
+    out = {}
+    if PDF_WITHOUT.exists():
+        import fitz  # PyMuPDF
+
+        with fitz.open(PDF_WITHOUT) as doc:
+            for zoom in (2, 4):
+                path = out_dir / f"page_{page:03d}_{zoom}x.png"
+                doc[page - 1].get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False).save(str(path))
+                out[f"{zoom}x"] = path
+        return out
+    from PIL import Image
+
+    src = PAGES_DIR / f"page_{page:03d}.png"
+    out["2x"] = src
+    with Image.open(src) as im:
+        path = out_dir / f"page_{page:03d}_4x.png"
+        im.convert("RGB").resize((im.width * 2, im.height * 2), Image.BICUBIC).save(path)
+        out["4x"] = path
+    return out
+
+
+def send_old(url: str, path: Path) -> None:
+    with open(path, "rb") as f:
+        b64 = base64.b64encode(f.read()).decode("ascii")
+    payload = {
+        "model": "bench",
+        "messages": [{"role": "user", "content": [
+            {"type": "text", "text": PROMPT},
+            {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{b64}"}},
+        ]}],
+    }
+    requests.post(url, json=payload, timeout=60).raise_for_status()
+
+
+def send_new(url: str, path: Path) -> None:
+    body = chat_body("bench", PROMPT, [path])
+    http_session().post(url, data=body, headers={"content-type": "application/json"}, timeout=60).raise_for_status()
+
+
+def measure(send, url: str, path: Path, n: int) -> dict:
+    send(url, path)  # прогрев (для пула — открыть соединение)
+    before = _Handler.connections
+    t0 = time.perf_counter()
+    for _ in range(n):
+        send(url, path)
+    per_request = (time.perf_counter() - t0) / n
+    connections = _Handler.connections - before
+    tracemalloc.start()
+    send(url, path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"ms": per_request * 1000, "peak_mb": peak / 1024 / 1024, "connections": connections}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Накладные расходы и пик памяти на vision-запрос: requests.post + base64 против пула и потокового тела")
+    parser.add_argument("--page", type=int, default=1, help="Номер страницы")
+    parser.add_argument("--requests", type=int, default=20, help="Запросов на каждый вариант")
+    args = parser.parse_args()
+
+    if not PDF_WITHOUT.exists() and not (PAGES_DIR / f"page_{args.page:03d}.png").exists():
+        print(f"Нет ни {PDF_WITHOUT.name}, ни {PAGES_DIR / f'page_{args.page:03d}.png'}", file=sys.stderr)
+        return 1
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        images = page_images(args.page, Path(tmp))
+        print(f"Страница {args.page}, запросов на вариант: {args.requests}")
+        print(f"{'PNG':>4} {'размер':>9}  {'вариант':<22} {'мс/запрос':>10} {'пик, МБ':>8} {'соединений':>10}")
+        for zoom, path in images.items():
+            size_mb = path.stat().st_size / 1024 / 1024
+            for name, send in (("requests.post + base64", send_old), ("Session + поток", send_new)):
+                r = measure(send, url, path, args.requests)
+                print(f"{zoom:>4} {size_mb:>6.2f} МБ  {name:<22} {r['ms']:>10.2f} {r['peak_mb']:>8.2f} {r['connections']:>10}")
+    server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,471 @@
+#!/usr/bin/env python3
+"""
+Локальная заглушка vision API (chat completions) для нагрузочных и регрессионных прогонов
+без внешнего endpoint: analyze_graphics_llm.py --api-url http://127.0.0.1:PORT/v1/chat/completions
+(api_example.py — через ELIZA_API_URL).
+
+Ответ на запрос:
+  - воспроизведение: сначала кэш ответов (data/vision_cache.sqlite, тот же ключ, что у
+    analyze_graphics_llm.py), затем сохранённые ответы data/graphics_llm*/page_XXX.json — страница
+    находится по sha256 изображения среди data/graphics_pages* и облегчённых data/graphics_payload*.
+    Сохранённые ответы отдаются только на полный промпт (PROMPT, PROMPT_COVERAGE, PROMPT_PAIRED);
+  - синтез: JSON по response_format запроса или по шаблону элемента в промпте (в том числе
+    компактному), а для короткого дозапроса — по списку полей. Значения правдоподобны
+    (K в [0.2, 0.6], K и Pr лога равны заголовку) и зависят только от изображения, поэтому
+    одна страница всегда даёт один ответ; --noise портит цифры части чисел (для --vote).
+
+Нагрузка: задержка = время до первого токена (--latency: const:S, uniform:A,B или
+lognormal:MEDIAN,SIGMA) + --ms-per-token на каждый токен ответа; поток (stream=true) отдаётся
+кусками в течение этого времени. Ошибки: --p429 и --p5xx — доли запросов, --max-inflight —
+429, если одновременно больше запросов. Токены считаются приближённо (символы / CHARS_PER_TOKEN
+и плитки изображения по правилу high detail) и отдаются в usage.
+
+Счётчики (запросы по статусам и источникам ответа, токены по моделям, максимум одновременных
+запросов): GET /stats, итог печатается при остановке (Ctrl+C).
+
+Пример запуска:
+  python scripts/vision_stub_server.py --port 8799 --latency lognormal:2,0.5 --p429 0.05 --max-inflight 8
+"""
+import argparse
+import base64
+import http.server
+import io
+import json
+import math
+import random
+import re
+import socket
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from optimize_payload import image_tokens
+from vision_cache import CACHE_PATH, VisionCache, sha256_file, sha256_hex
+from vision_json import prompt_template
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+DATA_DIR = PROJECT_ROOT / "data"
+
+CHARS_PER_TOKEN = 3.0     # смешанный русский текст и JSON
+DEFAULT_IMAGE_TOKENS = 765
+STREAM_CHUNK_TOKENS = 8
+# Поля, у которых в ответе одно и то же значение (K и Pr заголовка и лога, полные и короткие ключи)
+ALIASES = {
+    "K": "crystallinity_index",
+    "lK": "crystallinity_index",
+    "calculated_crystallinity_index": "crystallinity_index",
+    "Pr": "proton_density",
+    "lPr": "proton_density",
+    "calculated_proton_density": "proton_density",
+}
+NUMBER_RANGES = {
+    "crystallinity_index": (0.2, 0.6, 3),
+    "proton_density": (0.5, 3.0, 3),
+    "visible_min": (0, 0, 0),
+    "y0": (0, 0, 0),
+    "x0": (0, 0, 0),
+    "visible_max": (100, 4000, 0),
+    "y1": (100, 120, 0),
+    "x1": (1000, 4000, 0),
+}
+_FOCUS_LINE = re.compile(r"^- график (\S+): ([\w.]+)", re.MULTILINE)
+_DATA_URL = re.compile(r"^data:image/[\w.+-]+;base64,")
+
+
+def approx_tokens(text: str) -> int:
+    return max(1, math.ceil(len(text) / CHARS_PER_TOKEN)) if text else 0
+
+
+class Latency:
+    """Распределение задержки до первого токена: const:S, uniform:A,B, lognormal:MEDIAN,SIGMA (секунды)."""
+
+    def __init__(self, spec: str, rng: random.Random):
+        kind, _, params = spec.partition(":")
+        self.kind = kind
+        self.params = [float(x) for x in params.split(",") if x]
+        self.rng = rng
+        expected = {"const": 1, "uniform": 2, "lognormal": 2}
+        if kind not in expected or len(self.params) != expected[kind]:
+            raise ValueError(f"задержка: const:S, uniform:A,B или lognormal:MEDIAN,SIGMA, получено {spec!r}")
+
+    def sample(self) -> float:
+        if self.kind == "const":
+            return self.params[0]
+        if self.kind == "uniform":
+            return self.rng.uniform(*self.params)
+        median, sigma = self.params
+        return self.rng.lognormvariate(math.log(max(median, 1e-6)), sigma)
+
+
+class ReplayIndex:
+    """Сохранённые ответы по sha256 изображений: одно изображение — страница, два — парный режим."""
+
+    def __init__(self, data_dir: Path = DATA_DIR):
+        self.content: Dict[Tuple[str, ...], str] = {}
+        pages: Dict[Tuple[str, int], List[str]] = {}
+        for suffix in ("", "_coverage"):
+            llm_dir = data_dir / f"graphics_llm{suffix}"
+            for image_dir in (data_dir / f"graphics_pages{suffix}", data_dir / f"graphics_payload{suffix}"):
+                for path in sorted(image_dir.glob("page_*.*")):
+                    if path.suffix not in (".png", ".jpg", ".webp") or not path.stem[5:].isdigit():
+                        continue
+                    page = int(path.stem[5:])
+                    digest = sha256_file(path)
+                    pages.setdefault((suffix, page), []).append(digest)
+                    saved = self._load(llm_dir / f"page_{page:03d}.json")
+                    if saved is not None:
+                        self.content[(digest,)] = saved
+        for (suffix, page), digests in pages.items():
+            saved = self._load(data_dir / "graphics_llm_paired" / f"page_{page:03d}.json") if suffix == "" else None
+            if saved is None:
+                continue
+            for a in digests:
+                for b in pages.get(("_coverage", page), []):
+                    self.content[(a, b)] = saved
+
+    @staticmethod
+    def _load(path: Path) -> Optional[str]:
+        if not path.exists():
+            return None
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (json.JSONDecodeError, OSError):
+            return None
+        return data.get("content") or None
+
+    def get(self, digests: Tuple[str, ...]) -> Optional[str]:
+        return self.content.get(digests)
+
+
+class StubState:
+    """Настройки заглушки, источники ответов и счётчики; общий для потоков сервера."""
+
+    def __init__(self, args: argparse.Namespace):
+        self.rng = random.Random(args.seed)
+        self.latency = Latency(args.latency, self.rng)
+        self.ms_per_token = args.ms_per_token
+        self.p429 = args.p429
+        self.p5xx = args.p5xx
+        self.max_inflight = args.max_inflight
+        self.retry_after = args.retry_after
+        self.noise = args.noise
+        self.replay = not args.no_replay
+        self.cache = VisionCache(Path(args.cache_path)) if self.replay and Path(args.cache_path).exists() else None
+        self.index = ReplayIndex() if self.replay else None
+        self.full_prompts = set()
+        if self.replay:
+            from analyze_graphics_llm import PROMPT, PROMPT_COVERAGE, PROMPT_PAIRED
+
+            self.full_prompts = {PROMPT, PROMPT_COVERAGE, PROMPT_PAIRED}
+        self._lock = threading.Lock()
+        self.inflight = 0
+        self.stats: Dict[str, Any] = {"requests": 0, "status": {}, "source": {}, "max_inflight": 0, "models": {}}
+
+    def enter(self) -> bool:
+        """Начать запрос; False — превышен --max-inflight."""
+        with self._lock:
+            self.stats["requests"] += 1
+            if self.max_inflight and self.inflight >= self.max_inflight:
+                return False
+            self.inflight += 1
+            self.stats["max_inflight"] = max(self.stats["max_inflight"], self.inflight)
+            return True
+
+    def leave(self) -> None:
+        with self._lock:
+            self.inflight -= 1
+
+    def count(self, status: int, source: Optional[str] = None, model: Optional[str] = None,
+              usage: Optional[dict] = None) -> None:
+        with self._lock:
+            self.stats["status"][str(status)] = self.stats["status"].get(str(status), 0) + 1
+            if source:
+                self.stats["source"][source] = self.stats["source"].get(source, 0) + 1
+            if model and usage:
+                m = self.stats["models"].setdefault(model, {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0})
+                m["requests"] += 1
+                m["prompt_tokens"] += usage["prompt_tokens"]
+                m["completion_tokens"] += usage["completion_tokens"]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return json.loads(json.dumps(dict(self.stats, inflight=self.inflight)))
+
+    def roll_error(self) -> Optional[int]:
+        with self._lock:
+            x = self.rng.random()
+            if x < self.p429:
+                return 429
+            if x < self.p429 + self.p5xx:
+                return self.rng.choice((500, 502, 503))
+        return None
+
+
+def _value(name: str, kind: str, seed: str, gid: int, noise: float) -> Any:
+    """Синтетическое значение листового поля: одно и то же для одного изображения, графика и поля."""
+    if name in ("graph_id", "id"):
+        return gid
+    if kind == "array":
+        return []
+    if kind == "string":
+        return ""
+    canonical = ALIASES.get(name, name)
+    rng = random.Random(f"{seed}:{gid}:{canonical}")
+    lo, hi, digits = NUMBER_RANGES.get(canonical, (1, 100, 2))
+    value = round(rng.uniform(lo, hi), digits) if hi > lo else lo
+    if noise and random.random() < noise and value:
+        # Ошибка чтения одной цифры
+        value = round(value * random.choice((0.9, 1.1)), digits)
+    return int(value) if digits == 0 else value
+
+
+def synth_from_schema(schema: dict, seed: str, gid: int, noise: float, name: str = "") -> Any:
+    kind = schema.get("type")
+    if isinstance(kind, list):
+        kind = next((k for k in kind if k != "null"), "null")
+    if kind == "object":
+        return {k: synth_from_schema(v, seed, gid, noise, k) for k, v in (schema.get("properties") or {}).items()}
+    if kind in ("number", "integer"):
+        return _value(name, "number", seed, gid, noise)
+    return _value(name, "array" if kind == "array" else "string", seed, gid, noise)
+
+
+def synth_from_template(template: Any, seed: str, gid: int, noise: float, name: str = "") -> Any:
+    if isinstance(template, dict):
+        return {k: synth_from_template(v, seed, gid, noise, k) for k, v in template.items()}
+    if isinstance(template, list):
+        return _value(name, "array", seed, gid, noise)
+    if isinstance(template, (int, float)):
+        return _value(name, "number", seed, gid, noise)
+    return _value(name, "string", seed, gid, noise)
+
+
+def _nested(dotted: str, value: Any) -> dict:
+    out: Any = value
+    for part in reversed(dotted.split(".")):
+        out = {part: out}
+    return out
+
+
+def _merge(a: dict, b: dict) -> dict:
+    for k, v in b.items():
+        if isinstance(v, dict) and isinstance(a.get(k), dict):
+            _merge(a[k], v)
+        else:
+            a[k] = v
+    return a
+
+
+def synthesize(prompt: str, response_format: Optional[dict], seed: str, noise: float) -> str:
+    """Ответ без сохранённого: по схеме, по шаблону промпта или по списку полей дозапроса; иначе []."""
+    n_graphs = 1 + int(seed[-1], 16) % 2
+    if response_format and response_format.get("type") == "json_schema":
+        root = response_format["json_schema"]["schema"]
+        item = root["properties"]["graphs"]["items"]
+        graphs = [synth_from_schema(item, seed, gid, noise) for gid in range(1, n_graphs + 1)]
+        return json.dumps({"graphs": graphs}, ensure_ascii=False)
+    template = prompt_template(prompt)
+    if template is not None:
+        graphs = [synth_from_template(template, seed, gid, noise) for gid in range(1, n_graphs + 1)]
+        return json.dumps(graphs, ensure_ascii=False)
+    focus = _FOCUS_LINE.findall(prompt)
+    if focus:
+        by_gid: Dict[str, dict] = {}
+        for gid, field in focus:
+            g = by_gid.setdefault(gid, {"graph_id": int(gid) if gid.isdigit() else gid})
+            value = _value(field.rsplit(".", 1)[-1], "number", seed, int(gid) if gid.isdigit() else 1, noise)
+            _merge(g, _nested(field, value))
+        return json.dumps(list(by_gid.values()), ensure_ascii=False)
+    return "[]"
+
+
+def _image_tokens(raw: bytes) -> int:
+    try:
+        from PIL import Image
+    except ImportError:
+        return DEFAULT_IMAGE_TOKENS
+    try:
+        with Image.open(io.BytesIO(raw)) as im:
+            return image_tokens(*im.size)
+    except OSError:
+        return DEFAULT_IMAGE_TOKENS
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state: StubState = None  # задаётся в main
+
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict, headers: Optional[Dict[str, str]] = None) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            self._send_json(200, self.state.snapshot())
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        state = self.state
+        request = json.loads(self.rfile.read(int(self.headers.get("content-length") or 0)) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            state.count(404)
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+        if not state.enter():
+            state.count(429, "max_inflight")
+            self._send_json(429, {"error": {"message": "too many concurrent requests"}}, {"retry-after": f"{state.retry_after:g}"})
+            return
+        try:
+            self._complete(request)
+        finally:
+            state.leave()
+
+    def _complete(self, request: dict) -> None:
+        state = self.state
+        model = request.get("model") or "stub"
+        texts, images = [], []
+        for message in request.get("messages") or []:
+            content = message.get("content")
+            for part in content if isinstance(content, list) else [{"type": "text", "text": content or ""}]:
+                if part.get("type") == "text":
+                    texts.append(part.get("text") or "")
+                elif part.get("type") == "image_url":
+                    url = (part.get("image_url") or {}).get("url") or ""
+                    images.append(base64.b64decode(_DATA_URL.sub("", url)) if _DATA_URL.match(url) else url.encode("utf-8"))
+        prompt = "\n".join(texts)
+        digests = tuple(sha256_hex(raw) for raw in images)
+        first_token_s = state.latency.sample()
+
+        error = state.roll_error()
+        if error is not None:
+            time.sleep(first_token_s)
+            state.count(error, "injected")
+            headers = {"retry-after": f"{state.retry_after:g}"} if error == 429 else None
+            self._send_json(error, {"error": {"message": f"injected {error}"}}, headers)
+            return
+
+        schema = request.get("response_format")
+        content, source = None, "synth"
+        if state.cache is not None and len(digests) == 1:
+            cache_prompt = prompt if schema is None else prompt + "\n" + json.dumps(schema, sort_keys=True)
+            cached = state.cache.get(digests[0], cache_prompt, model)
+            if cached is not None:
+                cached = cached.get("response", cached)
+                content, source = cached["choices"][0]["message"]["content"], "cache"
+        if content is None and state.index is not None and prompt in state.full_prompts:
+            saved = state.index.get(digests)
+            if saved is not None:
+                content, source = saved, "saved"
+        if content is None:
+            seed = sha256_hex("".join(digests).encode("ascii") or prompt.encode("utf-8"))
+            content = synthesize(prompt, schema, seed, state.noise)
+
+        usage = {
+            "prompt_tokens": approx_tokens(prompt) + sum(_image_tokens(raw) for raw in images),
+            "completion_tokens": approx_tokens(content),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        generation_s = usage["completion_tokens"] * state.ms_per_token / 1000
+        state.count(200, source, model, usage)
+        if request.get("stream"):
+            self._stream(model, content, usage, first_token_s, generation_s, bool((request.get("stream_options") or {}).get("include_usage")))
+            return
+        time.sleep(first_token_s + generation_s)
+        self._send_json(200, {
+            "id": f"stub-{digests[0][:12] if digests else 'text'}",
+            "object": "chat.completion",
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage,
+        })
+
+    def _stream(self, model: str, content: str, usage: dict, first_token_s: float, generation_s: float, include_usage: bool) -> None:
+        self.send_response(200)
+        self.send_header("content-type", "text/event-stream")
+        self.send_header("cache-control", "no-cache")
+        self.send_header("connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        time.sleep(first_token_s)
+        step = max(1, int(STREAM_CHUNK_TOKENS * CHARS_PER_TOKEN))
+        chunks = [content[i:i + step] for i in range(0, len(content), step)] or [""]
+        pause = generation_s / len(chunks)
+        try:
+            for piece in chunks:
+                event = {"object": "chat.completion.chunk", "model": model, "choices": [{"index": 0, "delta": {"content": piece}}]}
+                self.wfile.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+                time.sleep(pause)
+            if include_usage:
+                event = {"object": "chat.completion.chunk", "model": model, "choices": [], "usage": usage}
+                self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # Клиент прервал поток (например, ранняя остановка по не-JSON началу)
+            pass
+
+
+def print_stats(stats: dict) -> None:
+    print(f"Запросов: {stats['requests']}, по статусам: " + ", ".join(f"{k}={v}" for k, v in sorted(stats["status"].items())))
+    print("Источник ответа: " + (", ".join(f"{k}={v}" for k, v in sorted(stats["source"].items())) or "—")
+          + f"; максимум одновременных запросов: {stats['max_inflight']}")
+    for model, m in sorted(stats["models"].items()):
+        print(f"  {model}: запросов {m['requests']}, токенов {m['prompt_tokens']} + {m['completion_tokens']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальная заглушка chat completions для нагрузочных прогонов vision-конвейера")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8799)
+    parser.add_argument("--latency", type=str, default="lognormal:1.5,0.4", help="Задержка до первого токена: const:S, uniform:A,B или lognormal:MEDIAN,SIGMA (с)")
+    parser.add_argument("--ms-per-token", type=float, default=15.0, help="Время генерации на токен ответа, мс")
+    parser.add_argument("--p429", type=float, default=0.0, help="Доля запросов с ответом 429")
+    parser.add_argument("--p5xx", type=float, default=0.0, help="Доля запросов с ответом 500/502/503")
+    parser.add_argument("--max-inflight", type=int, default=0, help="Больше одновременных запросов — 429 (0 — без лимита)")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Заголовок Retry-After у 429, с")
+    parser.add_argument("--noise", type=float, default=0.0, help="Доля синтетических чисел с ошибкой в цифре")
+    parser.add_argument("--no-replay", action="store_true", help="Только синтетические ответы (без кэша и сохранённых ответов)")
+    parser.add_argument("--cache-path", type=str, default=str(CACHE_PATH), help="Кэш ответов для воспроизведения")
+    parser.add_argument("--seed", type=int, default=None, help="Зерно генератора задержек и ошибок")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    try:
+        state = StubState(args)
+    except ValueError as e:
+        parser.error(str(e))
+    StubHandler.state = state
+    server = http.server.ThreadingHTTPServer((args.host, args.port), StubHandler)
+    server.daemon_threads = True
+    n_saved = len(state.index.content) if state.index is not None else 0
+    print(f"Заглушка: http://{args.host}:{args.port}/v1/chat/completions (счётчики — /stats); "
+          f"сохранённых ответов {n_saved}, кэш {'есть' if state.cache is not None else 'нет'}; готово за {time.perf_counter() - t0:.1f} с", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    print_stats(state.snapshot())
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())